@@ -46,12 +46,20 @@ Part6: 气象上常见评分函数
     ACC()          计算准确度Accuracy: (TP + TN) / (TP + TN + FP + FN)
     FSC()        计算f1 score = 2 * ((precision * recall) / (precision + recall))
     TS()         计算TS评分: TS = hits/(hits + falsealarms + misses)  
+    ETS()        计算ETS评分(公平技巧评分)
+    HSS()        计算HSS评分(Heidke技巧评分)
+    BIAS()       计算频率偏差 (hits + falsealarms)/(hits + misses)
+    multi_threshold_clf()  一次排序，得到任意多个阈值下混淆矩阵的四个元素
+    clf_scores()           由混淆矩阵的四个元素计算所有评分(Acc/Recall/Precision/F1/TS/MAR/FAR/ETS/HSS/BIAS)
+    multi_threshold_scores() 多个阈值下的混淆矩阵和所有评分, 返回pd.DataFrame
     multil_scores()  输入某个阈值下，输出该阈值下预报相对观测的评分（以直接打印的方式） 
     plot_multi_scores() 即画出不同阈值情况下的 模型预测对比实况的 Acc/Recall/Precision/F1/TS/MAR/FAR 的评分情况
+    以上评分函数都可以传入 mask(有效样本的bool数组)；obs或pre为nan的样本(缺测站点)不参与计算
 
 
 Part7: 数据分析 
     drop_outlier() 处理离群值
+    drop_outlier_batch() 批量处理离群值: 对 (time × ny × nx) 或 (time × station) 的数据，一次计算每个时刻的异常阈值并修正，同时返回QC标记
 
 
 '''
@@ -59,27 +67,30 @@ Part7: 数据分析
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.interpolate import griddata
 import os
-from mpl_toolkits.basemap import Basemap
 import numpy.ma as ma
 import datetime
 import time
-import netCDF4 as nc
-import h5py
-import matplotlib
 import scipy 
-from scipy.interpolate import griddata
+#绘图、netCDF、HDF5 和 scipy.interpolate 在第一次使用时才导入(见Lazy_import.py)，不画图的脚本和子进程启动更快
+from Lazy_import import LazyModule, LazyAttr, set_chinese_font
+plt = LazyModule('matplotlib.pyplot', on_import = set_chinese_font)
+matplotlib = LazyModule('matplotlib', on_import = set_chinese_font)
+Basemap = LazyAttr('mpl_toolkits.basemap', 'Basemap')
+griddata = LazyAttr('scipy.interpolate', 'griddata')
+nc = LazyModule('netCDF4')
+h5py = LazyModule('h5py')
+from EC_feature_spec import get_EC_feature_kernel
+from Map_utils import block_reduce, quicklook_factor, decimate_grid
+from Station_catalog import StationCatalog
+import Perf_utils as perf
 # import cartopy
 
-plt.rcParams['font.sans-serif']=['SimHei'] #用来正常显示中文标签
-plt.rcParams['axes.unicode_minus']=False #用来正常显示负号
-
 
 #%%
 #########################Part1: 基本数据的读取 #################################
 
+@perf.timed()
 def read_micaps_data(filename):
     '''
     func: 读micaps类型的数据，将其变为list 
@@ -88,6 +99,7 @@ def read_micaps_data(filename):
     return:
         data：由多个List组成，其中每行为一个子list。 
     '''
+    perf.count_file(filename)
     f=open(filename,mode='r')
     
     #此时每行的都为 字符格式
@@ -122,6 +134,7 @@ def read_micaps_data(filename):
 
 
 ###############################################################################
+@perf.timed()
 def get_station_data(filename,file_type = 'r6-p',loc_range = [18,54,73,135]):
     
     '''
@@ -146,6 +159,7 @@ def get_station_data(filename,file_type = 'r6-p',loc_range = [18,54,73,135]):
         
     ''' 
     
+    perf.count_file(filename)
     f=open(filename,mode='r')
     
     #此时每行的都为 字符格式
@@ -220,6 +234,7 @@ def get_station_data(filename,file_type = 'r6-p',loc_range = [18,54,73,135]):
 
 
 ###############################################################################
+@perf.timed()
 def get_jiami_obs(abs_file, filetype = 'pd', sort = True):
     '''
     func: 读取逐小时的观测资料
@@ -240,15 +255,15 @@ def get_jiami_obs(abs_file, filetype = 'pd', sort = True):
          '小时降水量', 'C2分钟风向', 'C2分钟平均风速', '最大风速的风向', '最大风速']
         
     '''
+    perf.count_file(abs_file)
     #由于abs_file里含有中文，不同平台的默认编码方式不同，可能会出错
+    #(解码错误在读取时才出现，因此读取也要放在try中)
     try:
-        f = open(abs_file,'r')
-    except Exception as e:
-        f = open(abs_file,'r',encoding = 'GBK')
-        
-    #读取所有行
-    str_data = f.readlines()  
-    f.close()
+        with open(abs_file,'r') as f:
+            str_data = f.readlines()  #读取所有行
+    except UnicodeDecodeError as e:
+        with open(abs_file,'r',encoding = 'GBK') as f:
+            str_data = f.readlines()
     
     #去掉换行符，并将字符串分开
     data = [line_data.strip().split(',') for line_data in str_data]
@@ -270,7 +285,7 @@ def get_jiami_obs(abs_file, filetype = 'pd', sort = True):
     for index,line_data in enumerate(station_data[0:]):
         all_stations.append(str(line_data[0]))
         all_times.append(line_data[1])
-        np_line_data = [np.float(var) if len(var) > 0 else np.nan for var in line_data[2:]]
+        np_line_data = [float(var) if len(var) > 0 else np.nan for var in line_data[2:]]
         valid_station_data[index,:] = np_line_data[0:]
       
     #去掉时间列
@@ -283,14 +298,15 @@ def get_jiami_obs(abs_file, filetype = 'pd', sort = True):
         pd_data[column] = valid_station_data[:,i]
     
     if sort:
-        pd_data = pd_data.sort_values('站号', ascending=bool)
+        pd_data = pd_data.sort_values('站号', ascending=True)
         pd_data.index = range(len(pd_data))
     
     return pd_data if filetype == 'pd' else pd_data.values
 
 
 ###############################################################################
-def get_EC_thin_data(filename,plot = True,label_gap = 2):
+@perf.timed()
+def get_EC_thin_data(filename,plot = True,label_gap = 2, quicklook = False):
     '''
     func:获取EC_thin的数据(不包括 EC_thin/physic底下的物理量)，默认EC_thin的数据是 等经纬网格的;
     doc: 空间分辨率为 0.125*0.125 或者 0.25*0.25 ; 时间分辨率为3小时
@@ -298,6 +314,7 @@ def get_EC_thin_data(filename,plot = True,label_gap = 2):
         filename: 文件名
         plot: 默认True，绘制数据场
         label_gap: Plot中，x和y label的坐标经纬度间隔
+        quicklook: 默认False; True时先将降水场按块取最大值降采样到图片的像素数，再画图(只影响画图，不影响返回的数据)
     
     return:
         lon_grid : 场对应的经度信息
@@ -308,6 +325,7 @@ def get_EC_thin_data(filename,plot = True,label_gap = 2):
         
     '''
     
+    perf.count_file(filename)
     f=open(filename,mode='r')
     
     #此时每行的都为 字符格式
@@ -364,9 +382,16 @@ def get_EC_thin_data(filename,plot = True,label_gap = 2):
     #将降水场可视化出来
     if plot: 
         
-        plt.figure(figsize = (16,10))
+        fig = plt.figure(figsize = (16,10))
         
-        cs = plt.contourf(tp[-1::-1], 
+        #quicklook: 降水场按块取最大值降采样(降采样倍数由坐标区的像素数确定)，x/y为降采样后每块中心的index
+        plot_tp = tp[-1::-1]
+        factor = quicklook_factor(plot_tp.shape, fig.dpi*16*0.775, fig.dpi*10*0.77) if quicklook else 1
+        plot_tp = block_reduce(plot_tp, factor, 'max')
+        plot_x = np.arange(plot_tp.shape[1])*factor + (factor - 1)/2
+        plot_y = np.arange(plot_tp.shape[0])*factor + (factor - 1)/2
+        
+        cs = plt.contourf(plot_x, plot_y, plot_tp, 
 #                          levels= np.arange(0,32+1,4), 
                            extend='both',
                            cmap = plt.cm.rainbow) #extend参数使得colorbar两端变尖
@@ -402,6 +427,7 @@ def get_EC_thin_data(filename,plot = True,label_gap = 2):
 
 
 ###############################################################################
+@perf.timed()
 def get_EC_thin_physic_data(filename,plot = True,label_gap = 2):
     '''
     func:获取EC_thin/physic路径下的物理量，默认EC_thin的数据是 等经纬网格的;
@@ -428,6 +454,7 @@ def get_EC_thin_physic_data(filename,plot = True,label_gap = 2):
         
     '''
     
+    perf.count_file(filename)
     f=open(filename,mode='r')
     
     #此时每行的都为 字符格式
@@ -732,7 +759,8 @@ def contourf_on_map(all_data,loc_range = [30,50,105,125],
 ###############################################################################               
 def contourf_data_on_map(data,lon_grid,lat_grid,gap = 5, 
                          levels = 10,
-                         is_norm = False, vmin = 0, vmax = 100):
+                         is_norm = False, vmin = 0, vmax = 100,
+                         quicklook = False, how = 'mean'):
     '''
     func: 传入数据和对应的经纬范围，将数据叠加在地图底图上
     inputs:
@@ -749,6 +777,10 @@ def contourf_data_on_map(data,lon_grid,lat_grid,gap = 5,
         默认False, 表示是否限制数值范围（在colorbar上可以体现出来）
     vmin,vmax: int
         当is_norm = True时才起作用，确定显示的数值的范围
+    quicklook: bool
+        默认False; True时先将网格降采样到图片的像素数再画图，大网格(SMS区域、0.125°EC)画图更快、图片更小
+    how: str
+        quicklook的降采样方式: 'max'(降水，保留强降水中心) 或 'mean'(其他要素)，默认'mean'
     ----------
     return None
     '''
@@ -777,6 +809,11 @@ def contourf_data_on_map(data,lon_grid,lat_grid,gap = 5,
         lat_grid = lat_grid[-1::-1]
         data = data[-1::-1]
     
+    #quicklook: 降采样到坐标区(figsize*0.8)的像素数
+    if quicklook:
+        data, lon_grid, lat_grid = decimate_grid(data, lon_grid, lat_grid, how = how,
+                                                 width = fig.dpi*14*0.8, height = fig.dpi*8*0.8)
+    
     
     h = m.contourf(lon_grid,lat_grid,data,
                   levels= levels,
@@ -890,6 +927,7 @@ def get_nearest_point_index(point_lon_lat,lon_grid,lat_grid):
     return [int(index_lat),int(index_lon)]
 
 ###############################################################################
+@perf.timed()
 def grid_interp_to_station(all_data, station_lon,station_lat ,method = 'linear'):
     '''
     func: 将等经纬度网格值 插值到 离散站点。使用griddata进行插值
@@ -912,6 +950,7 @@ def grid_interp_to_station(all_data, station_lon,station_lat ,method = 'linear')
     station_value = griddata(points,data,(station_lon,station_lat),method=method)
     
     station_value = station_value[:,:,0]
+    perf.count('vars_interpolated')
     
     return station_value
 
@@ -1110,6 +1149,7 @@ def surface_time2_SMS_time(src_f):
 #%%
 ############################### Part5: 构建地面观测(OBS)、EC、SMS的某个时刻的特征数据集 ####################### 
     
+@perf.timed()
 def get_all_surface_station_Dataset(r_filepath,
                                     loc_range = [30,50,105,125],
                                     filetype = 'array'):
@@ -1201,7 +1241,7 @@ def get_all_surface_station_Dataset(r_filepath,
     ########################################
     
     #按站台号排序
-    all_vars_data = pd.DataFrame(all_vars_data,columns = columns).sort_values('station_num', ascending=bool)
+    all_vars_data = pd.DataFrame(all_vars_data,columns = columns).sort_values('station_num', ascending=True)
     
     #获取当前文件中的站点序列在 all_station列表中的位置
     index = [all_station.index(station) for station in list(all_vars_data['station_num'])]
@@ -1211,7 +1251,7 @@ def get_all_surface_station_Dataset(r_filepath,
     all_vars_data_pad = np.zeros(shape = (len(all_station),all_vars_data.shape[1]))
     all_vars_data_pad = pd.DataFrame(all_vars_data_pad,columns = columns).replace(0, np.nan)
     
-    all_vars_data_pad.values[index] = all_vars_data
+    all_vars_data_pad.iloc[index] = all_vars_data
     
     all_vars_data_pad['station_num'] = all_station #填上所有站点
     all_vars_data_pad['lon'] = all_lon #填上所有站点的经度
@@ -1225,6 +1265,7 @@ def get_all_surface_station_Dataset(r_filepath,
     return all_vars_data_pad
 
 #%%
+@perf.timed()
 def get_T0_jiami_surface_station_Dataset(jiami_filepath,
                                    loc_range = [30,50,105,125],
                                    filetype = 'pd'):
@@ -1242,7 +1283,7 @@ def get_T0_jiami_surface_station_Dataset(jiami_filepath,
     '''
     
     all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv'
-    station_lon_lat_pd = pd.read_csv(all_station_file)
+    station_lon_lat_pd = StationCatalog.load(all_station_file).to_dataframe()  #同一进程内只读取一次
     all_station = list(station_lon_lat_pd['station_num'])
     all_lon = list(station_lon_lat_pd['lon'])
     all_lat = list(station_lon_lat_pd['lat'])
@@ -1256,9 +1297,9 @@ def get_T0_jiami_surface_station_Dataset(jiami_filepath,
    # 'C2分钟平均风速', '最大风速的风向', '最大风速']
     
     #剔除jiami_data中某些 不在all_station中的站点观测，并为其他站点加上[经度、纬度、高度]信息
-    obs_station = list(jiami_data['站号'])
-    # print('obs_station length:',len(obs_station))
-    error_station_index = [obs_station.index(station) for station in obs_station if station not in all_station]
+    #观测站点在all_station中的index(哈希查找)，不在all_station中的为 -1
+    obs_index = StationCatalog.load(all_station_file).lookup(jiami_data['站号'])
+    error_station_index = list(np.where(obs_index < 0)[0])
     if len(error_station_index) > 0:  
         jiami_data = jiami_data.drop(index = error_station_index) 
         jiami_data.index = range(len(jiami_data))  #index重新排序
@@ -1268,9 +1309,7 @@ def get_T0_jiami_surface_station_Dataset(jiami_filepath,
     ########################################
     
     #获取剩下的obs_station在所有all_station中的index
-    new_obs_station = list(jiami_data['站号'])
-    # print('obs_station length:',len(new_obs_station))
-    index = [all_station.index(station) for station in new_obs_station]
+    index = obs_index[obs_index >= 0]
     
     
     #  ['站号', '气温', '最高气温', '最低气温', '露点温度', '相对湿度', '小时降水量', 'C2分钟风向',
@@ -1297,23 +1336,23 @@ def get_T0_jiami_surface_station_Dataset(jiami_filepath,
     all_vars_data_pad = np.zeros(shape = (len(all_station),len(columns_en)))
     all_vars_data_pad = pd.DataFrame(all_vars_data_pad,columns = columns_en).replace(0, np.nan)
     
-    all_vars_data_pad['0_T-0_surface_r1-p'].values[index] = jiami_data['小时降水量']
+    all_vars_data_pad.loc[index, '0_T-0_surface_r1-p'] = np.asarray(jiami_data['小时降水量'])
     all_vars_data_pad['station_num'] = all_station
     all_vars_data_pad['lon'] = all_lon
     all_vars_data_pad['lat'] = all_lat
     all_vars_data_pad['height'] = all_height
-    all_vars_data_pad['4_T-0_surface_plot-T'].values[index] = jiami_data['气温']
-    all_vars_data_pad['1_T-0_surface_plot-Td'].values[index] = jiami_data['露点温度']
-    all_vars_data_pad['1_T-0_surface_plot-RH'].values[index] = jiami_data['相对湿度']
-    all_vars_data_pad['2_T-0_surface_plot-wind-max'].values[index] = jiami_data['最大风速']
-    all_vars_data_pad['2_T-0_surface_plot-wind-max-dir'].values[index] = jiami_data['最大风速的风向']
-    all_vars_data_pad['2_T-0_surface_plot-cos(wind-max-dir)'].values[index] = np.cos(jiami_data['最大风速的风向']*np.pi/180)
-    all_vars_data_pad['2_T-0_surface_plot-sin(wind-max-dir)'].values[index] = np.sin(jiami_data['最大风速的风向']*np.pi/180)
-    
-    all_vars_data_pad['2_T-0_surface_plot-wind-mean'].values[index] = jiami_data['C2分钟平均风速']
-    all_vars_data_pad['2_T-0_surface_plot-wind-mean-dir'].values[index] = jiami_data['C2分钟风向']
-    all_vars_data_pad['2_T-0_surface_plot-cos(wind-mean-dir)'].values[index] = np.cos(jiami_data['C2分钟风向']*np.pi/180)
-    all_vars_data_pad['2_T-0_surface_plot-sin(wind-mean-dir)'].values[index] = np.sin(jiami_data['C2分钟风向']*np.pi/180)
+    all_vars_data_pad.loc[index, '4_T-0_surface_plot-T'] = np.asarray(jiami_data['气温'])
+    all_vars_data_pad.loc[index, '1_T-0_surface_plot-Td'] = np.asarray(jiami_data['露点温度'])
+    all_vars_data_pad.loc[index, '1_T-0_surface_plot-RH'] = np.asarray(jiami_data['相对湿度'])
+    all_vars_data_pad.loc[index, '2_T-0_surface_plot-wind-max'] = np.asarray(jiami_data['最大风速'])
+    all_vars_data_pad.loc[index, '2_T-0_surface_plot-wind-max-dir'] = np.asarray(jiami_data['最大风速的风向'])
+    all_vars_data_pad.loc[index, '2_T-0_surface_plot-cos(wind-max-dir)'] = np.asarray(np.cos(jiami_data['最大风速的风向']*np.pi/180))
+    all_vars_data_pad.loc[index, '2_T-0_surface_plot-sin(wind-max-dir)'] = np.asarray(np.sin(jiami_data['最大风速的风向']*np.pi/180))
+    
+    all_vars_data_pad.loc[index, '2_T-0_surface_plot-wind-mean'] = np.asarray(jiami_data['C2分钟平均风速'])
+    all_vars_data_pad.loc[index, '2_T-0_surface_plot-wind-mean-dir'] = np.asarray(jiami_data['C2分钟风向'])
+    all_vars_data_pad.loc[index, '2_T-0_surface_plot-cos(wind-mean-dir)'] = np.asarray(np.cos(jiami_data['C2分钟风向']*np.pi/180))
+    all_vars_data_pad.loc[index, '2_T-0_surface_plot-sin(wind-mean-dir)'] = np.asarray(np.sin(jiami_data['C2分钟风向']*np.pi/180))
             
     if filetype == 'array':
         all_vars_data_pad = all_vars_data_pad.values
@@ -1321,6 +1360,7 @@ def get_T0_jiami_surface_station_Dataset(jiami_filepath,
     return all_vars_data_pad  
     
 
+@perf.timed()
 def get_T3_jiami_surface_station_Dataset(jiami_filepath,
                                    loc_range = [30,50,105,125],
                                    filetype = 'pd'):
@@ -1376,6 +1416,7 @@ def get_T3_jiami_surface_station_Dataset(jiami_filepath,
     return np.array(data0.values) if filetype == 'array' else data0
 
 #%%
+@perf.timed()
 def get_all_ECthin_Station_dataset_ori(EC_path, surface_file,loc_range = [30,50,105,125]):
     '''
     func: 根据surface_file的站点数据，获取对应的时刻的 EC细网格物理量资料，并将网格资料插值到站点
@@ -1390,7 +1431,7 @@ def get_all_ECthin_Station_dataset_ori(EC_path, surface_file,loc_range = [30,50,
     '''
     
     all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv'
-    station_lon_lat_pd = pd.read_csv(all_station_file)
+    station_lon_lat_pd = StationCatalog.load(all_station_file).to_dataframe()  #同一进程内只读取一次
     all_station = list(station_lon_lat_pd['station_num'])
     all_lon = list(station_lon_lat_pd['lon'])
     all_lat = list(station_lon_lat_pd['lat'])
@@ -1421,7 +1462,6 @@ def get_all_ECthin_Station_dataset_ori(EC_path, surface_file,loc_range = [30,50,
         print('Error!',EC_file0,'not exists! please check the file')
         
     else: 
-        t1 = time.time()
         
         for i in range(len(all_EC_filepath)):
             
@@ -1439,7 +1479,6 @@ def get_all_ECthin_Station_dataset_ori(EC_path, surface_file,loc_range = [30,50,
             all_EC_file_stations_values.append(valid_EC_station_values)
         
         all_EC_file_stations_values = np.concatenate(all_EC_file_stations_values,axis = 1)
-        print('total time cost:',time.time()-t1)
     
 #        将数组转换为 DataFrame
         all_EC_file_stations_values = pd.DataFrame(all_EC_file_stations_values,
@@ -1454,86 +1493,33 @@ def get_all_ECthin_Station_dataset_dst(ori_data,filetype = 'pd'):
     func: 将 get_all_ECthin_Station_dataset_ori 函数的输入进行进一步特征组合。
     
     inputs: 
-        ori_data：为pd.DataFrame格式，其中每列为一个ECthin的物理量名称，共计45个物理量
+        ori_data：为pd.DataFrame格式，其中每列为一个ECthin的物理量名称，共计45个物理量;
+                也可以为np.array, shape = (..., 45), eg: 整个时段所有站点的 (time, station, 45)
         filetype: 'array',默认输出为np.array类型。
-                否则，默认输出为 pd.DataFrame类型
+                否则，默认输出为 pd.DataFrame类型(此时ori_data必须为单个时刻的数据)
     return: 
-        返回 将一些物理量进行特征变化 的结果。其中每列为一个组合特征，共计45个特征
+        返回 将一些物理量进行特征变化 的结果。其中每列为一个组合特征，共计48个特征
     '''
     
     all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv'
-    station_lon_lat_pd = pd.read_csv(all_station_file)
+    station_lon_lat_pd = StationCatalog.load(all_station_file).to_dataframe()  #同一进程内只读取一次
     all_station = list(station_lon_lat_pd['station_num'])
     all_lon = list(station_lon_lat_pd['lon'])
     all_lat = list(station_lon_lat_pd['lat'])
     all_height = list(station_lon_lat_pd['height'])
     
     
-    #拷贝.可以保证后续不会修改ori_data的值
-    ori_data = ori_data.values.copy()
-    
-    rows,cols = ori_data.shape
-    dst_data = np.zeros((rows,cols + 3))
-    
-    print('ori_data.shape:',ori_data.shape)
-    print('dst_data.shape',dst_data.shape)
-
-    #前11个变量不变
-    dst_data[:,0:11] = ori_data[:,0:11] 
-    
-    #mean(8,9,10),850/700/500hPa三层垂直速度平均
-    dst_data[:,11] = np.mean(ori_data[:,[8,9,10]],axis = 1) 
-    
-    dst_data[:,12:18] = ori_data[:,11:17]
+    EC_filename_list_path = 'D:/zhongqi/Features_Lists/EC_filename_list.xlsx'
     
-    #1000/950/925/900/850/700hPa平均U
-    dst_data[:,18] = np.mean(ori_data[:,[17,18,19,20]],axis = 1) 
-    
-    #1000/950/925/900/850/700hPa平均V
-    dst_data[:,19] = np.mean(ori_data[:,[25,26,27,28]],axis = 1)
-    
-    #1000/950/925/900/850/700/600/500/400/300hPa平均U和Umax
-    dst_data[:,20] = np.mean(ori_data[:,[17,18,19,20,21,22,23,24]],axis = 1)
-    dst_data[:,21] = np.max(ori_data[:,[17,18,19,20,21,22,23,24]],axis = 1)
-    
-    #1000/950/925/900/850/700/600/500/400/300hPa平均V和Vmax
-    dst_data[:,22] = np.mean(ori_data[:,[25,26,27,28,29,30,31,32]],axis = 1)
-    dst_data[:,23] = np.max(ori_data[:,[25,26,27,28,29,30,31,32]],axis = 1)
-    
-    dst_data[:,24] = ori_data[:,22]
-    dst_data[:,25] = ori_data[:,30]
-    
-    #500hPa风向，用cos/sin表示，v大于0，则cos大于0;u > 0,sin > 0
-    dst_data[:,26] = ori_data[:,30]/np.sqrt(np.square(ori_data[:,22]) + np.square(ori_data[:,30])) #cos
-    dst_data[:,27] = ori_data[:,22]/np.sqrt(np.square(ori_data[:,22]) + np.square(ori_data[:,30])) #sin
-    
-    dst_data[:,28] = ori_data[:,19]
-    dst_data[:,29] = ori_data[:,27]
-    
-    #850hPa风向，用cos/sin表示，v大于0，则cos大于0; u > 0,sin > 0
-    dst_data[:,30] = ori_data[:,27]/np.sqrt(np.square(ori_data[:,19]) + np.square(ori_data[:,27])) #cos
-    dst_data[:,31] = ori_data[:,19]/np.sqrt(np.square(ori_data[:,19]) + np.square(ori_data[:,27])) #sin
-    
- 
-    dst_data[:,32] = ori_data[:,18]
-    dst_data[:,33] = ori_data[:,26]
-    
-    #925hPa风向，用cos/sin表示，v大于0，则cos大于0,u > 0,sin > 0
-    dst_data[:,34] = ori_data[:,26]/np.sqrt(np.square(ori_data[:,18]) + np.square(ori_data[:,26]))
-    dst_data[:,35] = ori_data[:,18]/np.sqrt(np.square(ori_data[:,18]) + np.square(ori_data[:,26]))
-    
-    
-    dst_data[:,36:42] = ori_data[:,33:39]
-    
-    #500hPa-850hPa的假相当位温差
-    dst_data[:,42] = ori_data[:,38]-ori_data[:,36]
-    dst_data[:,43:] = ori_data[:,40:]
+    #特征组合方式由EC_filename_list.xlsx的'Com_op'/'Com_src'两列配置，编译为向量化的计算核(按文件缓存)
+    #ori_data可以是单个时刻的(station, var)，也可以是整个时段的(time, station, var)，一次调用完成计算
+    kernel = get_EC_feature_kernel(EC_filename_list_path)
+    dst_data = kernel(ori_data.values if isinstance(ori_data, pd.DataFrame) else ori_data)
     
     #如果 filetype 为 'array',则输出np.array数组
     #否则输出 pd.DataFrame，columns为组合后的变量名称
     if filetype != 'array':
         
-        EC_filename_list_path = 'D:/zhongqi/Features_Lists/EC_filename_list.xlsx'  
         #读取变量说明特征说明 
         EC_filename_list = pd.read_excel(EC_filename_list_path)
         all_EC_Com_Features_Name = EC_filename_list['EC_Com_Features_Name']
@@ -1549,6 +1535,7 @@ def get_all_ECthin_Station_dataset_dst(ori_data,filetype = 'pd'):
 
 
 #%%
+@perf.timed()
 def get_T0_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125],
                                 filetype = 'pd',
                                 if_plot = False):
@@ -1569,7 +1556,7 @@ def get_T0_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
     
     
     all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv'
-    station_lon_lat_pd = pd.read_csv(all_station_file)
+    station_lon_lat_pd = StationCatalog.load(all_station_file).to_dataframe()  #同一进程内只读取一次
     all_station = list(station_lon_lat_pd['station_num'])
     all_lon = list(station_lon_lat_pd['lon'])
     all_lat = list(station_lon_lat_pd['lat'])
@@ -1603,11 +1590,11 @@ def get_T0_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
                   'REFC_P0_L10_GLC0']
                   
     
-    t1 = time.time()
     
     all_vars_grid_data = []
             
     #读取SMS_file_time0文件中valid_vars变量的数据
+    perf.count_file(SMS_file_time0)
     f = nc.Dataset(SMS_file_time0)
     for var in valid_vars[0:]:
         data = f[var][:]
@@ -1631,7 +1618,6 @@ def get_T0_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
     
     #将格点插值到站点
     for grid_data in all_vars_grid_data[0:]:
-        t2 = time.time()
         
         #只考虑loc_range内的数据，加快插值速度
         grid_data = grid_data[index1][index2]
@@ -1640,7 +1626,6 @@ def get_T0_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
                                                          station_lat = all_lat,
                                                          method = 'linear')
         
-        print('cost:',time.time() - t2)
         all_vars_station_data.append(valid_vars_station_data)
     
     if if_plot:
@@ -1685,11 +1670,11 @@ def get_T0_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
         all_vars_station_data['lat'] = all_lat
         all_vars_station_data['height'] = all_height
         
-    print('total time cost:',time.time()-t1)
     
     return all_vars_station_data
 
 
+@perf.timed()
 def get_T3_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125],
                                 filetype = 'array',
                                 if_plot = False):
@@ -1709,7 +1694,7 @@ def get_T3_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
     '''
     
     all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv'
-    station_lon_lat_pd = pd.read_csv(all_station_file)
+    station_lon_lat_pd = StationCatalog.load(all_station_file).to_dataframe()  #同一进程内只读取一次
     all_station = list(station_lon_lat_pd['station_num'])
     all_lon = list(station_lon_lat_pd['lon'])
     all_lat = list(station_lon_lat_pd['lat'])
@@ -1758,7 +1743,6 @@ def get_T3_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
     if not os.path.exists(SMS_file_time2):
         print('Error!',SMS_file_time2 ,'not exits!')
     
-    t1 = time.time()
     
     all_vars_grid_data = []
     
@@ -1769,6 +1753,7 @@ def get_T3_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
     
     i = 0
     for file in [SMS_file_time0,SMS_file_time1,SMS_file_time2]:
+        perf.count_file(file)
         f = nc.Dataset(file)
         r1 = f[acc_var][:]
         if i == 0:
@@ -1784,6 +1769,7 @@ def get_T3_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
     all_vars_grid_data.append(acc_r1)
     
     #读取SMS_file_time0文件中valid_vars变量的数据
+    perf.count_file(SMS_file_time0)
     f = nc.Dataset(SMS_file_time0)
     for var in valid_vars[0:]:
         data = f[var][:]
@@ -1807,7 +1793,6 @@ def get_T3_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
     
     #将格点插值到站点
     for grid_data in all_vars_grid_data[0:]:
-        t2 = time.time()
         
         #只考虑loc_range内的数据，加快插值速度
         grid_data = grid_data[index1][index2]
@@ -1816,7 +1801,6 @@ def get_T3_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
                                                          station_lat = all_lat,
                                                          method = 'linear')
         
-        print('cost:',time.time() - t2)
         all_vars_station_data.append(valid_vars_station_data)
     
     if if_plot:
@@ -1864,103 +1848,128 @@ def get_T3_SMS_Station_dataset(SMS_path, surface_file,loc_range = [30,50,105,125
         all_vars_station_data['lat'] = all_lat
         all_vars_station_data['height'] = all_height
         
-    print('total time cost:',time.time()-t1)
     
     return all_vars_station_data
 
 #%%
 ########################################Part6: 与降水有关评分函数 ######################## 
-def prep_clf(obs,pre, threshold=0.1):
+def prep_clf(obs,pre, threshold=0.1, mask = None, skipna = True):
     '''
     func: 计算二分类结果-混淆矩阵的四个元素
     inputs:
         obs: 观测值，即真实值；
         pre: 预测值；
         threshold: 阈值，判别正负样本的阈值,默认0.1,气象上默认格点 >= 0.1才判定存在降水。
+        mask: 有效样本的bool数组(与obs的shape一致或可广播)，默认None，即所有样本; 
+              eg: 只检验某个区域内的站点
+        skipna: 默认True，obs或pre为nan的样本(eg: 加密观测文件中缺测、以nan填充的站点)不参与计数;
+                False时与旧版本一致，nan按无降水处理(会使correctnegatives偏多)
     
     returns:
         hits, misses, falsealarms, correctnegatives
         #aliases: TP, FN, FP, TN 
     '''
-    #根据阈值分类为 0, 1
-    obs = np.where(obs >= threshold, 1, 0)
-    pre = np.where(pre >= threshold, 1, 0)
-
+    obs = np.asarray(obs)
+    pre = np.asarray(pre)
+    
+    #根据阈值分类，nan >= threshold 为False。只生成bool数组，不生成筛选后的obs/pre副本
+    with np.errstate(invalid = 'ignore'):
+        obs_yes = obs >= threshold
+        pre_yes = pre >= threshold
+    
+    if skipna or mask is not None:
+        valid = np.ones(np.broadcast(obs, pre).shape, dtype = bool)
+        if skipna:
+            valid &= ~np.isnan(obs)
+            valid &= ~np.isnan(pre)
+        if mask is not None:
+            valid &= np.asarray(mask, dtype = bool)
+        obs_yes &= valid
+        pre_yes &= valid
+        total = np.count_nonzero(valid)
+    else:
+        total = obs_yes.size
+    
     # True positive (TP)
-    hits = np.sum((obs == 1) & (pre == 1))
+    hits = np.count_nonzero(obs_yes & pre_yes)
 
     # False negative (FN)
-    misses = np.sum((obs == 1) & (pre == 0))
+    misses = np.count_nonzero(obs_yes) - hits
 
     # False positive (FP)
-    falsealarms = np.sum((obs == 0) & (pre == 1))
+    falsealarms = np.count_nonzero(pre_yes) - hits
 
     # True negative (TN)
-    correctnegatives = np.sum((obs == 0) & (pre == 0))
+    correctnegatives = total - hits - misses - falsealarms
 
     return hits, misses, falsealarms, correctnegatives
 
 
-def precision(obs, pre, threshold=0.1):
+def precision(obs, pre, threshold=0.1, mask = None):
     '''
     func: 计算精确度precision: TP / (TP + FP)
     inputs:
         obs: 观测值，即真实值；
         pre: 预测值；
         threshold: 阈值，判别正负样本的阈值,默认0.1,气象上默认格点 >= 0.1才判定存在降水。
+        mask: 有效样本的bool数组，默认None; obs或pre为nan的样本总是不参与计算, 见prep_clf
     
     returns:
         dtype: float
     '''
 
-    TP, FN, FP, TN = prep_clf(obs=obs, pre = pre, threshold=threshold)
+    TP, FN, FP, TN = prep_clf(obs=obs, pre = pre, threshold=threshold, mask = mask)
 
     return TP / (TP + FP)
 
 
-def recall(obs, pre, threshold=0.1):
+def recall(obs, pre, threshold=0.1, mask = None):
     '''
     func: 计算召回率recall: TP / (TP + FN)
     inputs:
         obs: 观测值，即真实值；
         pre: 预测值；
         threshold: 阈值，判别正负样本的阈值,默认0.1,气象上默认格点 >= 0.1才判定存在降水。
+        mask: 有效样本的bool数组，默认None; obs或pre为nan的样本总是不参与计算, 见prep_clf
     
     returns:
         dtype: float
     '''
 
-    TP, FN, FP, TN = prep_clf(obs=obs, pre = pre, threshold=threshold)
+    TP, FN, FP, TN = prep_clf(obs=obs, pre = pre, threshold=threshold, mask = mask)
 
     return TP / (TP + FN)
 
 
-def ACC(obs, pre, threshold=0.1):
+def ACC(obs, pre, threshold=0.1, mask = None):
     '''
     func: 计算准确度Accuracy: (TP + TN) / (TP + TN + FP + FN)
     inputs:
         obs: 观测值，即真实值；
         pre: 预测值；
         threshold: 阈值，判别正负样本的阈值,默认0.1,气象上默认格点 >= 0.1才判定存在降水。
+        mask: 有效样本的bool数组，默认None; obs或pre为nan的样本总是不参与计算, 见prep_clf
     
     returns:
         dtype: float
     '''
 
-    TP, FN, FP, TN = prep_clf(obs=obs, pre = pre, threshold=threshold)
+    TP, FN, FP, TN = prep_clf(obs=obs, pre = pre, threshold=threshold, mask = mask)
 
     return (TP + TN) / (TP + TN + FP + FN)
 
-def FSC(obs, pre, threshold=0.1):
+def FSC(obs, pre, threshold=0.1, mask = None):
     '''
     func:计算f1 score = 2 * ((precision * recall) / (precision + recall))
     '''
-    precision_socre = precision(obs, pre, threshold=threshold)
-    recall_score = recall(obs, pre, threshold=threshold)
+    #只计算一次混淆矩阵
+    TP, FN, FP, TN = prep_clf(obs=obs, pre = pre, threshold=threshold, mask = mask)
+    precision_socre = TP / (TP + FP)
+    recall_score = TP / (TP + FN)
 
     return 2 * ((precision_socre * recall_score) / (precision_socre + recall_score))
 
-def TS(obs, pre, threshold=0.1):
+def TS(obs, pre, threshold=0.1, mask = None):
     
     '''
     func: 计算TS评分: TS = hits/(hits + falsealarms + misses) 
@@ -1969,15 +1978,16 @@ def TS(obs, pre, threshold=0.1):
         obs: 观测值，即真实值；
         pre: 预测值；
         threshold: 阈值，判别正负样本的阈值,默认0.1,气象上默认格点 >= 0.1才判定存在降水。
+        mask: 有效样本的bool数组，默认None; obs或pre为nan的样本总是不参与计算, 见prep_clf
     returns:
         dtype: float
     '''
 
-    hits, misses, falsealarms, correctnegatives = prep_clf(obs=obs, pre = pre, threshold=threshold)
+    hits, misses, falsealarms, correctnegatives = prep_clf(obs=obs, pre = pre, threshold=threshold, mask = mask)
 
     return hits/(hits + falsealarms + misses) 
 
-def MAR(obs, pre, threshold=0.1):
+def MAR(obs, pre, threshold=0.1, mask = None):
     '''
     func : 计算漏报率 misses / (hits + misses)
     MAR - Missing Alarm Rate
@@ -1986,15 +1996,16 @@ def MAR(obs, pre, threshold=0.1):
         pre (numpy.ndarray): prediction
         threshold (float)  : threshold for rainfall values binaryzation
                              (rain/no rain)
+        mask (numpy.ndarray): valid samples (bool), NaN samples are always skipped
     Returns:
         float: MAR value
     '''
     hits, misses, falsealarms, correctnegatives = prep_clf(obs=obs, pre = pre,
-                                                           threshold=threshold)
+                                                           threshold=threshold, mask = mask)
 
     return misses / (hits + misses)
 
-def FAR(obs, pre, threshold=0.1):
+def FAR(obs, pre, threshold=0.1, mask = None):
     '''
     func: 计算误警率。falsealarms / (hits + falsealarms) 
     FAR - false alarm rate
@@ -2003,30 +2014,194 @@ def FAR(obs, pre, threshold=0.1):
         pre (numpy.ndarray): prediction
         threshold (float)  : threshold for rainfall values binaryzation
                              (rain/no rain)
+        mask (numpy.ndarray): valid samples (bool), NaN samples are always skipped
     Returns:
         float: FAR value
     '''
     hits, misses, falsealarms, correctnegatives = prep_clf(obs=obs, pre = pre,
-                                                           threshold=threshold)
+                                                           threshold=threshold, mask = mask)
 
     return falsealarms / (hits + falsealarms)
 
 
-def multil_scores(obs, pre, threshold):
+def ETS(obs, pre, threshold=0.1, mask = None):
+    '''
+    func: 计算ETS评分(公平技巧评分): (hits - hits_random)/(hits + misses + falsealarms - hits_random)
+          其中 hits_random = (hits + misses)*(hits + falsealarms)/total, 即随机预报的命中数
+    inputs:
+        obs: 观测值，即真实值；
+        pre: 预测值；
+        threshold: 阈值，判别正负样本的阈值,默认0.1,气象上默认格点 >= 0.1才判定存在降水。
+        mask: 有效样本的bool数组，默认None; obs或pre为nan的样本总是不参与计算, 见prep_clf
+    returns:
+        dtype: float
+    '''
+    return clf_scores(*prep_clf(obs = obs, pre = pre, threshold = threshold, mask = mask))['ETS']
+
+
+def HSS(obs, pre, threshold=0.1, mask = None):
+    '''
+    func: 计算HSS评分(Heidke技巧评分): 
+          2*(hits*correctnegatives - misses*falsealarms)/((hits + misses)*(misses + correctnegatives) + (hits + falsealarms)*(falsealarms + correctnegatives))
+    inputs:
+        obs: 观测值，即真实值；
+        pre: 预测值；
+        threshold: 阈值，判别正负样本的阈值,默认0.1,气象上默认格点 >= 0.1才判定存在降水。
+        mask: 有效样本的bool数组，默认None; obs或pre为nan的样本总是不参与计算, 见prep_clf
+    returns:
+        dtype: float
+    '''
+    return clf_scores(*prep_clf(obs = obs, pre = pre, threshold = threshold, mask = mask))['HSS']
+
+
+def BIAS(obs, pre, threshold=0.1, mask = None):
+    '''
+    func: 计算频率偏差: (hits + falsealarms)/(hits + misses), 即预报的降水次数/观测的降水次数
+          > 1 为预报偏多(空报倾向), < 1 为预报偏少(漏报倾向)
+    inputs:
+        obs: 观测值，即真实值；
+        pre: 预测值；
+        threshold: 阈值，判别正负样本的阈值,默认0.1,气象上默认格点 >= 0.1才判定存在降水。
+        mask: 有效样本的bool数组，默认None; obs或pre为nan的样本总是不参与计算, 见prep_clf
+    returns:
+        dtype: float
+    '''
+    return clf_scores(*prep_clf(obs = obs, pre = pre, threshold = threshold, mask = mask))['BIAS']
+
+
+def multi_threshold_clf(obs, pre, thresholds, mask = None, skipna = True):
+    '''
+    func: 一次计算多个阈值下混淆矩阵的四个元素。
+          对每个阈值分别调用prep_clf需要对obs和pre各做一次二值化和4次布尔运算，
+          这里只对 obs、pre 和 min(obs, pre) 各排序一次，每个阈值的计数由二分查找(np.searchsorted)得到:
+              观测有降水: obs >= t 的个数
+              预报有降水: pre >= t 的个数
+              hits:      obs >= t 且 pre >= t 的个数，即 min(obs, pre) >= t 的个数
+    inputs:
+        obs: 观测值，即真实值；任意shape的数组
+        pre: 预测值；与obs的shape一致
+        thresholds: 阈值列表, eg: [0.1, 5, 10, 15, 20]
+        mask: 有效样本的bool数组，默认None，即所有样本
+        skipna: 默认True，obs或pre为nan的样本不参与计数; False时nan按 < threshold 处理, 见prep_clf
+    returns:
+        hits, misses, falsealarms, correctnegatives: np.array, shape = (len(thresholds),)
+    '''
+    shape = np.shape(obs)
+    obs = np.asarray(obs, dtype = np.float64).ravel()
+    pre = np.asarray(pre, dtype = np.float64).ravel()
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype = np.float64))
+    
+    if skipna or mask is not None:
+        valid = np.ones(obs.size, dtype = bool)
+        if skipna:
+            valid &= ~np.isnan(obs)
+            valid &= ~np.isnan(pre)
+        if mask is not None:
+            valid &= np.broadcast_to(np.asarray(mask, dtype = bool), shape).ravel()
+        #排序本身需要一份拷贝，这里直接排序筛选后的样本，不再额外拷贝
+        if not np.all(valid):
+            obs = obs[valid]
+            pre = pre[valid]
+    
+    if not skipna:
+        #nan >= threshold 为False, 用 -inf 代替，保证排序后位于最前面
+        obs = np.where(np.isnan(obs), -np.inf, obs)
+        pre = np.where(np.isnan(pre), -np.inf, pre)
+    
+    n = obs.size
+    
+    #>= t 的个数 = 总数 - < t 的个数
+    both = np.minimum(obs, pre)
+    both.sort()
+    hits = n - np.searchsorted(both, thresholds, side = 'left')
+    obs_yes = n - np.searchsorted(np.sort(obs), thresholds, side = 'left')
+    pre_yes = n - np.searchsorted(np.sort(pre), thresholds, side = 'left')
+    
+    misses = obs_yes - hits
+    falsealarms = pre_yes - hits
+    correctnegatives = n - hits - misses - falsealarms
+    
+    return hits, misses, falsealarms, correctnegatives
+
+
+def clf_scores(hits, misses, falsealarms, correctnegatives):
+    '''
+    func: 由混淆矩阵的四个元素计算所有评分。输入可以是单个数，也可以是多个阈值的数组(见multi_threshold_clf)
+    returns:
+        dict: {'Acc','Recall','Precision','F1','TS','MAR','FAR','ETS','HSS','BIAS'}, 
+              分母为0的评分为nan
+    '''
+    hits = np.asarray(hits, dtype = np.float64)
+    misses = np.asarray(misses, dtype = np.float64)
+    falsealarms = np.asarray(falsealarms, dtype = np.float64)
+    correctnegatives = np.asarray(correctnegatives, dtype = np.float64)
+    
+    total = hits + misses + falsealarms + correctnegatives
+    
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        recall_score = hits / (hits + misses)
+        precision_score = hits / (hits + falsealarms)
+        hits_random = (hits + misses) * (hits + falsealarms) / total
+        
+        scores = {}
+        scores['Acc'] = (hits + correctnegatives) / total
+        scores['Recall'] = recall_score
+        scores['Precision'] = precision_score
+        scores['F1'] = 2 * ((precision_score * recall_score) / (precision_score + recall_score))
+        scores['TS'] = hits / (hits + falsealarms + misses)
+        scores['MAR'] = misses / (hits + misses)
+        scores['FAR'] = falsealarms / (hits + falsealarms)
+        scores['ETS'] = (hits - hits_random) / (hits + misses + falsealarms - hits_random)
+        scores['HSS'] = 2 * (hits * correctnegatives - misses * falsealarms) / \
+                        ((hits + misses) * (misses + correctnegatives) + (hits + falsealarms) * (falsealarms + correctnegatives))
+        scores['BIAS'] = (hits + falsealarms) / (hits + misses)
+    
+    return scores
+
+
+def multi_threshold_scores(obs, pre, thresholds = [0.1, 5,10,15,20,25,30,35,40], mask = None):
+    '''
+    func: 多个阈值下的混淆矩阵和所有评分
+    inputs:
+        obs: 观测值，即真实值；
+        pre: 预测值；
+        thresholds: 阈值列表
+        mask: 有效样本的bool数组，默认None; obs或pre为nan的样本总是不参与计算
+    returns:
+        pd.DataFrame, index为阈值，
+        columns为 ['hits','misses','falsealarms','correctnegatives','Acc','Recall','Precision','F1','TS','MAR','FAR','ETS','HSS','BIAS']
+    '''
+    hits, misses, falsealarms, correctnegatives = multi_threshold_clf(obs, pre, thresholds, mask = mask)
+    
+    scores = pd.DataFrame({'hits': hits, 'misses': misses, 
+                           'falsealarms': falsealarms, 'correctnegatives': correctnegatives},
+                          index = pd.Index(np.atleast_1d(thresholds), name = 'threshold'))
+    for name, score in clf_scores(hits, misses, falsealarms, correctnegatives).items():
+        scores[name] = score
+    
+    return scores
+
+
+def multil_scores(obs, pre, threshold, mask = None):
     '''
     func: 输入某个阈值下，输出该阈值下预报相对观测的评分（以直接打印的方式） 
     '''
+    scores = multi_threshold_scores(obs, pre, [threshold], mask = mask).iloc[0]
+    
     print('Threshold:', threshold)
-    print('Acc:',ACC(obs,pre,threshold = threshold))
-    print('Recall score:',recall(obs,pre,threshold = threshold))
-    print('Precision score:',precision(obs,pre,threshold = threshold))
-    print('F1 score:',FSC(obs,pre,threshold = threshold))
-    print('TS评分:',TS(obs,pre,threshold = threshold))
-    print('漏报率(MAR)评分:',MAR(obs,pre,threshold = threshold))
-    print('误报率(FAR)评分:',FAR(obs,pre,threshold = threshold))
+    print('Acc:',scores['Acc'])
+    print('Recall score:',scores['Recall'])
+    print('Precision score:',scores['Precision'])
+    print('F1 score:',scores['F1'])
+    print('TS评分:',scores['TS'])
+    print('ETS评分:',scores['ETS'])
+    print('HSS评分:',scores['HSS'])
+    print('频率偏差(BIAS):',scores['BIAS'])
+    print('漏报率(MAR)评分:',scores['MAR'])
+    print('误报率(FAR)评分:',scores['FAR'])
     
 
-def plot_multi_scores(obs, pre, thresholds = [0.1, 5,10,15,20,25,30,35,40], title = None):
+def plot_multi_scores(obs, pre, thresholds = [0.1, 5,10,15,20,25,30,35,40], title = None, mask = None):
 
     '''
     画出不同阈值情况下的 模型预测对比实况的 Acc/Recall/Precision/F1/TS/MAR/FAR 的评分情况
@@ -2040,30 +2215,27 @@ def plot_multi_scores(obs, pre, thresholds = [0.1, 5,10,15,20,25,30,35,40], titl
         The default is [0.1, 5,10,15,20,25,30,35,40]. 进行评分判断的阈值
     title : str or None
         The default is None, 图片的 title
+    mask : np.array or None
+        The default is None, 有效样本的bool数组; obs或pre为nan的样本总是不参与评分
     Returns
     -------
-    None.
+    scores : pd.DataFrame
+        所有阈值下的混淆矩阵和评分, 见 multi_threshold_scores()
 
     '''
     
-    Acc_scores = []
-    Recall_scores = []
-    Precision_scores = []
-    F1_scores = []
-    TS_scores = []
-    MAR_scores = []
-    FAR_scores = []
-    
     # thresholds = [0.1,5,10, 15,20,25,30]
     
-    for threshold in thresholds:
-        Acc_scores.append(ACC(obs,pre, threshold = threshold))
-        Recall_scores.append(recall(obs,pre, threshold = threshold))
-        Precision_scores.append(precision(obs,pre, threshold = threshold))
-        F1_scores.append(FSC(obs,pre, threshold = threshold))
-        TS_scores.append(TS(obs,pre, threshold = threshold))
-        MAR_scores.append(MAR(obs,pre, threshold = threshold))
-        FAR_scores.append(FAR(obs,pre, threshold = threshold))
+    #所有阈值的评分一次计算得到
+    scores = multi_threshold_scores(obs, pre, thresholds, mask = mask)
+    
+    Acc_scores = scores['Acc'].values
+    Recall_scores = scores['Recall'].values
+    Precision_scores = scores['Precision'].values
+    F1_scores = scores['F1'].values
+    TS_scores = scores['TS'].values
+    MAR_scores = scores['MAR'].values
+    FAR_scores = scores['FAR'].values
         
          
     plt.figure(figsize = (12,8))
@@ -2090,7 +2262,7 @@ def plot_multi_scores(obs, pre, thresholds = [0.1, 5,10,15,20,25,30,35,40], titl
 
     plt.show()
     
-    return None
+    return scores
     
 
 #%%
@@ -2146,6 +2318,71 @@ def drop_outlier(x,max_threshold=50,min_threshold=1):
 
 
 
+def drop_outlier_batch(x, max_threshold=50, min_threshold=1, flag_only = False):
+    '''
+    func: 批量处理离群值。对x的每个时刻(第0维)分别做与drop_outlier()相同的处理，
+          但所有时刻的 平均值/标准差/最大值 都由沿非时间维的向量化统计一次得到，不需要逐个时刻循环
+          每个时刻:
+              outlier_threshold = mean + 3*std (只统计 >= min_threshold 的值)
+              如果 outlier_threshold >= 最大值: 无异常
+              否则，>= max(outlier_threshold, max_threshold) 的值修正为 max(outlier_threshold, max_threshold)
+    Parameter
+    ---------
+    x: np.array or np.ma.MaskedArray
+        shape = (time, ny, nx) 或 (time, station), 第0维为时间; nan和被mask的值不参与统计，也不会被修改
+    max_threshold: int
+        default 50, 1小时降水量最大正常值
+    min_threshold: int
+        default 1, 使用data >= min_threshold 的样本去做降水分布分析
+    flag_only: bool
+        default False; 为True时只标记异常值，不修改数据
+    return
+    ---------
+    data: 修正后的数据，float64, 与x的shape一致(x为MaskedArray时，返回MaskedArray，mask与x一致)
+    flags: bool数组，与x的shape一致, True为被修正(或标记)的异常值
+    '''
+    mask = None
+    if np.ma.isMaskedArray(x):
+        mask = np.ma.getmaskarray(x)
+        data = x.astype(np.float64).filled(np.nan)
+    else:
+        data = np.array(x, dtype = np.float64)
+
+    n_time = data.shape[0]
+    flat = data.reshape(n_time, -1)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        #每个时刻 >= min_threshold 的值的个数、平均值和标准差(与np.std一致，ddof = 0)
+        valid = flat >= min_threshold
+        count = np.count_nonzero(valid, axis = 1)
+        mean = np.sum(np.where(valid, flat, 0), axis = 1) / count
+        std = np.sqrt(np.sum(np.where(valid, np.square(flat - mean[:, None]), 0), axis = 1) / count)
+
+        #设置最小异常值
+        outlier_threshold = mean + 3*std
+        max_value = np.max(np.where(np.isnan(flat), -np.inf, flat), axis = 1)
+
+        #异常阈值 < 最大值时存在异常(没有 >= min_threshold 的值时，异常阈值为nan，同样按存在异常处理)
+        has_outlier = ~(outlier_threshold >= max_value)
+
+        #异常阈值 > max_threshold时修正为异常阈值，否则修正为max_threshold
+        clip_value = np.where(outlier_threshold >= max_threshold, outlier_threshold, max_threshold)
+
+        flags = has_outlier[:, None] & (flat > clip_value[:, None])
+
+    if not flag_only:
+        flat[flags] = np.broadcast_to(clip_value[:, None], flat.shape)[flags]
+
+    data = flat.reshape(data.shape)
+    flags = flags.reshape(data.shape)
+
+    if mask is not None:
+        data = np.ma.array(data, mask = mask)
+
+    return data, flags
+
+
+
 ###############################################################################
 ###############################################################################
 ###############################################################################
@@ -0,0 +1,776 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+基准测试: 生成与真实资料格式一致的模拟数据(MICAPS/加密观测/SMS)，分阶段计时，生成可在不同版本间比较的报告
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    bench_configs         预设的测试规模: 'small' / 'medium' / 'large'(站点数、网格分辨率、时刻数)
+    make_station_table()  模拟站点表，格式与all_jiami_station_lon_lat_alt.csv一致(含'A0302'这类字母开头的站点号)
+    write_diamond4()      模拟MICAPS第4类(diamond 4)格点文件; per_line不为None时，每个纬向行按per_line个数据换行(EC_thin/physic)
+    write_r6p_file()      模拟surface/r6-p(6小时累计降水)站点文件
+    write_plot_file()     模拟surface/plot(地面填图)站点文件，每个站点占两行
+    write_jiami_file()    模拟逐小时加密观测.csv文件，GBK编码
+    write_sms_file()      模拟SMS(华东区域中心)的.nc文件，经纬度为二维的 ELON_P0_L1_GLC0 / NLAT_P0_L1_GLC0
+    write_EC_filename_list()  模拟EC_filename_list.xlsx(EC_Com_Features_Name + filepath)
+    generate_dataset()    按配置生成所有模拟数据; 配置未改变时直接使用已生成的数据
+    run_benchmark()       依次运行并计时 parse -> interpolate -> build_T0 -> build_lags -> verify，返回报告(dict)
+    save_report() / load_report()
+    compare_reports()     比较多个报告(eg: 不同版本)各阶段的耗时
+
+各阶段:
+    parse         读取所有文件: 加密观测(get_jiami_obs)、r6-p/plot(get_station_data)、
+                  EC物理量(get_EC_thin_physic_data)、SMS(.nc, 与get_T3_SMS_Station_dataset读取的变量一致)
+    interpolate   EC和SMS格点插值到站点(grid_interp_to_station)
+    build_T0      ComposeMultipleData.get_T_0_TRAIN_dataset()逐时刻构建T0数据集，写入StationCubeStore
+                  (包括其内部的读取、插值、对齐、异常值修正和EC特征组合，即真实构建流程的端到端耗时)
+    build_lags    write_lag_datasets，T-3/6/9/12滞后数据集
+    verify        观测与EC/SMS 3小时降水的分组检验(grouped_scores)
+
+build_T0阶段的ComposeMultipleData指向模拟数据(站点表、EC_filename_list.xlsx、EC/SMS路径)；
+构建函数内部会使用 os.chdir()，因此该阶段结束后恢复原来的工作目录。
+各阶段内部的耗时和计数器(读取文件数、字节数、插值变量数、对齐站点数)由Perf_utils统计;
+parse/interpolate的吞吐量只统计这两个阶段本身的计数器。
+
+用法:
+    from Benchmark import run_benchmark, save_report, compare_reports
+    report = run_benchmark('D:/zhongqi/bench', config = 'small', label = 'v1')
+    save_report(report, 'D:/zhongqi/bench/report_v1.json')
+    ...
+    compare_reports(['D:/zhongqi/bench/report_v1.json', 'D:/zhongqi/bench/report_v2.json'])
+'''
+#%%
+
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import platform
+import subprocess
+import numpy as np
+import pandas as pd
+
+import Perf_utils as perf
+from Lazy_import import LazyModule
+from All_utils_funs import (get_jiami_obs, get_station_data, get_EC_thin_physic_data, grid_interp_to_station,
+                            surface_time2_EC_BJ_time, surface_time2_SMS_time, drop_outlier_batch)
+from EC_feature_spec import default_EC_com_spec
+from Class_utils2 import ComposeMultipleData
+from Build_manifest import BuildManifest
+from Station_catalog import StationCatalog
+from Station_store import StationCubeStore
+from Lag_features import write_lag_datasets
+from Verify_utils import grouped_scores
+
+nc = LazyModule('netCDF4')
+
+
+#测试规模: 站点数, EC网格分辨率(度), SMS网格分辨率(度), T0时刻数(间隔3小时)
+bench_configs = {
+    'small':  {'n_station': 500,  'ec_res': 0.5,   'sms_res': 0.25, 'n_times': 6},
+    'medium': {'n_station': 2000, 'ec_res': 0.25,  'sms_res': 0.1,  'n_times': 12},
+    'large':  {'n_station': 4343, 'ec_res': 0.125, 'sms_res': 0.05, 'n_times': 24},
+}
+
+#其他配置的默认值
+default_config = {
+    'loc_range': [30,50,105,125],  #[lat_min,lat_max,lon_min,lon_max]
+    'start_time': '2018080402',    #第一个T0时刻(北京时)，小时必须为 2/5/8/.../23
+    'n_ec_vars': 45,               #EC_thin物理量个数，与EC_filename_list.xlsx一致
+    'per_line': 10,                #EC_thin/physic每行保存的数据个数
+    'alpha_fraction': 0.7,         #字母开头的站点号(区域站)的比例，r6-p/plot中只有数字站点号的站点
+    'obs_fraction': 0.95,          #每个时刻有观测的站点比例
+    'unknown_fraction': 0.01,      #加密观测中不在站点表中的站点比例
+    'missing_fraction': 0.02,      #加密观测中的缺测比例(空字符串)
+    'time_gaps': [3,6,9,12],
+    'thresholds': [0.1, 5, 10, 20],
+    'seed': 0,
+}
+
+jiami_columns = ['站号', '时间', '气温', '最高气温', '最低气温', '露点温度', '相对湿度',
+                 '小时降水量', 'C2分钟风向', 'C2分钟平均风速', '最大风速的风向', '最大风速']
+
+#与get_T3_SMS_Station_dataset()一致
+sms_acc_var = 'APCP_P8_L1_GLC0_acc'
+sms_vars = ['DPT_P0_L103_GLC0', 'TMP_P0_L103_GLC0', 'RH_P0_L103_GLC0', 'UGRD_P0_L103_GLC0', 'VGRD_P0_L103_GLC0',
+            'PRES_P0_L101_GLC0', 'CAPE_P0_L1_GLC0', 'CIN_P0_L1_GLC0', 'REFC_P0_L10_GLC0']
+
+
+def get_config(config = 'small', **kwargs):
+    '''
+    func: 获取完整的测试配置
+    inputs:
+        config: bench_configs中的名称，或者dict
+        kwargs: 覆盖配置中的值, eg: n_station = 1000
+    return:
+        dict
+    '''
+    if isinstance(config, str):
+        if config not in bench_configs:
+            raise ValueError('unknown benchmark config: {}, must be one of {}'.format(config, list(bench_configs)))
+        name, config = config, bench_configs[config]
+    else:
+        name = 'custom'
+
+    all_config = dict(default_config)
+    all_config['name'] = name
+    all_config.update(config)
+    all_config.update(kwargs)
+
+    return all_config
+
+
+#%%
+##############################模拟数据 ############################################
+
+def bench_times(config):
+    '''
+    func: 所有T0时刻(北京时, 间隔3小时)以及需要的加密观测时刻(每个T0及其前2小时)
+    return:
+        T0_times, jiami_times: list, eg: ['2018080402', ...]
+    '''
+    start = datetime.datetime.strptime(config['start_time'], '%Y%m%d%H')
+    if start.hour not in [2,5,8,11,14,17,20,23]:
+        raise ValueError('start_time hour must be one of 2/5/8/.../23, got {}'.format(config['start_time']))
+
+    T0_times = [(start + datetime.timedelta(hours = 3*i)).strftime('%Y%m%d%H') for i in range(config['n_times'])]
+    jiami_times = [(start + datetime.timedelta(hours = h)).strftime('%Y%m%d%H')
+                   for h in range(-2, 3*(config['n_times'] - 1) + 1)]
+
+    return T0_times, jiami_times
+
+
+def sms_files_of_time(T0):
+    '''
+    func: T0时刻需要的3个SMS文件(与get_T3_SMS_Station_dataset一致)，eg: ['2018080318.006.nc', ...005.nc, ...004.nc]
+    '''
+    SMS_file_time = surface_time2_SMS_time(T0)
+    hour = int(SMS_file_time.split('.')[1])
+    return [SMS_file_time.split('.')[0] + '.' + '{:03d}'.format(h) + '.nc' for h in [hour, hour - 1, hour - 2]]
+
+
+def grid_range(loc_range, res):
+    '''
+    func: 与get_EC_thin_physic_data()一致的经纬度序列(np.arange), 保证写入的网格大小与读取时计算的一致
+    '''
+    lat_min, lat_max, lon_min, lon_max = loc_range
+    lat_range = np.arange(lat_min, lat_max + res, res)
+    lon_range = np.arange(lon_min, lon_max + res, res)
+
+    return lon_range, lat_range
+
+
+def random_field(rng, shape, kind = 'normal'):
+    '''
+    func: 模拟的二维场: 'rain': 约30%的格点有降水(gamma分布); 'normal': 平滑的正态场
+    '''
+    if kind == 'rain':
+        return rng.gamma(0.6, 6, size = shape) * (rng.random(shape) < 0.3)
+
+    #沿两个方向做累积和，得到空间上连续的场
+    field = np.cumsum(np.cumsum(rng.standard_normal(shape), axis = 0), axis = 1)
+    return (field - field.mean()) / (field.std() + 1e-6)
+
+
+def make_station_table(n_station, loc_range = [30,50,105,125], alpha_fraction = 0.7, seed = 0):
+    '''
+    func: 模拟站点表
+    return:
+        pd.DataFrame, columns = ['station_num','lon','lat','height'], 与all_jiami_station_lon_lat_alt.csv一致
+    '''
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lon_min, lon_max = loc_range
+
+    n_alpha = int(n_station * alpha_fraction)
+    national = rng.choice(np.arange(50000, 60000), size = n_station - n_alpha, replace = False)
+    regional = rng.choice(np.arange(26*10000), size = n_alpha, replace = False)
+
+    station_num = [str(s) for s in national] + ['{}{:04d}'.format(chr(ord('A') + s // 10000), s % 10000) for s in regional]
+
+    return pd.DataFrame({'station_num': station_num,
+                         'lon': np.round(rng.uniform(lon_min, lon_max, n_station), 4),
+                         'lat': np.round(rng.uniform(lat_min, lat_max, n_station), 4),
+                         'height': np.round(rng.gamma(1.5, 300, n_station), 1)})
+
+
+def write_diamond4(save_file, field, lon_range, lat_range, init_time, lead, per_line = 10):
+    '''
+    func: 写入MICAPS第4类(diamond 4)格点文件, 可由 get_EC_thin_physic_data()(per_line不为None) 或
+          get_EC_thin_data()(per_line = None) 读取
+          第0行: 时间信息(年 月 日 时 时效 层次)
+          第1行: 经纬度网格信息(格距 -格距 起始经度 终止经度 起始纬度(北) 终止纬度(南) 格点数 等值线信息...)
+          之后: 从北到南每个纬向行的数据; per_line不为None时每per_line个数据换一行
+    inputs:
+        field: shape = (len(lat_range), len(lon_range))，第0行为最南边
+        init_time: 起报时间, datetime
+        lead: 预报时效(小时)
+    '''
+    res = lon_range[1] - lon_range[0]
+    ny, nx = field.shape
+    lines = ['{:02d} {:02d} {:02d} {:02d} {:d} 0'.format(init_time.year % 100, init_time.month, init_time.day,
+                                                        init_time.hour, lead),
+             '{:g} {:g} {:g} {:g} {:g} {:g} {:d} {:d} 4 0 100 1 0'.format(
+                 res, -res, lon_range[0], lon_range[-1], lat_range[-1], lat_range[0], nx, ny)]
+
+    #从北到南
+    values = np.char.mod('%.2f', field[::-1])
+    step = nx if per_line is None else per_line
+    for row in values:
+        for j in range(0, nx, step):
+            lines.append(' '.join(row[j:j + step]))
+
+    with open(save_file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    return save_file
+
+
+def write_r6p_file(save_file, stations, rain, T0):
+    '''
+    func: 写入surface/r6-p文件，可由 get_station_data(file_type = 'r6-p') 读取:
+          前13行为数值型的头信息(时间、层次、等值线、剪切区域等，读取时跳过), 之后每行为 [站台号, 经度，纬度，海拔高度，降水量]
+    inputs:
+        stations: pd.DataFrame(站点号必须为数字)
+        rain: 降水量, shape = (n_station,)
+    '''
+    t = datetime.datetime.strptime(T0, '%Y%m%d%H')
+    header = ['{:02d} {:02d} {:02d} {:02d} -1'.format(t.year % 100, t.month, t.day, t.hour), '0', '6',
+              '0.1 10 25 50 100 250', '0 0', '2', '1', '0', '0', '0', '0', '0', str(len(stations))]
+
+    values = np.column_stack([stations['station_num'].astype(int).values, stations['lon'].values,
+                              stations['lat'].values, stations['height'].values, rain])
+    with open(save_file, 'w') as f:
+        f.write('\n'.join(header) + '\n')
+        np.savetxt(f, values, fmt = ['%d', '%.4f', '%.4f', '%.1f', '%.1f'])
+
+    return save_file
+
+
+def write_plot_file(save_file, stations, rng, T0):
+    '''
+    func: 写入surface/plot文件，可由 get_station_data(file_type = 'plot') 读取:
+          第0行为时间信息, 之后每个站点占两行(共22列)，
+          [0,1,2,6,7,16,19]列分别为[站台号,经度,纬度,风向,风速,露点,温度]
+    '''
+    t = datetime.datetime.strptime(T0, '%Y%m%d%H')
+    n = len(stations)
+
+    values = np.round(rng.normal(0, 1, size = (n, 22)), 1)
+    values[:, 0] = stations['station_num'].astype(int).values
+    values[:, 1] = stations['lon'].values
+    values[:, 2] = stations['lat'].values
+    values[:, 3] = stations['height'].values
+    values[:, 6] = np.round(rng.uniform(0, 360, n))
+    values[:, 7] = np.round(rng.gamma(2, 1.5, n), 1)
+    values[:, 19] = np.round(rng.normal(28, 3, n), 1)
+    values[:, 16] = np.round(values[:, 19] - rng.gamma(2, 2, n), 1)
+
+    text = np.char.mod('%g', values)
+    lines = ['{:02d} {:02d} {:02d} {:02d} {:d}'.format(t.year % 100, t.month, t.day, t.hour, n)]
+    for row in text:
+        lines.append(' '.join(row[:10]))
+        lines.append(' '.join(row[10:]))
+
+    with open(save_file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    return save_file
+
+
+def write_jiami_file(save_file, stations, rng, obs_time, obs_fraction = 0.95, unknown_fraction = 0.01,
+                     missing_fraction = 0.02):
+    '''
+    func: 写入逐小时加密观测文件(GBK编码的.csv)，可由 get_jiami_obs() 读取。
+          部分站点无观测, 部分站点不在站点表中, 部分要素缺测(空字符串), 站点顺序随机
+    '''
+    n = len(stations)
+    obs = stations.iloc[np.sort(rng.choice(n, size = int(n * obs_fraction), replace = False))]
+    station_num = list(obs['station_num'])
+    n_unknown = int(n * unknown_fraction)
+    station_num += ['Z{:04d}'.format(i) for i in range(n_unknown)]
+    m = len(station_num)
+
+    temp = rng.normal(28, 3, m)
+    values = np.column_stack([temp, temp + rng.gamma(2, 0.5, m), temp - rng.gamma(2, 0.5, m),
+                              temp - rng.gamma(2, 2, m), rng.uniform(40, 100, m),
+                              rng.gamma(0.4, 5, m) * (rng.random(m) < 0.3),
+                              rng.uniform(0, 360, m), rng.gamma(2, 1.5, m),
+                              rng.uniform(0, 360, m), rng.gamma(2, 3, m)])
+    text = np.char.mod('%.1f', values)
+    text[rng.random(text.shape) < missing_fraction] = ''
+
+    order = rng.permutation(m)
+    lines = [','.join(jiami_columns)]
+    for i in order:
+        lines.append(','.join([station_num[i], obs_time] + list(text[i])))
+
+    with open(save_file, 'w', encoding = 'GBK') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    return save_file
+
+
+def write_sms_file(save_file, lon_grid, lat_grid, fields):
+    '''
+    func: 写入SMS的.nc文件，所有变量的维度为(ygrid_0, xgrid_0)，
+          经纬度为二维的 ELON_P0_L1_GLC0 / NLAT_P0_L1_GLC0 (兰伯特投影网格，这里用等经纬度网格代替)
+    inputs:
+        fields: {变量名: 二维数组}
+    '''
+    f = nc.Dataset(save_file, 'w', format = 'NETCDF4')
+    try:
+        f.createDimension('ygrid_0', lon_grid.shape[0])
+        f.createDimension('xgrid_0', lon_grid.shape[1])
+        for name, values in [('ELON_P0_L1_GLC0', lon_grid), ('NLAT_P0_L1_GLC0', lat_grid)] + list(fields.items()):
+            var = f.createVariable(name, 'f4', ('ygrid_0', 'xgrid_0'), fill_value = 1e20)
+            var[:] = values.astype(np.float32)
+    finally:
+        f.close()
+
+    return save_file
+
+
+def dataset_paths(root):
+    '''
+    func: 模拟数据的目录结构
+    '''
+    return {'station_file': os.path.join(root, 'all_jiami_station_lon_lat_alt.csv'),
+            'jiami': os.path.join(root, 'aws_jiami'),
+            'r6-p': os.path.join(root, 'micaps', 'surface', 'r6-p'),
+            'plot': os.path.join(root, 'micaps', 'surface', 'plot'),
+            'EC': os.path.join(root, 'micaps', 'ecmwf_thin'),
+            'SMS': os.path.join(root, 'micaps', 'warr', 'nc'),
+            'EC_list': os.path.join(root, 'EC_filename_list.xlsx'),
+            'config': os.path.join(root, 'bench_config.json')}
+
+
+def ec_var_dirs(n_ec_vars):
+    '''
+    func: EC_thin物理量的目录, 第0个为3小时累计降水 TP/r3
+    '''
+    return ['TP/r3'] + ['V{:02d}/sfc'.format(i) for i in range(1, n_ec_vars)]
+
+
+def write_EC_filename_list(save_file, n_ec_vars):
+    '''
+    func: 写入EC_filename_list.xlsx，可由 ComposeMultipleData.get_all_ECthin_Station_dataset_ori() 读取:
+          'filepath'列为n_ec_vars个EC_thin物理量的目录, 'EC_Com_Features_Name'列为组合后的特征名(与default_EC_com_spec一致)
+    '''
+    EC_names = ['0_T-0_ECthin_TP-r3'] + ['3_T-0_ECthin_F{:02d}'.format(i) for i in range(1, len(default_EC_com_spec))]
+
+    EC_filename_list = pd.DataFrame({'EC_Com_Features_Name': EC_names})
+    EC_filename_list['filepath'] = pd.Series(['EC_thin/' + var_dir for var_dir in ec_var_dirs(n_ec_vars)])
+    EC_filename_list.to_excel(save_file, index = False)
+
+    return save_file
+
+
+@perf.timed('generate')
+def generate_dataset(root, config = 'small', overwrite = False, **kwargs):
+    '''
+    func: 按配置在root下生成所有模拟数据。root/bench_config.json记录生成数据时的配置，
+          配置未改变且overwrite = False时，直接使用已有的数据
+    inputs:
+        root: 模拟数据的根目录
+        config: bench_configs中的名称或者dict; kwargs: 覆盖配置中的值
+    return:
+        config(dict)
+    '''
+    if isinstance(config, dict) and 'name' in config:
+        config = dict(config, **kwargs)
+    else:
+        config = get_config(config, **kwargs)
+    paths = dataset_paths(root)
+
+    if not overwrite and os.path.exists(paths['config']) and os.path.exists(paths['EC_list']):
+        with open(paths['config'], 'r', encoding = 'utf-8') as f:
+            if json.load(f) == json.loads(json.dumps(config)):
+                return config
+
+    for key in ['jiami', 'r6-p', 'plot', 'EC', 'SMS']:
+        if os.path.exists(paths[key]):
+            shutil.rmtree(paths[key])
+        os.makedirs(paths[key])
+
+    rng = np.random.default_rng(config['seed'])
+    loc_range = config['loc_range']
+
+    stations = make_station_table(config['n_station'], loc_range, config['alpha_fraction'], config['seed'])
+    stations.to_csv(paths['station_file'])
+    write_EC_filename_list(paths['EC_list'], config['n_ec_vars'])
+    numeric = stations[stations['station_num'].str.isdigit()]
+
+    T0_times, jiami_times = bench_times(config)
+
+    #加密观测(逐小时)
+    for obs_time in jiami_times:
+        write_jiami_file(os.path.join(paths['jiami'], obs_time + '.txt'), stations, rng, obs_time,
+                         config['obs_fraction'], config['unknown_fraction'], config['missing_fraction'])
+
+    #r6-p / plot, 文件名eg: 18080420.000
+    for T0 in T0_times:
+        write_r6p_file(os.path.join(paths['r6-p'], T0[2:] + '.000'), numeric,
+                       random_field(rng, (len(numeric),), 'rain'), T0)
+        write_plot_file(os.path.join(paths['plot'], T0[2:] + '.000'), numeric, rng, T0)
+
+    #EC_thin物理量, eg: ecmwf_thin/TP/r3/18080320.006
+    lon_range, lat_range = grid_range(loc_range, config['ec_res'])
+    for var_dir in ec_var_dirs(config['n_ec_vars']):
+        os.makedirs(os.path.join(paths['EC'], var_dir))
+    for EC_time in sorted(set(surface_time2_EC_BJ_time(T0) for T0 in T0_times)):
+        init_time = datetime.datetime.strptime(EC_time.split('.')[0], '%y%m%d%H')
+        lead = int(EC_time.split('.')[1])
+        for i, var_dir in enumerate(ec_var_dirs(config['n_ec_vars'])):
+            field = random_field(rng, (len(lat_range), len(lon_range)), 'rain' if i == 0 else 'normal')
+            write_diamond4(os.path.join(paths['EC'], var_dir, EC_time), field, lon_range, lat_range,
+                           init_time, lead, per_line = config['per_line'])
+
+    #SMS, 网格比loc_range大1度
+    lat_min, lat_max, lon_min, lon_max = loc_range
+    sms_lon, sms_lat = grid_range([lat_min - 1, lat_max + 1, lon_min - 1, lon_max + 1], config['sms_res'])
+    lon_grid, lat_grid = np.meshgrid(sms_lon, sms_lat)
+    for SMS_file in sorted(set(sum([sms_files_of_time(T0) for T0 in T0_times], []))):
+        fields = {sms_acc_var: random_field(rng, lon_grid.shape, 'rain')}
+        for var in sms_vars:
+            fields[var] = random_field(rng, lon_grid.shape, 'normal')
+        write_sms_file(os.path.join(paths['SMS'], SMS_file), lon_grid, lat_grid, fields)
+
+    with open(paths['config'], 'w', encoding = 'utf-8') as f:
+        json.dump(config, f, ensure_ascii = False, indent = 1)
+
+    return config
+
+
+#%%
+##############################各阶段 ############################################
+
+def read_sms_fields(SMS_path, T0, loc_range):
+    '''
+    func: 读取T0时刻的3个SMS文件(与get_T3_SMS_Station_dataset一致): 3/2/1小时累计降水 + 9个物理量,
+          并只保留loc_range内的格点
+    return:
+        [loc_grid_lon, loc_grid_lat, [12个一维数组]]
+    '''
+    lat_min, lat_max, lon_min, lon_max = loc_range
+    files = [os.path.join(SMS_path, file) for file in sms_files_of_time(T0)]
+
+    all_r1 = []
+    for file in files:
+        perf.count_file(file)
+        f = nc.Dataset(file)
+        all_r1.append(f[sms_acc_var][:])
+        f.close()
+
+    #与get_T3_SMS_Station_dataset一致, 三个时刻一起做异常值修正
+    all_r1, flags = drop_outlier_batch(np.ma.stack(all_r1))
+    perf.count('outliers_corrected', int(np.count_nonzero(flags)))
+
+    all_vars_grid_data = [all_r1[0] + all_r1[1] + all_r1[2], all_r1[0] + all_r1[1], all_r1[0]]
+
+    perf.count_file(files[0])
+    f = nc.Dataset(files[0])
+    for var in sms_vars:
+        all_vars_grid_data.append(f[var][:])
+    grid_lon = f['ELON_P0_L1_GLC0'][:]
+    grid_lat = f['NLAT_P0_L1_GLC0'][:]
+    f.close()
+
+    index1 = np.where(grid_lon <= lon_max)
+    index2 = np.where(grid_lat[index1] >= lat_min)
+
+    return [grid_lon[index1][index2], grid_lat[index1][index2],
+            [np.ma.filled(data[index1][index2].astype(np.float64), np.nan) for data in all_vars_grid_data]]
+
+
+def stage_parse(root, config):
+    '''
+    func: 读取所有模拟数据
+    return:
+        {T0: {'jiami': [T0, T0-1h, T0-2h的pd.DataFrame], 'r6-p', 'plot', 'EC': [网格], 'SMS': read_sms_fields()的输出}}
+    '''
+    paths = dataset_paths(root)
+    T0_times, _ = bench_times(config)
+    EC_dirs = ec_var_dirs(config['n_ec_vars'])
+
+    parsed = {}
+    for T0 in T0_times:
+        t = datetime.datetime.strptime(T0, '%Y%m%d%H')
+        jiami_files = [os.path.join(paths['jiami'], (t - datetime.timedelta(hours = h)).strftime('%Y%m%d%H') + '.txt')
+                       for h in [0, 1, 2]]
+        EC_time = surface_time2_EC_BJ_time(T0)
+
+        parsed[T0] = {
+            'jiami': [get_jiami_obs(file, filetype = 'pd') for file in jiami_files],
+            'r6-p': get_station_data(os.path.join(paths['r6-p'], T0[2:] + '.000'), file_type = 'r6-p'),
+            'plot': get_station_data(os.path.join(paths['plot'], T0[2:] + '.000'), file_type = 'plot'),
+            'EC': [get_EC_thin_physic_data(os.path.join(paths['EC'], var_dir, EC_time), plot = False) for var_dir in EC_dirs],
+            'SMS': read_sms_fields(paths['SMS'], T0, config['loc_range']),
+        }
+
+    return parsed
+
+
+def stage_interpolate(parsed, catalog):
+    '''
+    func: EC和SMS格点插值到所有站点
+    return:
+        {T0: (EC站点值 shape = (n_station, n_ec_vars), SMS站点值 shape = (n_station, 12))}
+    '''
+    interpolated = {}
+    for T0, data in parsed.items():
+        EC_values = [grid_interp_to_station(EC_data, station_lon = catalog.lon, station_lat = catalog.lat, method = 'linear')
+                     for EC_data in data['EC']]
+
+        loc_grid_lon, loc_grid_lat, SMS_data = data['SMS']
+        SMS_values = [grid_interp_to_station([loc_grid_lon, loc_grid_lat, grid_data], station_lon = catalog.lon,
+                                             station_lat = catalog.lat, method = 'linear') for grid_data in SMS_data]
+
+        interpolated[T0] = (np.concatenate(EC_values, axis = 1), np.concatenate(SMS_values, axis = 1))
+
+    return interpolated
+
+
+def stage_build_T0(root, config, store, save_path):
+    '''
+    func: 用ComposeMultipleData.get_T_0_TRAIN_dataset()构建每个时刻的T0数据集(加密观测 + EC + SMS)，写入store
+    inputs:
+        save_path: 中间结果的目录, 构建清单保存为 save_path/T0_manifest.json
+    return:
+        写入的时刻数
+    '''
+    paths = dataset_paths(root)
+    T0_times, _ = bench_times(config)
+    manifest = BuildManifest(os.path.join(save_path, 'T0_manifest.json'))
+
+    #构建函数内部会改变工作目录
+    cwd = os.getcwd()
+    try:
+        for T0 in T0_times:
+            compose = ComposeMultipleData('/'.join([paths['jiami'], T0 + '.txt']), paths['station_file'],
+                                          os.path.dirname(paths['EC']), paths['SMS'], os.path.join(save_path, 'T0'))
+            compose.EC_filename_list_path = paths['EC_list']
+            compose.get_T_0_TRAIN_dataset(manifest = manifest, store = store)
+    finally:
+        os.chdir(cwd)
+
+    store.flush()
+
+    return len(store.times)
+
+
+def stage_verify(store, thresholds):
+    '''
+    func: 观测3小时降水 与 EC/SMS 3小时降水的检验，按时刻(小时)分组
+    return:
+        pd.DataFrame, grouped_scores()的输出 + 'model'列
+    '''
+    cube = store.read_cube(features = ['0_T-0_surface_r3-p', '0_T-0_ECthin_TP-r3', '0_T-0_SMS_ACC-r3'])
+    hours = np.array([int(t[-2:]) for t in store.times])
+
+    all_scores = []
+    for k, model in [(1, 'EC'), (2, 'SMS')]:
+        scores = grouped_scores(cube[:, :, 0], cube[:, :, k], {'hour': hours[:, None]}, thresholds)
+        scores.insert(0, 'model', model)
+        all_scores.append(scores)
+    perf.count('samples_verified', 2 * int(np.count_nonzero(~np.isnan(cube[:, :, 0]))))
+
+    return pd.concat(all_scores, axis = 0)
+
+
+#%%
+##############################报告 ############################################
+
+stages = ['parse', 'interpolate', 'build_T0', 'build_lags', 'verify']
+
+
+def _repo_version():
+    '''
+    func: 当前代码的版本(git commit)，不是git仓库时为None
+    '''
+    try:
+        repo = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = repo, capture_output = True,
+                                text = True, timeout = 10).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd = repo,
+                               capture_output = True, text = True, timeout = 30).stdout.strip()
+        return (commit + ('-dirty' if dirty else '')) if commit else None
+    except Exception:
+        return None
+
+
+def run_benchmark(root, config = 'small', label = None, repeat = 1, overwrite = False, **kwargs):
+    '''
+    func: 生成(或复用)模拟数据，依次运行并计时 parse -> interpolate -> build_T0 -> build_lags -> verify
+    inputs:
+        root: 模拟数据和中间结果(root/work)的目录
+        config: bench_configs中的名称或者dict; kwargs: 覆盖配置中的值, eg: n_station = 1000
+        label: 报告的标签, eg: 'v1'，默认为代码版本(git commit)
+        repeat: 重复次数，各阶段取最短的耗时
+        overwrite: 是否重新生成模拟数据
+    return:
+        report: dict
+            'stage_totals': {阶段: 耗时(s)}, 用于不同版本之间的比较
+            'stages': 各阶段(包括内部的函数)的耗时汇总表(最后一次运行)
+            'counters': 计数器(最后一次运行)
+            'throughput': 各阶段的吞吐量
+    '''
+    was_enabled = perf.is_enabled()
+    perf.enable()
+    perf.reset()
+
+    t1 = time.time()
+    #构建函数内部会改变工作目录，root必须为绝对路径
+    root = os.path.abspath(root)
+    config = generate_dataset(root, config, overwrite = overwrite, **kwargs)
+    generate_cost = time.time() - t1
+
+    paths = dataset_paths(root)
+    work_path = os.path.join(root, 'work')
+
+    runs = []
+    try:
+        for _ in range(repeat):
+            perf.reset()
+            if os.path.exists(work_path):
+                shutil.rmtree(work_path)
+            os.makedirs(work_path)
+
+            catalog = StationCatalog.load(paths['station_file'])
+
+            with perf.timer('parse'):
+                parsed = stage_parse(root, config)
+            parse_counters = perf.counters()
+
+            with perf.timer('interpolate'):
+                stage_interpolate(parsed, catalog)
+            interpolate_counters = perf.counters()
+
+            store = StationCubeStore(os.path.join(work_path, 'T0.h5'), mode = 'w')
+            try:
+                n_T0 = stage_build_T0(root, config, store, work_path)
+                lag_counts = write_lag_datasets(store, os.path.join(work_path, 'lags'), time_gaps = config['time_gaps'])
+                with perf.timer('verify'):
+                    scores = stage_verify(store, config['thresholds'])
+            finally:
+                store.close()
+
+            table = perf.summary()
+            top = table[table['depth'] == 0].set_index('stage')['total_s']
+            runs.append({'stage_totals': {stage: float(top.get(stage, np.nan)) for stage in stages},
+                         'stages': table, 'counters': perf.counters(),
+                         'parse_counters': parse_counters,
+                         'interpolate_vars': interpolate_counters.get('vars_interpolated', 0) -
+                                             parse_counters.get('vars_interpolated', 0),
+                         'n_T0': n_T0, 'lag_counts': lag_counts, 'n_scores': len(scores)})
+    finally:
+        if not was_enabled:
+            perf.disable()
+
+    last = runs[-1]
+    stage_totals = {stage: min(run['stage_totals'][stage] for run in runs) for stage in stages}
+    counters = last['counters']
+
+    def rate(n, stage):
+        return float(n) / stage_totals[stage] if stage_totals[stage] > 0 else None
+
+    report = {
+        'label': label if label is not None else _repo_version(),
+        'version': _repo_version(),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': config,
+        'environment': {'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__,
+                        'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'repeat': repeat,
+        'generate_s': generate_cost,
+        'stage_totals': stage_totals,
+        'total_s': float(sum(stage_totals.values())),
+        'throughput': {'parse_MB_per_s': rate(last['parse_counters'].get('bytes_parsed', 0) / 1e6, 'parse'),
+                       'parse_files_per_s': rate(last['parse_counters'].get('files_read', 0), 'parse'),
+                       'interpolate_vars_per_s': rate(last['interpolate_vars'], 'interpolate'),
+                       'build_T0_times_per_s': rate(last['n_T0'], 'build_T0'),
+                       'build_lags_samples_per_s': rate(sum(last['lag_counts'].values()), 'build_lags'),
+                       'verify_samples_per_s': rate(counters.get('samples_verified', 0), 'verify')},
+        'counters': counters,
+        'stages': last['stages'].to_dict(orient = 'records'),
+        'runs': [run['stage_totals'] for run in runs],
+    }
+
+    return report
+
+
+def save_report(report, save_file):
+    '''
+    func: 保存报告为JSON
+    '''
+    save_path = os.path.dirname(save_file)
+    if save_path != '' and not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    with open(save_file, 'w', encoding = 'utf-8') as f:
+        json.dump(report, f, ensure_ascii = False, indent = 1, default = str)
+
+    return save_file
+
+
+def load_report(report_file):
+    with open(report_file, 'r', encoding = 'utf-8') as f:
+        return json.load(f)
+
+
+def print_report(report):
+    '''
+    func: 打印报告中各阶段的耗时和吞吐量
+    '''
+    print('benchmark: {} ({}), config: {}, n_station = {}, n_times = {}'.format(
+        report['label'], report['version'], report['config']['name'], report['config']['n_station'],
+        report['config']['n_times']))
+    for stage in stages:
+        print('{:<16s}{:>10.3f}s'.format(stage, report['stage_totals'][stage]))
+    print('{:<16s}{:>10.3f}s'.format('total', report['total_s']))
+    for name, value in report['throughput'].items():
+        print('{:<28s}{:>12}'.format(name, '-' if value is None else '{:.2f}'.format(value)))
+
+    return None
+
+
+def compare_reports(reports, base = 0):
+    '''
+    func: 比较多个报告各阶段的耗时
+    inputs:
+        reports: 报告(dict)或报告文件路径的列表
+        base: 作为基准的报告的位置，默认第0个
+    return:
+        pd.DataFrame, 行为各阶段 + 'total'，列为各报告的耗时(s) 以及相对基准的加速比 'speedup(label)'
+    '''
+    reports = [load_report(r) if isinstance(r, str) else r for r in reports]
+
+    #配置不同时，耗时不可比
+    names = set((r['config']['name'], r['config']['n_station'], r['config']['n_times']) for r in reports)
+    if len(names) > 1:
+        print('warning! reports have different configs: {}'.format(sorted(names)))
+
+    labels = []
+    for i, r in enumerate(reports):
+        label = str(r['label'])
+        labels.append(label if label not in labels else '{}#{}'.format(label, i))
+
+    table = pd.DataFrame({label: [r['stage_totals'][stage] for stage in stages] + [r['total_s']]
+                          for label, r in zip(labels, reports)}, index = stages + ['total'])
+
+    for label in labels:
+        if label != labels[base]:
+            table['speedup({})'.format(label)] = table[labels[base]] / table[label]
+
+    return table
+
+
+#%%
+if __name__ == '__main__':
+    root = 'D:/zhongqi/bench'
+    report = run_benchmark(root, config = 'small')
+    print_report(report)
+    save_report(report, os.path.join(root, 'report_{}.json'.format(report['label'])))
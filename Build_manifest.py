@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+构建T0/T-gap数据集时使用的 build manifest(构建清单)
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    BuildManifest  记录每个输出文件对应的所有输入文件 + 特征配置的指纹，
+                   只有输入(或配置)发生变化的输出文件才需要重新构建
+    atomic_to_csv() 以原子方式写csv文件: 先写临时文件，写完后再os.replace为目标文件，
+                    避免程序中断时留下写了一半的文件
+    atomic_write_json() 以同样的方式写json文件(eg: 性能统计、Chrome trace)
+    atomic_to_pickle()  以同样的方式写pickle文件(eg: 底图缓存)
+
+manifest文件为逐行追加的json(json lines)，每行记录一个输出文件:
+    {"output": 输出文件, "inputs": {输入文件: 指纹}, "config": 配置指纹}
+    同一输出文件出现多次时，以最后一行为准；最后一行若因程序中断而不完整，则直接忽略。
+
+文件指纹为 [size, mtime_ns, md5]:
+    先比较 size 和 mtime，二者一致则认为文件未改变(不需要重新读取文件)；
+    若 mtime 改变但 md5 一致(如文件被重新拷贝)，仍认为文件未改变。
+输入不是单独的文件时(eg: HDF5 store中的某个时刻 'T0.h5::2018080420')，由调用者通过fingerprints参数
+传入其md5(eg: StationCubeStore.time_digest)，记录为 [None, None, md5]。
+'''
+#%%
+
+import os
+import json
+import pickle
+import hashlib
+
+
+class BuildManifest():
+    '''
+    func: 构建清单。记录每个输出文件由哪些输入文件(及其指纹)和哪个特征配置生成，
+          用于判断输出文件是否需要重新构建
+    Parameter
+    ----------------------------
+    manifest_file: str
+        清单文件的保存位置，eg: 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0/build_manifest.json'
+
+    用法:
+        manifest = BuildManifest(manifest_file)
+        if not manifest.is_up_to_date(save_file, input_files, config):
+            ...构建数据并 atomic_to_csv(data, save_file)
+            manifest.record(save_file, input_files, config)
+    '''
+    def __init__(self, manifest_file):
+
+        self.manifest_file = manifest_file
+
+        #{输出文件: {'inputs': {输入文件: 指纹}, 'config': 配置指纹}}
+        self.entries = {}
+
+        #本进程内已经计算过的文件指纹缓存, {文件: [size, mtime_ns, md5]}
+        #同一个输入文件(如EC_filename_list.xlsx、站点文件)会被很多输出共用，避免重复计算md5
+        self._fingerprint_cache = {}
+
+        self.load()
+
+    def load(self):
+        '''
+        func: 读取manifest文件。同一输出文件以最后一条记录为准，不完整的行直接跳过
+        '''
+        self.entries = {}
+
+        if not os.path.exists(self.manifest_file):
+            return None
+
+        with open(self.manifest_file, 'r', encoding = 'utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self.entries[entry['output']] = {'inputs': entry['inputs'],
+                                                     'config': entry['config']}
+                except Exception:
+                    #程序中断时最后一行可能不完整，跳过
+                    pass
+
+        return None
+
+    @staticmethod
+    def file_md5(filepath, chunk_size = 1 << 20):
+        '''
+        func: 分块计算文件的md5
+        '''
+        md5 = hashlib.md5()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def fingerprint(self, filepath, old = None):
+        '''
+        func: 获取文件指纹 [size, mtime_ns, md5]
+        inputs:
+            filepath: 文件路径
+            old: 该文件之前记录的指纹。如果size和mtime与old一致，则直接沿用old中的md5，不再读取文件
+        return:
+            [size, mtime_ns, md5]; 文件不存在时返回 None
+        '''
+        if not os.path.exists(filepath):
+            return None
+
+        stat = os.stat(filepath)
+        size, mtime = stat.st_size, stat.st_mtime_ns
+
+        cache = self._fingerprint_cache.get(filepath)
+        if cache is not None and cache[0] == size and cache[1] == mtime:
+            return cache
+
+        if old is not None and old[0] == size and old[1] == mtime:
+            fp = [size, mtime, old[2]]
+        else:
+            fp = [size, mtime, self.file_md5(filepath)]
+
+        self._fingerprint_cache[filepath] = fp
+
+        return fp
+
+    @staticmethod
+    def config_fingerprint(config):
+        '''
+        func: 计算特征配置的指纹
+        inputs:
+            config: 可以被json序列化的对象(dict/list/str)，eg: {'EC_filename_list': 指纹, 'loc_range': [30,50,105,125]}
+        return:
+            md5 字符串
+        '''
+        config_str = json.dumps(config, sort_keys = True, ensure_ascii = False, default = str)
+        return hashlib.md5(config_str.encode('utf-8')).hexdigest()
+
+    def _input_fingerprint(self, filepath, old = None, fingerprints = None):
+        '''
+        func: 输入的指纹: fingerprints中给定md5的输入为 [None, None, md5]，否则为文件指纹
+        '''
+        if fingerprints is not None and filepath in fingerprints:
+            return [None, None, fingerprints[filepath]]
+
+        return self.fingerprint(filepath, old = old)
+
+    def is_up_to_date(self, output_file, input_files, config = None, output_exists = None,
+                      fingerprints = None):
+        '''
+        func: 判断output_file是否为最新，即:
+              1. output_file存在，且manifest中有其记录;
+              2. 特征配置未变化;
+              3. 输入文件列表未变化，且每个输入文件的内容都未变化
+        inputs:
+            output_file: 输出文件路径
+            input_files: 生成output_file需要的所有输入文件路径列表
+            config: 特征配置，见config_fingerprint()
+            output_exists: bool or None
+                输出是否存在。默认None，即使用os.path.exists(output_file)判断;
+                当输出不是单独的文件时(eg: HDF5 store中的某个时刻)，由调用者判断后传入
+            fingerprints: dict or None
+                不是单独文件的输入的md5, {输入: md5}, eg: {'D:/.../T0.h5::2018080420': store.time_digest('2018080420')}
+        return:
+            bool
+        '''
+        if output_exists is None:
+            output_exists = os.path.exists(output_file)
+
+        if not output_exists:
+            return False
+
+        entry = self.entries.get(output_file)
+        if entry is None:
+            return False
+
+        if entry['config'] != self.config_fingerprint(config):
+            return False
+
+        old_inputs = entry['inputs']
+        if set(old_inputs.keys()) != set(input_files):
+            return False
+
+        for filepath in input_files:
+            old = old_inputs[filepath]
+            new = self._input_fingerprint(filepath, old = old, fingerprints = fingerprints)
+            if new is None or old is None or new[2] != old[2]:
+                return False
+
+        return True
+
+    def record(self, output_file, input_files, config = None, fingerprints = None):
+        '''
+        func: output_file构建完成后，记录其输入文件指纹和配置指纹，并追加写入manifest文件
+        inputs:
+            fingerprints: 不是单独文件的输入的md5，见is_up_to_date()
+        '''
+        old_entry = self.entries.get(output_file, {'inputs': {}})
+        inputs = {filepath: self._input_fingerprint(filepath, old = old_entry['inputs'].get(filepath),
+                                                    fingerprints = fingerprints)
+                  for filepath in input_files}
+
+        entry = {'inputs': inputs, 'config': self.config_fingerprint(config)}
+        self.entries[output_file] = entry
+
+        save_dir = os.path.dirname(self.manifest_file)
+        if save_dir and not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+
+        #逐行追加写入，每条记录单独flush，中断时最多丢失最后一条记录
+        line = json.dumps(dict(output = output_file, **entry), ensure_ascii = False)
+
+        #如果上次写入时中断，最后一行不完整(没有换行符)，则先换行，避免新记录接在不完整的行后面
+        if os.path.exists(self.manifest_file) and os.path.getsize(self.manifest_file) > 0:
+            with open(self.manifest_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    line = '\n' + line
+
+        with open(self.manifest_file, 'a', encoding = 'utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        return None
+
+    def compact(self):
+        '''
+        func: 重写manifest文件，每个输出文件只保留最新的一条记录。以原子方式写入
+        '''
+        tmp_file = '{}.tmp-{}'.format(self.manifest_file, os.getpid())
+        with open(tmp_file, 'w', encoding = 'utf-8') as f:
+            for output_file, entry in self.entries.items():
+                f.write(json.dumps(dict(output = output_file, **entry), ensure_ascii = False) + '\n')
+        os.replace(tmp_file, self.manifest_file)
+
+        return None
+
+
+def atomic_to_csv(data, save_file, **kwargs):
+    '''
+    func: 以原子方式保存pd.DataFrame为csv文件。先写入同目录下的临时文件，写完后os.replace为save_file;
+          如果写入过程中程序中断，save_file要么不存在，要么仍为旧的完整文件
+    inputs:
+        data: pd.DataFrame
+        save_file: 保存的文件路径 + 文件名
+        kwargs: 传给 data.to_csv 的其他参数
+    '''
+    tmp_file = '{}.tmp-{}'.format(save_file, os.getpid())
+    try:
+        data.to_csv(tmp_file, **kwargs)
+        os.replace(tmp_file, save_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    return None
+
+
+def atomic_write_json(data, save_file, **kwargs):
+    '''
+    func: 以原子方式保存json文件，与atomic_to_csv一样先写入带进程号的临时文件再os.replace，
+          多个进程写同一个文件时不会互相覆盖临时文件; 写入失败时删除临时文件
+    inputs:
+        data: 可以被json序列化的对象
+        save_file: 保存的文件路径 + 文件名
+        kwargs: 传给 json.dump 的其他参数, eg: ensure_ascii = False, indent = 1
+    '''
+    tmp_file = '{}.tmp-{}'.format(save_file, os.getpid())
+    try:
+        with open(tmp_file, 'w', encoding = 'utf-8') as f:
+            json.dump(data, f, **kwargs)
+        os.replace(tmp_file, save_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    return None
+
+
+def atomic_to_pickle(obj, save_file, protocol = pickle.HIGHEST_PROTOCOL):
+    '''
+    func: 以原子方式保存pickle文件，临时文件的命名和清理与atomic_write_json一致
+    inputs:
+        obj: 可以被pickle的对象
+        save_file: 保存的文件路径 + 文件名
+    '''
+    tmp_file = '{}.tmp-{}'.format(save_file, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(obj, f, protocol = protocol)
+        os.replace(tmp_file, save_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    return None
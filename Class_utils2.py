@@ -8,18 +8,26 @@ Created on Tue May 26 11:36:55 2020
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.interpolate import griddata
 import os
-from mpl_toolkits.basemap import Basemap
 import numpy.ma as ma
 import datetime
 import time
-import netCDF4 as nc
-import h5py
+#绘图、netCDF、HDF5 和 scipy.interpolate 在第一次使用时才导入(见Lazy_import.py)
+from Lazy_import import LazyModule, LazyAttr, set_chinese_font
+plt = LazyModule('matplotlib.pyplot', on_import = set_chinese_font)
+Basemap = LazyAttr('mpl_toolkits.basemap', 'Basemap')
+griddata = LazyAttr('scipy.interpolate', 'griddata')
+nc = LazyModule('netCDF4')
+h5py = LazyModule('h5py')
+from Build_manifest import BuildManifest, atomic_to_csv
+from Station_store import StationCubeStore
+from Lag_features import write_lag_datasets, lag_inputs
+from EC_feature_spec import get_EC_feature_kernel
+from Map_utils import block_reduce, quicklook_factor, decimate_grid
+from Shard_utils import shard_store_file, open_shard_store, merge_shard_stores
+from Station_catalog import StationCatalog
+import Perf_utils as perf
 
-plt.rcParams['font.sans-serif']=['SimHei'] #用来正常显示中文标签
-plt.rcParams['axes.unicode_minus']=False #用来正常显示负号
 
 #%%
 class ComposeMultipleData():
@@ -79,15 +87,15 @@ class ComposeMultipleData():
         # eg: 'D:/zhongqi/ori_data/Train_Dataset/all_jiami_stations_lon_lat_alt.csv'
         self.all_station_file = all_station_file
         
-        station_lon_lat_pd = pd.read_csv(self.all_station_file)
-        all_station = list(station_lon_lat_pd['station_num'])
-        # all_station = [str(station) for station in all_station]
-        self.all_station = all_station
-        self.all_lon = list(station_lon_lat_pd['lon'])
-        self.all_lat = list(station_lon_lat_pd['lat'])
-        self.all_height = list(station_lon_lat_pd['height'])
+        #站点表在同一进程内只读取一次(按文件路径和修改时间缓存)，所有实例共用同一组只读数组
+        self.station_catalog = StationCatalog.load(self.all_station_file)
+        self.all_station = self.station_catalog.station_num
+        self.all_lon = self.station_catalog.lon
+        self.all_lat = self.station_catalog.lat
+        self.all_height = self.station_catalog.height
         
         
+    @perf.timed()
     def read_micaps_data(self, filename):
         
         '''
@@ -97,6 +105,7 @@ class ComposeMultipleData():
         return:
             data：每行都为 array数组
         '''
+        perf.count_file(filename)
         f=open(filename,mode='r')
         
         #此时每行的都为 字符格式
@@ -129,6 +138,7 @@ class ComposeMultipleData():
         
         return data
     
+    @perf.timed()
     def get_station_data(self, filename,file_type = 'r6-p',loc_range = [18,54,73,135]):
     
         '''
@@ -153,6 +163,7 @@ class ComposeMultipleData():
             
         ''' 
         
+        perf.count_file(filename)
         f=open(filename,mode='r')
         
         #此时每行的都为 字符格式
@@ -225,6 +236,7 @@ class ComposeMultipleData():
     
         return station_data
     
+    @perf.timed()
     def get_jiami_obs(self, abs_file, filetype = 'pd', sort = True):
         
         '''
@@ -246,15 +258,15 @@ class ComposeMultipleData():
              '小时降水量', 'C2分钟风向', 'C2分钟平均风速', '最大风速的风向', '最大风速']
             
         '''
+        perf.count_file(abs_file)
         #由于abs_file里含有中文，不同平台的默认编码方式不同，可能会出错
+        #(解码错误在读取时才出现，因此读取也要放在try中)
         try:
-            f = open(abs_file,'r')
-        except Exception as e:
-            f = open(abs_file,'r',encoding = 'GBK')
-            
-        #读取所有行
-        str_data = f.readlines()  
-        f.close()
+            with open(abs_file,'r') as f:
+                str_data = f.readlines()  #读取所有行
+        except UnicodeDecodeError as e:
+            with open(abs_file,'r',encoding = 'GBK') as f:
+                str_data = f.readlines()
         
         #去掉换行符，并将字符串分开
         data = [line_data.strip().split(',') for line_data in str_data]
@@ -275,7 +287,7 @@ class ComposeMultipleData():
         for index,line_data in enumerate(station_data[0:]):
             all_stations.append(str(line_data[0]))
             all_times.append(line_data[1])
-            np_line_data = [np.float(var) if len(var) > 0 else np.nan for var in line_data[2:]]
+            np_line_data = [float(var) if len(var) > 0 else np.nan for var in line_data[2:]]
             valid_station_data[index,:] = np_line_data[0:]
           
         #去掉时间列
@@ -288,13 +300,14 @@ class ComposeMultipleData():
             pd_data[column] = valid_station_data[:,i]
             
         if sort:
-            pd_data = pd_data.sort_values('站号', ascending=bool)
+            pd_data = pd_data.sort_values('站号', ascending=True)
             pd_data.index = range(len(pd_data))
         
         return pd_data if filetype == 'pd' else pd_data.values
 
 
-    def get_EC_thin_data(self,filename,plot = True,label_gap = 2):
+    @perf.timed()
+    def get_EC_thin_data(self,filename,plot = True,label_gap = 2, quicklook = False):
         '''
         func:获取EC_thin的数据(不包括 EC_thin/physic底下的物理量)，默认EC_thin的数据是 等经纬网格的;
         doc: 空间分辨率为 0.125*0.125 或者 0.25*0.25 ; 时间分辨率为3小时
@@ -303,6 +316,7 @@ class ComposeMultipleData():
                       eg: 'D:/zhongqi/ori_data/20180806/micaps/ecmwf_thin/10u/999/18040808.006'
             plot: 默认True，绘制数据场
             label_gap: Plot中，x和y label的坐标经纬度间隔
+            quicklook: 默认False; True时先将降水场按块取最大值降采样到图片的像素数，再画图(只影响画图，不影响返回的数据)
         
         return:
             lon_grid : 场对应的经度信息
@@ -313,6 +327,7 @@ class ComposeMultipleData():
             
         '''
         
+        perf.count_file(filename)
         f=open(filename,mode='r')
         
         #此时每行的都为 字符格式
@@ -369,9 +384,16 @@ class ComposeMultipleData():
         #将降水场可视化出来
         if plot: 
             
-            plt.figure(figsize = (16,10))
+            fig = plt.figure(figsize = (16,10))
             
-            cs = plt.contourf(tp[-1::-1], 
+            #quicklook: 降水场按块取最大值降采样(降采样倍数由坐标区的像素数确定)，x/y为降采样后每块中心的index
+            plot_tp = tp[-1::-1]
+            factor = quicklook_factor(plot_tp.shape, fig.dpi*16*0.775, fig.dpi*10*0.77) if quicklook else 1
+            plot_tp = block_reduce(plot_tp, factor, 'max')
+            plot_x = np.arange(plot_tp.shape[1])*factor + (factor - 1)/2
+            plot_y = np.arange(plot_tp.shape[0])*factor + (factor - 1)/2
+            
+            cs = plt.contourf(plot_x, plot_y, plot_tp, 
     #                          levels= np.arange(0,32+1,4), 
                                extend='both',
                                cmap = plt.cm.rainbow) #extend参数使得colorbar两端变尖
@@ -405,6 +427,7 @@ class ComposeMultipleData():
         
         return rain_info
     
+    @perf.timed()
     def get_EC_thin_physic_data(self, filename,plot = True,label_gap = 2):
         '''
         func:获取EC_thin/physic路径下的物理量，默认EC_thin的数据是 等经纬网格的;
@@ -431,6 +454,7 @@ class ComposeMultipleData():
             
         '''
         
+        perf.count_file(filename)
         f=open(filename,mode='r')
         
         #此时每行的都为 字符格式
@@ -616,7 +640,7 @@ class ComposeMultipleData():
      
         return None
                 
-    def contourf_data_on_map(self,data,lon_grid,lat_grid,gap = 5):
+    def contourf_data_on_map(self,data,lon_grid,lat_grid,gap = 5, quicklook = False, how = 'mean'):
         '''
         func: 传入数据和对应的经纬范围，将数据叠加在地图底图上
         inputs:
@@ -624,6 +648,8 @@ class ComposeMultipleData():
             lon_grid : 网格经度
             lat_grid ：网格纬度
             gap : 地图上横纵坐标显示的经纬度数值间隔。即tick_gap
+            quicklook: 默认False; True时先将网格降采样到图片的像素数再画图
+            how: quicklook的降采样方式: 'max'(降水) 或 'mean'(其他要素)
         return 
             输出一张图
             return None
@@ -653,6 +679,11 @@ class ComposeMultipleData():
             lat_grid = lat_grid[-1::-1]
             data = data[-1::-1]
             
+        #quicklook: 降采样到坐标区(figsize*0.8)的像素数
+        if quicklook:
+            data, lon_grid, lat_grid = decimate_grid(data, lon_grid, lat_grid, how = how,
+                                                     width = fig.dpi*14*0.8, height = fig.dpi*8*0.8)
+            
         h = m.contourf(lon_grid,lat_grid,data,
     #                   levels= np.arange(0,32+1,4),
                        extend='both',
@@ -828,6 +859,7 @@ class ComposeMultipleData():
         
         return [int(index_lat),int(index_lon)]
 
+    @perf.timed()
     def grid_interp_to_station(self, all_data, station_lon,station_lat ,method = 'linear'):
         '''
         func: 将等经纬度网格值 插值到 离散站点。使用griddata进行插值
@@ -850,6 +882,7 @@ class ComposeMultipleData():
         station_value = griddata(points,data,(station_lon,station_lat),method=method)
         
         station_value = station_value[:,:,0]
+        perf.count('vars_interpolated')
         
         return station_value
     
@@ -1186,6 +1219,71 @@ class ComposeMultipleData():
                     
             return data
 
+    def drop_outlier_batch(self, x, max_threshold=50, min_threshold=1, flag_only = False):
+        '''
+        func: 批量处理离群值。对x的每个时刻(第0维)分别做与drop_outlier()相同的处理，
+              但所有时刻的 平均值/标准差/最大值 都由沿非时间维的向量化统计一次得到，不需要逐个时刻循环
+              每个时刻:
+                  outlier_threshold = mean + 3*std (只统计 >= min_threshold 的值)
+                  如果 outlier_threshold >= 最大值: 无异常
+                  否则，>= max(outlier_threshold, max_threshold) 的值修正为 max(outlier_threshold, max_threshold)
+        Parameter
+        ---------
+        x: np.array or np.ma.MaskedArray
+            shape = (time, ny, nx) 或 (time, station), 第0维为时间; nan和被mask的值不参与统计，也不会被修改
+        max_threshold: int
+            default 50, 1小时降水量最大正常值
+        min_threshold: int
+            default 1, 使用data >= min_threshold 的样本去做降水分布分析
+        flag_only: bool
+            default False; 为True时只标记异常值，不修改数据
+        return
+        ---------
+        data: 修正后的数据，float64, 与x的shape一致(x为MaskedArray时，返回MaskedArray，mask与x一致)
+        flags: bool数组，与x的shape一致, True为被修正(或标记)的异常值
+        '''
+        mask = None
+        if np.ma.isMaskedArray(x):
+            mask = np.ma.getmaskarray(x)
+            data = x.astype(np.float64).filled(np.nan)
+        else:
+            data = np.array(x, dtype = np.float64)
+
+        n_time = data.shape[0]
+        flat = data.reshape(n_time, -1)
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            #每个时刻 >= min_threshold 的值的个数、平均值和标准差(与np.std一致，ddof = 0)
+            valid = flat >= min_threshold
+            count = np.count_nonzero(valid, axis = 1)
+            mean = np.sum(np.where(valid, flat, 0), axis = 1) / count
+            std = np.sqrt(np.sum(np.where(valid, np.square(flat - mean[:, None]), 0), axis = 1) / count)
+
+            #设置最小异常值
+            outlier_threshold = mean + 3*std
+            max_value = np.max(np.where(np.isnan(flat), -np.inf, flat), axis = 1)
+
+            #异常阈值 < 最大值时存在异常(没有 >= min_threshold 的值时，异常阈值为nan，同样按存在异常处理)
+            has_outlier = ~(outlier_threshold >= max_value)
+
+            #异常阈值 > max_threshold时修正为异常阈值，否则修正为max_threshold
+            clip_value = np.where(outlier_threshold >= max_threshold, outlier_threshold, max_threshold)
+
+            flags = has_outlier[:, None] & (flat > clip_value[:, None])
+
+        if not flag_only:
+            flat[flags] = np.broadcast_to(clip_value[:, None], flat.shape)[flags]
+
+        data = flat.reshape(data.shape)
+        flags = flags.reshape(data.shape)
+
+        if mask is not None:
+            data = np.ma.array(data, mask = mask)
+
+        return data, flags
+
+
+    @perf.timed()
     def get_all_surface_station_Dataset(self, r_filepath,
                                        loc_range = [30,50,105,125],
                                        filetype = 'array'):
@@ -1277,23 +1375,23 @@ class ComposeMultipleData():
         ########################################
         
         #按站台号排序
-        all_vars_data = pd.DataFrame(all_vars_data,columns = columns).sort_values('station_num', ascending=bool)
+        all_vars_data = pd.DataFrame(all_vars_data,columns = columns).sort_values('station_num', ascending=True)
         
         #如果all_vars_data里存在不在all_station列表里面的站点，则删除该站点样本
-        obs_station = list(all_vars_data['station_num'])
-        error_station_index = [obs_station.index(station) for station in obs_station if station not in self.all_station]
+        obs_index = self.station_catalog.lookup(all_vars_data['station_num'])
+        error_station_index = list(np.where(obs_index < 0)[0])
         if len(error_station_index) > 0:
             all_vars_data = all_vars_data.drop(index = list(all_vars_data.index(error_station_index)))
             
         #获取当前文件中的站点序列在 all_station列表中的位置
-        index = [self.all_station.index(station) for station in list(all_vars_data['station_num'])]
+        index = self.station_catalog.lookup(all_vars_data['station_num'])
         all_vars_data = all_vars_data.values
         
         #构建文件：样本数为总站点数len(all_station)，index位置上填上对应的观测数据，其他的以np.nan填充
         all_vars_data_pad = np.zeros(shape = (len(self.all_station),all_vars_data.shape[1]))
         all_vars_data_pad = pd.DataFrame(all_vars_data_pad,columns = columns).replace(0, np.nan)
         
-        all_vars_data_pad.values[index] = all_vars_data
+        all_vars_data_pad.iloc[index] = all_vars_data
         
         all_vars_data_pad['station_num'] = self.all_station #填上所有站点
         all_vars_data_pad['lon'] = self.all_lon #填上所有站点的经度
@@ -1307,6 +1405,7 @@ class ComposeMultipleData():
         return all_vars_data_pad    
     
     
+    @perf.timed()
     def get_T0_jiami_surface_station_Dataset(self, jiami_filepath,
                                        loc_range = [30,50,105,125],
                                        filetype = 'pd'):
@@ -1330,9 +1429,9 @@ class ComposeMultipleData():
        # 'C2分钟平均风速', '最大风速的风向', '最大风速']
         
         #剔除jiami_data中某些 不在 self.all_station中的站点观测，并为其他站点加上[经度、纬度、高度]信息
-        obs_station = list(jiami_data['站号'])
-        # print('obs_station length:',len(obs_station))
-        error_station_index = [obs_station.index(station) for station in obs_station if station not in self.all_station]
+        #观测站点在self.all_station中的index(哈希查找)，不在其中的为 -1
+        obs_index = self.station_catalog.lookup(jiami_data['站号'])
+        error_station_index = list(np.where(obs_index < 0)[0])
         if len(error_station_index) > 0:  
             jiami_data = jiami_data.drop(index = error_station_index) 
             jiami_data.index = range(len(jiami_data))  #index重新排序
@@ -1342,9 +1441,7 @@ class ComposeMultipleData():
         ########################################
         
         #获取剩下的obs_station在所有self.all_station中的index
-        new_obs_station = list(jiami_data['站号'])
-        # print('obs_station length:',len(new_obs_station))
-        index = [self.all_station.index(station) for station in new_obs_station]
+        index = obs_index[obs_index >= 0]
         
         
         #  ['站号', '气温', '最高气温', '最低气温', '露点温度', '相对湿度', '小时降水量', 'C2分钟风向',
@@ -1371,23 +1468,23 @@ class ComposeMultipleData():
         all_vars_data_pad = np.zeros(shape = (len(self.all_station),len(columns_en)))
         all_vars_data_pad = pd.DataFrame(all_vars_data_pad,columns = columns_en).replace(0, np.nan)
         
-        all_vars_data_pad['0_T-0_surface_r1-p'].values[index] = jiami_data['小时降水量']
+        all_vars_data_pad.loc[index, '0_T-0_surface_r1-p'] = np.asarray(jiami_data['小时降水量'])
         all_vars_data_pad['station_num'] = self.all_station
         all_vars_data_pad['lon'] = self.all_lon
         all_vars_data_pad['lat'] = self.all_lat
         all_vars_data_pad['height'] = self.all_height
-        all_vars_data_pad['3_T-0_surface_plot-T'].values[index] = jiami_data['气温']
-        all_vars_data_pad['1_T-0_surface_plot-Td'].values[index] = jiami_data['露点温度']
-        all_vars_data_pad['1_T-0_surface_plot-RH'].values[index] = jiami_data['相对湿度']
-        all_vars_data_pad['2_T-0_surface_plot-wind-max'].values[index] = jiami_data['最大风速']
-        all_vars_data_pad['2_T-0_surface_plot-wind-max-dir'].values[index] = jiami_data['最大风速的风向']
-        all_vars_data_pad['2_T-0_surface_plot-cos(wind-max-dir)'].values[index] = np.cos(jiami_data['最大风速的风向']*np.pi/180)
-        all_vars_data_pad['2_T-0_surface_plot-sin(wind-max-dir)'].values[index] = np.sin(jiami_data['最大风速的风向']*np.pi/180)
-        
-        all_vars_data_pad['2_T-0_surface_plot-wind-mean'].values[index] = jiami_data['C2分钟平均风速']
-        all_vars_data_pad['2_T-0_surface_plot-wind-mean-dir'].values[index] = jiami_data['C2分钟风向']
-        all_vars_data_pad['2_T-0_surface_plot-cos(wind-mean-dir)'].values[index] = np.cos(jiami_data['C2分钟风向']*np.pi/180)
-        all_vars_data_pad['2_T-0_surface_plot-sin(wind-mean-dir)'].values[index] = np.sin(jiami_data['C2分钟风向']*np.pi/180)
+        all_vars_data_pad.loc[index, '3_T-0_surface_plot-T'] = np.asarray(jiami_data['气温'])
+        all_vars_data_pad.loc[index, '1_T-0_surface_plot-Td'] = np.asarray(jiami_data['露点温度'])
+        all_vars_data_pad.loc[index, '1_T-0_surface_plot-RH'] = np.asarray(jiami_data['相对湿度'])
+        all_vars_data_pad.loc[index, '2_T-0_surface_plot-wind-max'] = np.asarray(jiami_data['最大风速'])
+        all_vars_data_pad.loc[index, '2_T-0_surface_plot-wind-max-dir'] = np.asarray(jiami_data['最大风速的风向'])
+        all_vars_data_pad.loc[index, '2_T-0_surface_plot-cos(wind-max-dir)'] = np.asarray(np.cos(jiami_data['最大风速的风向']*np.pi/180))
+        all_vars_data_pad.loc[index, '2_T-0_surface_plot-sin(wind-max-dir)'] = np.asarray(np.sin(jiami_data['最大风速的风向']*np.pi/180))
+        
+        all_vars_data_pad.loc[index, '2_T-0_surface_plot-wind-mean'] = np.asarray(jiami_data['C2分钟平均风速'])
+        all_vars_data_pad.loc[index, '2_T-0_surface_plot-wind-mean-dir'] = np.asarray(jiami_data['C2分钟风向'])
+        all_vars_data_pad.loc[index, '2_T-0_surface_plot-cos(wind-mean-dir)'] = np.asarray(np.cos(jiami_data['C2分钟风向']*np.pi/180))
+        all_vars_data_pad.loc[index, '2_T-0_surface_plot-sin(wind-mean-dir)'] = np.asarray(np.sin(jiami_data['C2分钟风向']*np.pi/180))
                 
         if filetype == 'array':
             all_vars_data_pad = all_vars_data_pad.values
@@ -1395,6 +1492,7 @@ class ComposeMultipleData():
         return all_vars_data_pad  
         
     
+    @perf.timed()
     def get_T3_jiami_surface_station_Dataset(self,jiami_filepath,
                                        loc_range = [30,50,105,125],
                                        filetype = 'pd'):
@@ -1450,6 +1548,7 @@ class ComposeMultipleData():
         return np.array(data0.values) if filetype == 'array' else data0
         
         
+    @perf.timed()
     def get_all_ECthin_Station_dataset_ori(self,surface_file,loc_range = [30,50,105,125]):
         '''
         func: 根据surface_file的站点数据，获取对应的时刻的 EC细网格物理量资料，并将网格资料插值到站点
@@ -1485,7 +1584,6 @@ class ComposeMultipleData():
             print('Error!',EC_file0,'not exists! please check the file')
             
         else: 
-            t1 = time.time()
             
             for i in range(len(all_EC_filepath)):
                 
@@ -1503,7 +1601,6 @@ class ComposeMultipleData():
                 all_EC_file_stations_values.append(valid_EC_station_values)
             
             all_EC_file_stations_values = np.concatenate(all_EC_file_stations_values,axis = 1)
-            print('total time cost:',time.time()-t1)
         
     #        将数组转换为 DataFrame
             all_EC_file_stations_values = pd.DataFrame(all_EC_file_stations_values,
@@ -1518,72 +1615,18 @@ class ComposeMultipleData():
         func: 将 get_all_ECthin_Station_dataset_ori 函数的输入进行进一步特征组合。
         
         inputs: 
-            ori_data：为pd.DataFrame格式，其中每列为一个ECthin的物理量名称，共计45个物理量
+            ori_data：为pd.DataFrame格式，其中每列为一个ECthin的物理量名称，共计45个物理量;
+                    也可以为np.array, shape = (..., 45), eg: 整个时段所有站点的 (time, station, 45)
             filetype: 'array',默认输出为np.array类型。
-                    否则，默认输出为 pd.DataFrame类型
+                    否则，默认输出为 pd.DataFrame类型(此时ori_data必须为单个时刻的数据)
         return: 
-            返回 将一些物理量进行特征变化 的结果。其中每列为一个组合特征，共计45个特征
+            返回 将一些物理量进行特征变化 的结果。其中每列为一个组合特征，共计48个特征
         '''
         
-        #拷贝.可以保证后续不会修改ori_data的值
-        ori_data = ori_data.values.copy()
-        
-        rows,cols = ori_data.shape
-        dst_data = np.zeros((rows,cols + 3))
-        
-        print('ori_data.shape:',ori_data.shape)
-        print('dst_data.shape',dst_data.shape)
-    
-        #前11个变量不变
-        dst_data[:,0:11] = ori_data[:,0:11] 
-        
-        #mean(8,9,10),850/700/500hPa三层垂直速度平均
-        dst_data[:,11] = np.mean(ori_data[:,[8,9,10]],axis = 1) 
-        
-        dst_data[:,12:18] = ori_data[:,11:17]
-        
-        #1000/950/925/900/850/700hPa平均U
-        dst_data[:,18] = np.mean(ori_data[:,[17,18,19,20]],axis = 1) 
-        
-        #1000/950/925/900/850/700hPa平均V
-        dst_data[:,19] = np.mean(ori_data[:,[25,26,27,28]],axis = 1)
-        
-        #1000/950/925/900/850/700/600/500/400/300hPa平均U和Umax
-        dst_data[:,20] = np.mean(ori_data[:,[17,18,19,20,21,22,23,24]],axis = 1)
-        dst_data[:,21] = np.max(ori_data[:,[17,18,19,20,21,22,23,24]],axis = 1)
-        
-        #1000/950/925/900/850/700/600/500/400/300hPa平均V和Vmax
-        dst_data[:,22] = np.mean(ori_data[:,[25,26,27,28,29,30,31,32]],axis = 1)
-        dst_data[:,23] = np.max(ori_data[:,[25,26,27,28,29,30,31,32]],axis = 1)
-        
-        dst_data[:,24] = ori_data[:,22]
-        dst_data[:,25] = ori_data[:,30]
-        
-        #500hPa风向，用cos/sin表示，v大于0，则cos大于0;u > 0,sin > 0
-        dst_data[:,26] = ori_data[:,30]/np.sqrt(np.square(ori_data[:,22]) + np.square(ori_data[:,30])) #cos
-        dst_data[:,27] = ori_data[:,22]/np.sqrt(np.square(ori_data[:,22]) + np.square(ori_data[:,30])) #sin
-        
-        dst_data[:,28] = ori_data[:,19]
-        dst_data[:,29] = ori_data[:,27]
-        
-        #850hPa风向，用cos/sin表示，v大于0，则cos大于0; u > 0,sin > 0
-        dst_data[:,30] = ori_data[:,27]/np.sqrt(np.square(ori_data[:,19]) + np.square(ori_data[:,27])) #cos
-        dst_data[:,31] = ori_data[:,19]/np.sqrt(np.square(ori_data[:,19]) + np.square(ori_data[:,27])) #sin
-        
-     
-        dst_data[:,32] = ori_data[:,18]
-        dst_data[:,33] = ori_data[:,26]
-        
-        #925hPa风向，用cos/sin表示，v大于0，则cos大于0,u > 0,sin > 0
-        dst_data[:,34] = ori_data[:,26]/np.sqrt(np.square(ori_data[:,18]) + np.square(ori_data[:,26]))
-        dst_data[:,35] = ori_data[:,18]/np.sqrt(np.square(ori_data[:,18]) + np.square(ori_data[:,26]))
-        
-        
-        dst_data[:,36:42] = ori_data[:,33:39]
-        
-        #500hPa-850hPa的假相当位温差
-        dst_data[:,42] = ori_data[:,38]-ori_data[:,36]
-        dst_data[:,43:] = ori_data[:,40:]
+        #特征组合方式由EC_filename_list.xlsx的'Com_op'/'Com_src'两列配置，编译为向量化的计算核(按文件缓存)
+        #ori_data可以是单个时刻的(station, var)，也可以是整个时段的(time, station, var)，一次调用完成计算
+        kernel = get_EC_feature_kernel(self.EC_filename_list_path)
+        dst_data = kernel(ori_data.values if isinstance(ori_data, pd.DataFrame) else ori_data)
         
         #如果 filetype 为 'array',则输出np.array数组
         #否则输出 pd.DataFrame，columns为组合后的变量名称
@@ -1603,6 +1646,7 @@ class ComposeMultipleData():
         return dst_data
     
     
+    @perf.timed()
     def get_T0_SMS_Station_dataset(self, surface_file,loc_range = [30,50,105,125],
                                     filetype = 'pd',
                                     if_plot = False):
@@ -1648,11 +1692,11 @@ class ComposeMultipleData():
                       'REFC_P0_L10_GLC0']
                       
         
-        t1 = time.time()
         
         all_vars_grid_data = []
                 
         #读取SMS_file_time0文件中valid_vars变量的数据
+        perf.count_file(SMS_file_time0)
         f = nc.Dataset(SMS_file_time0)
         for var in valid_vars[0:]:
             data = f[var][:]
@@ -1676,7 +1720,6 @@ class ComposeMultipleData():
         
         #将格点插值到站点
         for var_name,grid_data in zip(valid_vars[0:],all_vars_grid_data[0:]):
-            t2 = time.time()
             
             #只考虑loc_range内的数据，加快插值速度
             grid_data = grid_data[index1][index2]
@@ -1690,7 +1733,6 @@ class ComposeMultipleData():
                                                              station_lat = self.all_lat,
                                                              method = 'linear')
             
-            print('cost:',time.time() - t2)
             all_vars_station_data.append(valid_vars_station_data)
         
         if if_plot:
@@ -1737,11 +1779,11 @@ class ComposeMultipleData():
             all_vars_station_data['lat'] = self.all_lat
             all_vars_station_data['height'] = self.all_height
             
-        print('total time cost:',time.time()-t1)
         
         return all_vars_station_data
 
 
+    @perf.timed()
     def get_T3_SMS_Station_dataset(self,surface_file,loc_range = [30,50,105,125],
                                     filetype = 'array',
                                     if_plot = False):
@@ -1801,7 +1843,6 @@ class ComposeMultipleData():
         if not os.path.exists(SMS_file_time2):
             print('Error!',SMS_file_time2 ,'not exits!')
         
-        t1 = time.time()
         
         all_vars_grid_data = []
         
@@ -1810,24 +1851,28 @@ class ComposeMultipleData():
         acc_r2 = 0
         acc_r1 = 0
         
-        i = 0
+        all_r1 = []
         for file in [SMS_file_time0,SMS_file_time1,SMS_file_time2]:
+            perf.count_file(file)
             f = nc.Dataset(file)
-            r1 = f[acc_var][:]
-            r1 = self.drop_outlier(r1)  #对异常值做修正
-            if i == 0:
-                acc_r1 = r1
-            acc_r3 = acc_r3 + r1
-            i = i + 1
+            all_r1.append(f[acc_var][:])
             f.close()
-            
-        acc_r2 = acc_r3 - r1
+        
+        #三个时刻一起做异常值修正, shape = (3, ny, nx)
+        all_r1, flags = self.drop_outlier_batch(np.ma.stack(all_r1))
+        if perf.is_enabled():
+            perf.count('outliers_corrected', int(np.count_nonzero(flags)))
+        
+        acc_r1 = all_r1[0]
+        acc_r3 = all_r1[0] + all_r1[1] + all_r1[2]
+        acc_r2 = acc_r3 - all_r1[2]
 
         all_vars_grid_data.append(acc_r3)
         all_vars_grid_data.append(acc_r2)
         all_vars_grid_data.append(acc_r1)
         
         #读取SMS_file_time0文件中valid_vars变量的数据
+        perf.count_file(SMS_file_time0)
         f = nc.Dataset(SMS_file_time0)
         for var in valid_vars[0:]:
             data = f[var][:]
@@ -1851,7 +1896,6 @@ class ComposeMultipleData():
         
         #将格点插值到站点
         for grid_data in all_vars_grid_data[0:]:
-            t2 = time.time()
             
             #只考虑loc_range内的数据，加快插值速度
             grid_data = grid_data[index1][index2]
@@ -1860,7 +1904,6 @@ class ComposeMultipleData():
                                                              station_lat = self.all_lat,
                                                              method = 'linear')
             
-            print('cost:',time.time() - t2)
             all_vars_station_data.append(valid_vars_station_data)
         
         if if_plot:
@@ -1908,18 +1951,67 @@ class ComposeMultipleData():
             all_vars_station_data['lat'] = self.all_lat
             all_vars_station_data['height'] = self.all_height
             
-        print('total time cost:',time.time()-t1)
         
         return all_vars_station_data
 
 
-    def get_T_0_TRAIN_dataset(self):
+    def get_T_0_input_files(self):
+        '''
+        func: 获取构建 self.surface_file 时刻的T0数据集所需要的所有输入文件,
+              包括: T/T-1/T-2时刻的加密观测文件，所有EC_thin物理量文件，T/T-1/T-2时刻的SMS文件，
+              以及站点文件和EC物理量列表文件
+        return:
+            list, 所有输入文件的路径
+        '''
+        surface_filepath = self.surface_file 
+        surface_time = surface_filepath.split('/')[-1].split('.')[0]
+        
+        input_files = [self.all_station_file, self.EC_filename_list_path]
+        
+        #T/T-1/T-2时刻的加密观测文件, 与get_T3_jiami_surface_station_Dataset一致
+        T0 = datetime.datetime.strptime(surface_time, '%Y%m%d%H')
+        input_files.append(surface_filepath)
+        for hour in [1,2]:
+            file_time = (T0 + datetime.timedelta(hours = -hour)).strftime('%Y%m%d%H')
+            input_files.append(surface_filepath.replace(surface_time, file_time))
+        
+        #所有EC_thin物理量文件, 与get_all_ECthin_Station_dataset_ori一致
+        EC_time = self.surface_time2_EC_BJ_time(surface_time)
+        EC_filename_list = pd.read_excel(self.EC_filename_list_path)
+        for EC_filepath in EC_filename_list['filepath'].dropna():
+            input_files.append(os.path.join(self.EC_path, EC_filepath.replace('EC_thin','ecmwf_thin'), EC_time))
+        
+        #T/T-1/T-2时刻的SMS文件, 与get_T3_SMS_Station_dataset一致
+        SMS_time = self.surface_time2_SMS_time(surface_time)
+        hour = SMS_time.split('.')[1]
+        input_files.append(os.path.join(self.SMS_path, SMS_time))
+        for det_h in [1,2]:
+            SMS_file = SMS_time.split('.')[0] + '.' + '00' + str(int(hour)-det_h) + '.nc'
+            input_files.append(os.path.join(self.SMS_path, SMS_file))
+        
+        return input_files
+    
+    
+    def get_T_0_TRAIN_dataset(self, manifest = None, store = None, shard = None):
         '''
         func: 输入降水站点观测文件名，得到同时刻的 地面观测+EC细网格资料+SMS华东区域 特征;
              每行表示一个站点,每列表示一个特征; 并保存为.csv文件,以surface_file的时间(eg:2018080420)为文件名
+             
+             只有当输出文件不存在，或者其输入文件(见get_T_0_input_files)/特征配置相比上次构建发生变化时，才重新构建;
+             输出文件以原子方式写入，构建中断不会留下不完整的文件
         inputs: 
             self.surface_file : 地面降水观测文件路径
             eg: 'D:/ori_data/aws_jiami/2018080420.txt'
+            manifest: BuildManifest or None
+                构建清单。多个时刻共用同一个manifest时，建议在外部创建后传入;
+                默认None, 则使用 save_path同级目录下的 'T0_manifest.json' (eg: .../T0 --> .../T0_manifest.json)
+            store: StationCubeStore or None
+                默认None, 即保存为 save_path/2018080420.csv;
+                否则将该时刻的数据追加写入HDF5 store，不再保存.csv文件
+            shard: ShardSpec or None
+                多机构建时的分片规则(见Shard_utils)。默认None，即构建所有时刻、所有站点;
+                按时间分片时，不属于该分片的时刻直接跳过; 按站点分片时，只保存属于该分片的站点。
+                此时store应为 open_shard_store 打开的部分store
         return:
             None
             
@@ -1938,38 +2030,65 @@ class ComposeMultipleData():
                     
         save_path = self.save_path
         
-        if not os.path.exists(save_path):
-            os.makedirs(save_path)
+        if shard is not None and not shard.owns_time(surface_time):
+            return None
+        
+        if store is None:
+            if not os.path.exists(save_path):
+                os.makedirs(save_path)
+            
+            save_file = os.path.join(save_path, surface_time + '.csv')
+            save_exists = None
+        else:
+            #store中的某个时刻, eg: D:/.../T0.h5::2018080420
+            save_file = store.store_file + '::' + surface_time
+            save_exists = store.has_time(surface_time)
+        
+        if manifest is None:
+            manifest = BuildManifest(save_path.rstrip('/\\') + '_manifest.json')
         
-        save_file = os.path.join(save_path, surface_time + '.csv')
+        #特征配置,配置改变时所有T0文件都需要重新构建
+        config = {'dataset': 'T0', 'loc_range': [30,50,105,125]}
         
         #保证所有文件都存在,否则就不能生成对应文件
         if os.path.exists(surface_filepath):
             if os.path.exists(EC_filepath):
                 if os.path.exists(SMS_filepath):
                     
-                    #如果已经存在save_path，则跳过
-                    if not os.path.exists(save_file):
+                    input_files = self.get_T_0_input_files()
+                    
+                    #如果save_file已经存在且其输入文件和配置都未改变，则跳过
+                    if not manifest.is_up_to_date(save_file, input_files, config, output_exists = save_exists):
                                             
-                        t1 = time.time()
-                        surface_data = self.get_T3_jiami_surface_station_Dataset(surface_filepath,filetype = 'pd')
-                        ori_EC_data = self.get_all_ECthin_Station_dataset_ori(surface_filepath)
-                        EC_data = self.get_all_ECthin_Station_dataset_dst(ori_EC_data,filetype = 'pd')
-                        SMS_data = self.get_T3_SMS_Station_dataset(surface_filepath,filetype = 'pd')
+                        with perf.timer('build_T0'):
+                            surface_data = self.get_T3_jiami_surface_station_Dataset(surface_filepath,filetype = 'pd')
+                            ori_EC_data = self.get_all_ECthin_Station_dataset_ori(surface_filepath)
+                            EC_data = self.get_all_ECthin_Station_dataset_dst(ori_EC_data,filetype = 'pd')
+                            SMS_data = self.get_T3_SMS_Station_dataset(surface_filepath,filetype = 'pd')
                         
                         
-                        EC_data = EC_data.drop(columns = ['station_num','lon','lat','height']) #去掉'station_num'等 
-                        SMS_data = SMS_data.drop(columns = ['station_num','lon','lat','height'])
+                            EC_data = EC_data.drop(columns = ['station_num','lon','lat','height']) #去掉'station_num'等 
+                            SMS_data = SMS_data.drop(columns = ['station_num','lon','lat','height'])
                         
     #                   先将所有的数据整理成一个pd
-                        all_type_data = pd.concat([surface_data,EC_data,SMS_data],axis = 1)
-                        all_type_data.to_csv(save_file)
-                        print('time cost: ',time.time() - t1)
+                            all_type_data = pd.concat([surface_data,EC_data,SMS_data],axis = 1)
+                        
+                            #按站点分片时，只保留该分片的站点
+                            if shard is not None and shard.by == 'station':
+                                all_type_data = all_type_data.iloc[shard.station_index(len(all_type_data))]
+                                all_type_data.index = range(len(all_type_data))
+                        
+                            if store is None:
+                                atomic_to_csv(all_type_data, save_file)
+                            else:
+                                store.append(surface_time, all_type_data)
+                                store.flush()
+                            manifest.record(save_file, input_files, config)
                         print(save_file,'save done!')
                         print()
                      
                     else: 
-                        print(save_file,'are ready exists!')
+                        print(save_file,'are ready exists and up to date!')
                 else:
                     print(SMS_filepath,'not exists! Error!')
             else:
@@ -2007,32 +2126,62 @@ class ComposeMultipleData():
 # composeData = ComposeMultipleData(surface_file, all_station_file,EC_path, SMS_path,save_path)
 
 #%%
-# 形成T0文件：加密观测 --- EC --- SMS
-case_times = ['20180806','20180807','20190804','20190812']
+if __name__ == '__main__':
+    # 形成T0文件：加密观测 --- EC --- SMS
+    case_times = ['20180806','20180807','20190804','20190812']
 
-all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv'
-save_path = 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0'
+    all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv'
+    save_path = 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0'
 
-for case_time in case_times[0:]:
-    
-    EC_path = os.path.join('D:/zhongqi/ori_data/', case_time ,'micaps')
-    SMS_path = os.path.join('D:/zhongqi/ori_data/', case_time , 'micaps/warr/nc')
-    
-    print(SMS_path)
-    
-    surface_path = 'D:/zhongqi/ori_data/aws_of_4_cases/'
-    file_list = os.listdir(surface_path)
-    for file in file_list[0:]:
-        if file.split('.')[0][-2:] in ['02','05','08','11','14','17','20','23']:
-            surface_file = os.path.join(surface_path, file)
-            composeData = ComposeMultipleData(surface_file, all_station_file,EC_path, SMS_path,save_path)
-            # composeData.get_T_0_TRAIN_dataset(EC_path, SMS_path)
-            composeData.get_T_0_TRAIN_dataset()
+    #多机构建时，每台机器设置不同的分片编号，eg: ShardSpec(1, 4)，只构建属于该分片的时刻;
+    #shard = None 则在本机构建所有时刻
+    shard = None
+
+    #所有时刻共用一个构建清单，只重新构建输入发生变化的时刻
+    manifest_file = 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0_manifest.json'
+    if shard is not None:
+        manifest_file = shard_store_file(manifest_file, shard)
+    manifest = BuildManifest(manifest_file)
+
+    #所有时刻的T0数据集都追加写入同一个HDF5 store; 分片时写入该分片的部分store, eg: T0.shard-1-of-4.h5
+    store_file = 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0.h5'
+    if shard is None:
+        store = StationCubeStore(store_file)
+    else:
+        store = open_shard_store(store_file, shard, n_station = len(pd.read_csv(all_station_file)))
+
+    #统计各阶段耗时和读取的文件数/字节数, 构建完成后打印汇总表并保存Chrome trace
+    perf.enable()
 
+    for case_time in case_times[0:]:
+
+        EC_path = os.path.join('D:/zhongqi/ori_data/', case_time ,'micaps')
+        SMS_path = os.path.join('D:/zhongqi/ori_data/', case_time , 'micaps/warr/nc')
+
+        print(SMS_path)
+
+        surface_path = 'D:/zhongqi/ori_data/aws_of_4_cases/'
+        file_list = os.listdir(surface_path)
+        for file in file_list[0:]:
+            if file.split('.')[0][-2:] in ['02','05','08','11','14','17','20','23']:
+                surface_file = os.path.join(surface_path, file)
+                composeData = ComposeMultipleData(surface_file, all_station_file,EC_path, SMS_path,save_path)
+                # composeData.get_T_0_TRAIN_dataset(EC_path, SMS_path)
+                composeData.get_T_0_TRAIN_dataset(manifest = manifest, store = store, shard = shard)
+
+    store.close()
+    perf.print_summary()
+    perf.to_chrome_trace('D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0_perf.trace.json')
+
+#%%
+#所有分片构建完成并拷贝到同一目录后，合并为一个store。分片不完整或有重叠时报错，不写出T0.h5
+# merge_shard_stores('D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0.h5')
         
 #%%
 #构建时序数据集
-def build_time_series_dataset(T0_file,time_gap = 12, filetype = 'pd',save_path = None):
+@perf.timed('build_lags')
+def build_time_series_dataset(T0_file,time_gap = 12, filetype = 'pd',save_path = None, manifest = None,
+                              store = None):
     '''
     func: 输入某个T-0时刻的特征量文件，该文件每一行为一个站点的数据，每一列为一个特征量。
         其中特征包括T-0时刻[站点降水, 地面观测数据,EC_细网格资料,SMS资料]。以3h为间隔，构建训练
@@ -2046,6 +2195,12 @@ def build_time_series_dataset(T0_file,time_gap = 12, filetype = 'pd',save_path =
         filetype: 'array',默认输出为np.array类型。
                 否则，默认输出为 pd.DataFrame类型
         save_path: 文件保存路径，eg: D:/ori_data/Full_jiami_Station_Dataset/
+        manifest: BuildManifest or None
+            构建清单，只在filetype为'pd'(即需要保存文件)时起作用。默认None,即每次都重新构建;
+            否则当输出文件已存在，且T-0/T-3/../T-gap时刻的输入文件都未改变时跳过构建，返回None
+        store: StationCubeStore or None
+            默认None，即从T0的.csv文件读取各时刻特征; 否则从HDF5 store读取，此时T0_file可以直接为时间戳，
+            eg: '2018080420'; manifest中的输入为store中各时刻的数据(见Lag_features.lag_inputs)
     return:        
     '''
   
@@ -2089,12 +2244,30 @@ def build_time_series_dataset(T0_file,time_gap = 12, filetype = 'pd',save_path =
            
     ###step2：确定这些文件是否都存在，如果存在，则进行下一步操作；不存在则跳出
     #这里的遍历time_files不能使用file变量名，避免覆盖输入file
-    judge = [os.path.exists(file) for file in time_files] 
+    fingerprints = None
+    if store is None:
+        judge = [os.path.exists(file) for file in time_files] 
+    else:
+        judge = [store.has_time(file.split('/')[-1].split('.')[0]) for file in time_files]
+        if np.all(judge):
+            #输入为store中各时刻的数据, eg: D:/.../T0.h5::2018080420, 指纹为该时刻数据的md5
+            time_files, fingerprints = lag_inputs(store, T_0, time_gap)
     if not np.all(judge):
         print('Error! Not all file exists!')
          
     else:
         print('All file exists!')
+        
+        #输出文件位置, eg: save_path/T-12/T-12-2018080420.csv
+        if save_path == None:
+            save_path = 'D:/zhongqi/ori_data/Full_jiami_Station_Dataset/'
+        save_file = os.path.join(save_path, 'T-'+str(time_gap), 'T-'+str(time_gap) + '-' + T_0 + '.csv')
+        config = {'dataset': 'T-gap', 'time_gap': int(time_gap)}
+        
+        if filetype != 'array' and manifest is not None:
+            if manifest.is_up_to_date(save_file, time_files, config, fingerprints = fingerprints):
+                print(save_file,'are ready exists and up to date!')
+                return None
             
         #确定某些特征变量不需要保留
         # drop_features = ['5_T-0_SMS_PRES-L101-GLC0']
@@ -2102,7 +2275,10 @@ def build_time_series_dataset(T0_file,time_gap = 12, filetype = 'pd',save_path =
         
         all_data = []
         for file in time_files[0:]:
-            data = pd.read_csv(file).iloc[:,1:]  #第0列为index,去掉
+            if store is None:
+                data = pd.read_csv(file).iloc[:,1:]  #第0列为index,去掉
+            else:
+                data = store.read_time(file.split('::')[-1])
             
             all_data.append(data)
             
@@ -2156,39 +2332,33 @@ def build_time_series_dataset(T0_file,time_gap = 12, filetype = 'pd',save_path =
             # all_features_data['time'] = [T_0]*len(all_features_data)
             all_features_data.insert(0,'time', [T_0]*len(all_features_data)) 
             
-            if save_path == None:
-                save_path = 'D:/zhongqi/ori_data/Full_jiami_Station_Dataset/'
-                    
-            save_path1 = save_path
-            save_path2 = 'T-'+str(time_gap)  #eg T-12
-            
-            if not os.path.exists(os.path.join(save_path1,save_path2)):
+            if not os.path.exists(os.path.dirname(save_file)):
                 #递归创建目录
-                os.makedirs(os.path.join(save_path1,save_path2))   
+                os.makedirs(os.path.dirname(save_file))   
                 
-            #eg: T-12-2018080420.csv
-            save_path3 =  save_path2 + '-' + T_0 + '.csv' 
-            save_path = os.path.join(save_path1,save_path2,save_path3)
-        
-            all_features_data.to_csv(save_path)
-            print('save path:',save_path)
+            atomic_to_csv(all_features_data, save_file)
+            if manifest is not None:
+                manifest.record(save_file, time_files, config, fingerprints = fingerprints)
+            print('save path:',save_file)
                 
         return all_features_data
 
 #%%
 
-T0_path = 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0/'
-file_list = os.listdir(T0_path)
-save_path = 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop'
+if __name__ == '__main__':
+    save_path = 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop'
+    store = StationCubeStore(os.path.join(save_path, 'T0.h5'), mode = 'r')
+
+    #所有滞后数据集共用一个构建清单，只重新构建T0数据发生变化的样本
+    lag_manifest = BuildManifest(os.path.join(save_path, 'T-gap_manifest.json'))
+
+    #每个时刻只读取一次，一次遍历同时写出 T-3/T-6/T-9/T-12 四个数据集: save_path/T-3.h5 ...
+    #如需与build_time_series_dataset一样逐时刻保存.csv，设置filetype = 'csv'
+    counts = write_lag_datasets(store, save_path, time_gaps = [3,6,9,12], filetype = 'h5', manifest = lag_manifest)
+    print(counts)
+
+    store.close()
 
-for file in file_list[0:]:
-    T0_filepath = os.path.join(T0_path,file)
-    
-    for gap in [3,6,9,12]:
-        print('file: {} --- gap: {}'.format(T0_filepath, gap))
-        data = build_time_series_dataset(T0_filepath, time_gap = gap, save_path = save_path)
-        print()
-    
 #%%
 
         
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+EC细网格物理量的特征组合: 声明式配置 + 向量化计算
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    default_EC_com_spec      默认的特征组合配置，与原 get_all_ECthin_Station_dataset_dst() 中写死的组合完全一致
+    read_EC_com_spec()       从EC_filename_list.xlsx的 'Com_op'/'Com_src' 两列读取特征组合配置
+    ECFeatureKernel          将特征组合配置编译为向量化的计算核，一次调用处理任意维度的数组
+    get_EC_feature_kernel()  按 EC_filename_list.xlsx 的路径和修改时间缓存编译好的计算核
+
+特征组合配置:
+    EC_filename_list.xlsx 每一行对应一个组合后的特征(EC_Com_Features_Name)，
+    'Com_op'  为组合方式， 'Com_src' 为参与组合的原始物理量的index(即'filepath'列的行号，多个用逗号分隔)
+        copy: 直接使用原始物理量，         eg: copy  '8'
+        mean: 多个原始物理量的平均，       eg: mean  '8,9,10'
+        max:  多个原始物理量的最大值，     eg: max   '17,18,19,20,21,22,23,24'
+        cos:  风向的cos, 即 v/sqrt(u^2+v^2), Com_src为 'u,v'
+        sin:  风向的sin, 即 u/sqrt(u^2+v^2), Com_src为 'u,v'
+        diff: 两个原始物理量之差 a-b,      Com_src为 'a,b'
+'''
+#%%
+
+import os
+import numpy as np
+import pandas as pd
+
+
+def _copy_range(spec, dst_start, src_start, length):
+    '''
+    func: 在spec末尾追加length个copy组合(原始物理量src_start ~ src_start+length-1);
+          dst_start为第一个追加的组合特征的位置，与len(spec)不一致时报错，避免配置错位
+    '''
+    if len(spec) != dst_start:
+        raise ValueError('EC com spec misaligned: copy range should start at {}, got {}'.format(len(spec), dst_start))
+
+    spec.extend([('copy', [src_start + i]) for i in range(length)])
+
+    return spec
+
+
+def _build_default_spec():
+    '''
+    func: 与原get_all_ECthin_Station_dataset_dst中的组合一一对应, 第i个元素为第i个组合特征
+    '''
+    spec = _copy_range([], 0, 0, 11)                         #前11个变量不变
+    spec.append(('mean', [8,9,10]))                          #850/700/500hPa三层垂直速度平均
+    _copy_range(spec, 12, 11, 6)
+    spec.extend([('mean', [17,18,19,20]),                    #1000/950/925/900/850/700hPa平均U
+                 ('mean', [25,26,27,28]),                    #1000/950/925/900/850/700hPa平均V
+                 ('mean', [17,18,19,20,21,22,23,24]),        #1000~300hPa平均U和Umax
+                 ('max',  [17,18,19,20,21,22,23,24]),
+                 ('mean', [25,26,27,28,29,30,31,32]),        #1000~300hPa平均V和Vmax
+                 ('max',  [25,26,27,28,29,30,31,32]),
+                 ('copy', [22]), ('copy', [30]),             #500hPa U/V 及风向cos/sin
+                 ('cos',  [22,30]), ('sin',  [22,30]),
+                 ('copy', [19]), ('copy', [27]),             #850hPa U/V 及风向cos/sin
+                 ('cos',  [19,27]), ('sin',  [19,27]),
+                 ('copy', [18]), ('copy', [26]),             #925hPa U/V 及风向cos/sin
+                 ('cos',  [18,26]), ('sin',  [18,26])])
+    _copy_range(spec, 36, 33, 6)
+    spec.append(('diff', [38,36]))                           #假相当位温差
+    _copy_range(spec, 43, 40, 5)
+
+    return spec
+
+
+default_EC_com_spec = _build_default_spec()
+
+
+def read_EC_com_spec(EC_filename_list_path):
+    '''
+    func: 从EC_filename_list.xlsx读取特征组合配置
+    inputs:
+        EC_filename_list_path: EC_filename_list.xlsx 的路径
+    return:
+        spec: [(op, [src_index, ...]), ...], 第i个元素为第i个组合特征(EC_Com_Features_Name)的组合方式
+              如果文件中没有'Com_op'/'Com_src'两列，则返回 default_EC_com_spec
+    '''
+    EC_filename_list = pd.read_excel(EC_filename_list_path)
+
+    if 'Com_op' not in EC_filename_list.columns or 'Com_src' not in EC_filename_list.columns:
+        return list(default_EC_com_spec)
+
+    spec = []
+    for op, src in zip(EC_filename_list['Com_op'], EC_filename_list['Com_src']):
+        if isinstance(op, float) and np.isnan(op):
+            break
+        src = [int(float(i)) for i in str(src).split(',')]
+        spec.append((str(op).strip(), src))
+
+    return spec
+
+
+class ECFeatureKernel():
+    '''
+    func: 将特征组合配置编译为向量化的计算核。
+          相同类型的组合(以及相同个数的mean/max)合并为一次numpy运算，
+          不论输入有多少个时刻、多少个站点，每次调用的numpy运算次数只与组合类型数有关
+    Parameter
+    ----------------------------
+    spec: list
+        特征组合配置, [(op, [src_index, ...]), ...]，见 read_EC_com_spec()
+
+    用法:
+        kernel = ECFeatureKernel(read_EC_com_spec(EC_filename_list_path))
+        dst_data = kernel(ori_data)  #ori_data.shape = (..., n_var), eg: (time, station, 45)
+                                     #dst_data.shape = (..., len(spec)), eg: (time, station, 48)
+    '''
+    def __init__(self, spec):
+
+        self.spec = list(spec)
+        self.n_dst = len(self.spec)
+        self.n_src = max(max(src) for _, src in self.spec) + 1
+
+        #按组合方式分组: {(op, k): (dst_index数组, src_index数组 shape = (n, k))}
+        groups = {}
+        for dst, (op, src) in enumerate(self.spec):
+            if op not in ['copy','mean','max','cos','sin','diff']:
+                raise ValueError('unknown feature combination op: {}'.format(op))
+            if op in ['cos','sin','diff'] and len(src) != 2:
+                raise ValueError('op {} needs 2 source variables, got {}'.format(op, src))
+
+            key = (op, len(src))
+            groups.setdefault(key, ([], []))
+            groups[key][0].append(dst)
+            groups[key][1].append(src)
+
+        self.groups = {key: (np.array(dst), np.array(src)) for key, (dst, src) in groups.items()}
+
+    def __call__(self, ori_data):
+        '''
+        func: 计算组合特征
+        inputs:
+            ori_data: np.array or pd.DataFrame, shape = (..., n_var), 最后一维为原始物理量
+        return:
+            dst_data: np.array, shape = (..., n_dst)
+        '''
+        ori_data = np.asarray(ori_data, dtype = np.float64)
+
+        dst_data = np.empty(ori_data.shape[:-1] + (self.n_dst,), dtype = ori_data.dtype)
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            for (op, k), (dst, src) in self.groups.items():
+
+                #shape = (..., n, k)
+                values = ori_data[..., src]
+
+                if op == 'copy':
+                    dst_data[..., dst] = values[..., 0]
+                elif op == 'mean':
+                    dst_data[..., dst] = np.mean(values, axis = -1)
+                elif op == 'max':
+                    dst_data[..., dst] = np.max(values, axis = -1)
+                elif op == 'diff':
+                    dst_data[..., dst] = values[..., 0] - values[..., 1]
+                else:
+                    #风向用cos/sin表示，v大于0，则cos大于0; u > 0,sin > 0
+                    u, v = values[..., 0], values[..., 1]
+                    norm = np.sqrt(np.square(u) + np.square(v))
+                    dst_data[..., dst] = v/norm if op == 'cos' else u/norm
+
+        return dst_data
+
+
+#{EC_filename_list_path: (修改时间, ECFeatureKernel)}
+_kernel_cache = {}
+
+
+def get_EC_feature_kernel(EC_filename_list_path = None):
+    '''
+    func: 获取(并缓存)EC_filename_list.xlsx对应的特征组合计算核，避免每个时刻都重新读取xlsx
+    inputs:
+        EC_filename_list_path: EC_filename_list.xlsx的路径; 为None或文件不存在时使用 default_EC_com_spec
+    return:
+        ECFeatureKernel
+    '''
+    if EC_filename_list_path is None or not os.path.exists(EC_filename_list_path):
+        key, mtime = None, None
+    else:
+        key, mtime = EC_filename_list_path, os.stat(EC_filename_list_path).st_mtime_ns
+
+    cache = _kernel_cache.get(key)
+    if cache is None or cache[0] != mtime:
+        spec = default_EC_com_spec if key is None else read_EC_com_spec(key)
+        _kernel_cache[key] = (mtime, ECFeatureKernel(spec))
+
+    return _kernel_cache[key][1]
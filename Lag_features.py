@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+基于站点数据立方体(StationCubeStore)的滞后特征(T-3/6/9/12)构建
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    time_to_hour()        将时间戳(eg: '2018080420' 或 '18080420')转换为整数小时数，便于在时间轴上做平移
+    hour_to_time()        time_to_hour的逆变换
+    LagFeatureEngine      将所有时刻的T0数据一次性读入内存，按时间轴平移得到任意time_gap的滞后特征
+    lag_inputs()          构建清单(BuildManifest)中某个样本的输入: store中 T-0/T-3/.../T-gap 时刻的数据及其md5
+    write_lag_datasets()  一次遍历所有时刻，同时写出 time_gap = 3/6/9/12 的所有数据集;
+                          给定manifest时，只重新构建输入(或配置)发生变化的样本
+
+与 Class_utils2.build_time_series_dataset() 的输出一致:
+    列为: [T-0时刻的所有特征(包括station_num/lon/lat/height), T-3时刻特征, ..., T-gap时刻特征,
+           0_T-0_ECthin_TP-r6, 0_T-0_SMS_ACC-r6, (time_gap >= 9时) 0_T-6_ECthin_TP-r6, 0_T-6_SMS_ACC-r6]
+    只有 T-0/T-3/.../T-gap 时刻的数据都存在时，才构建该时刻的样本。
+
+build_time_series_dataset() 对每个T0文件、每个gap都要重新读取并解析最多5个.csv文件，
+每个T0文件共被解析约20次; 这里每个时刻只从store中读取一次，所有gap的滞后特征都是对同一个内存数组
+在时间维上的索引(平移)，逐时刻写入一个预分配的缓冲区后立即保存。
+'''
+#%%
+
+import os
+import datetime
+import numpy as np
+import pandas as pd
+
+from Station_store import StationCubeStore
+from Build_manifest import atomic_to_csv
+import Perf_utils as perf
+
+
+#EC和SMS模式的3小时累计降水，用于构建6小时累计降水特征
+r3_features = ['0_T-0_ECthin_TP-r3', '0_T-0_SMS_ACC-r3']
+
+_epoch = datetime.datetime(1970,1,1)
+
+
+def time_to_hour(T_0):
+    '''
+    func: 将时间戳转换为从1970010100起的小时数
+    inputs:
+        T_0: str, eg: '2018080420' 或者 '18080420'
+    return:
+        int
+    '''
+    T_0 = str(T_0)
+    k = 4 if len(T_0) == 10 else 2
+    year = int(T_0[0:k])
+    if k == 2:
+        year = year + 2000
+    dst = datetime.datetime(year, int(T_0[k:k+2]), int(T_0[k+2:k+4]), int(T_0[k+4:]))
+
+    return int((dst - _epoch).total_seconds() // 3600)
+
+
+def hour_to_time(hour):
+    '''
+    func: time_to_hour的逆变换
+    return:
+        str, eg: '2018080420'
+    '''
+    return (_epoch + datetime.timedelta(hours = int(hour))).strftime('%Y%m%d%H')
+
+
+def lag_inputs(store, T_0, time_gap, step = 3, digests = None):
+    '''
+    func: 构建清单中T_0时刻time_gap样本的输入，即store中 T-0/T-3/.../T-gap 时刻的数据。
+          这些时刻的数据不是单独的文件，以 'store文件::时间戳' 表示，其指纹为该时刻数据的md5
+    inputs:
+        store: StationCubeStore，T0数据集
+        T_0: 时间戳，eg: '2018080420'
+        time_gap: 3/6/9/12
+        digests: dict or None, {时间戳: md5}的缓存，同一时刻被多个样本共用，避免重复计算
+    return:
+        input_files: ['D:/.../T0.h5::2018080420', 'D:/.../T0.h5::2018080417', ...];
+                     有时刻不在store中(不能构建该样本)时为None
+        fingerprints: {input_file: md5}
+    '''
+    hour = time_to_hour(T_0)
+    times = [hour_to_time(hour - lag) for lag in range(0, int(time_gap) + step, step)]
+    if not all(store.has_time(t) for t in times):
+        return None, None
+
+    if digests is None:
+        digests = {}
+
+    input_files = []
+    fingerprints = {}
+    for t in times:
+        if t not in digests:
+            digests[t] = store.time_digest(t)
+        input_file = store.store_file + '::' + t
+        input_files.append(input_file)
+        fingerprints[input_file] = digests[t]
+
+    return input_files, fingerprints
+
+
+def lag_columns(columns, time_gap, step = 3):
+    '''
+    func: 获取time_gap对应的滞后特征数据集的所有列名(不包括'time'列)
+    inputs:
+        columns: T0数据集的所有列名(包括station_num/lon/lat/height)
+        time_gap: 3/6/9/12
+        step: 滞后的时间间隔，默认3小时
+    return:
+        all_columns: 所有列名
+        r6_columns: [(r6特征名, r3特征名1, r3特征名2)], 6小时累计降水 = 两个相邻3小时累计降水之和
+    '''
+    fix_features = StationCubeStore.fix_features
+    features = [c for c in columns if c not in fix_features]
+
+    all_columns = list(columns)
+    for hour in range(step, int(time_gap) + step, step):
+        all_columns += [feature.replace('T-0', 'T-' + str(hour)) for feature in features]
+
+    #T-0时刻的6小时累计降水总是可以构建; 当time_gap >= 9时，还可以构建T-6时刻的
+    r6_columns = []
+    for hour in range(0, int(time_gap), 6):
+        if hour + 3 > int(time_gap):
+            break
+        for r3 in r3_features:
+            if r3 not in columns:
+                continue
+            r6 = r3.replace('T-0', 'T-' + str(hour)).replace('-r3', '-r6')
+            r6_columns.append((r6,
+                               r3.replace('T-0', 'T-' + str(hour)),
+                               r3.replace('T-0', 'T-' + str(hour + 3))))
+
+    #与build_time_series_dataset一致: 先T-0后T-6，先EC后SMS
+    all_columns += [r6 for r6, _, _ in r6_columns]
+
+    return all_columns, r6_columns
+
+
+class LagFeatureEngine():
+    '''
+    func: 滞后特征引擎。将store中(部分)时刻的数据一次性读入内存，
+          构建时间轴上的 小时数 --> 数组index 的映射，任意滞后 h 小时的特征即为按该映射在时间维上的平移
+    Parameter
+    ----------------------------
+    store: StationCubeStore
+        T0数据集所在的store
+    times: list or None
+        需要读入内存的时刻，默认None，即store中的所有时刻
+    step: int
+        滞后的时间间隔，默认3小时
+    '''
+    def __init__(self, store, times = None, step = 3):
+
+        self.store = store
+        self.step = step
+        self.times = list(store.times) if times is None else [str(t) for t in times]
+        self.columns = store.columns
+        self.features = store.features
+        self.station_info = store.station_info()
+
+        #shape = (n_time, n_station, n_feature), 只读取一次
+        self.cube = store.read_times(self.times)
+
+        #时间轴: 小时数 --> self.cube第0维的index, 不存在的时刻为-1
+        self.hours = np.array([time_to_hour(t) for t in self.times], dtype = np.int64)
+        if len(self.hours) > 0:
+            self.hour0 = self.hours.min()
+            self.slot = np.full(self.hours.max() - self.hour0 + 1, -1, dtype = np.int64)
+            self.slot[self.hours - self.hour0] = np.arange(len(self.times))
+        else:
+            self.hour0 = 0
+            self.slot = np.zeros(0, dtype = np.int64)
+
+    def shift_index(self, hour):
+        '''
+        func: 获取每个时刻滞后hour小时的时刻在self.cube中的index，不存在则为-1
+        return:
+            np.array, shape = (n_time,)
+        '''
+        index = self.hours - hour - self.hour0
+        valid = (index >= 0) & (index < len(self.slot))
+
+        shift = np.full(len(self.times), -1, dtype = np.int64)
+        shift[valid] = self.slot[index[valid]]
+
+        return shift
+
+    def availability(self, time_gap):
+        '''
+        func: 判断每个时刻是否可以构建time_gap的样本，即T-0/T-3/.../T-gap时刻的数据都存在
+        return:
+            valid: bool数组，shape = (n_time,)
+            shifts: shape = (n_lag, n_time)，每个滞后时刻的index
+        '''
+        lags = list(range(self.step, int(time_gap) + self.step, self.step))
+        shifts = np.stack([self.shift_index(hour) for hour in lags], axis = 0) if lags else np.zeros((0, len(self.times)), dtype = np.int64)
+        valid = np.all(shifts >= 0, axis = 0)
+
+        return valid, shifts
+
+    def lag_features(self, time_gap, time_index = None):
+        '''
+        func: 逐时刻构建time_gap的滞后特征(生成器)。每个时刻的 T-0 + 所有滞后时刻的特征 + 6小时累计降水
+              直接写入同一个预分配的缓冲区，不复制整个块的数据
+        inputs:
+            time_gap: 3/6/9/12
+            time_index: 需要构建的时刻在self.times中的index，默认None，即所有可以构建的时刻
+        yield:
+            T_0: 构建成功的时刻
+            data: np.array, float32, shape = (n_station, n_column),
+                  列顺序为lag_columns(...)[0] 中去掉station_num/lon/lat/height后的顺序;
+                  每次迭代都会覆盖同一个缓冲区，需要保留时先copy()
+            columns: data的列名
+        '''
+        valid, shifts = self.availability(time_gap)
+        if time_index is not None:
+            mask = np.zeros(len(self.times), dtype = bool)
+            mask[np.asarray(time_index)] = True
+            valid = valid & mask
+
+        rows = np.where(valid)[0]
+
+        all_columns, r6_columns = lag_columns(self.columns, time_gap, self.step)
+        columns = [c for c in all_columns if c not in StationCubeStore.fix_features and c not in [r6 for r6, _, _ in r6_columns]]
+
+        #6小时累计降水: 两个3小时累计降水列的位置
+        position = {c: i for i, c in enumerate(columns)}
+        r6_index = [(position[r3_a], position[r3_b]) for _, r3_a, r3_b in r6_columns]
+        columns = columns + [r6 for r6, _, _ in r6_columns]
+
+        n_feature = len(self.features)
+        n_lag = len(shifts)
+        data = np.empty((self.cube.shape[1], len(columns)), dtype = np.float32)
+
+        for i in rows:
+            #T-0 + 所有滞后时刻的特征，依次写入缓冲区
+            data[:, :n_feature] = self.cube[i]
+            for j in range(n_lag):
+                data[:, (j + 1)*n_feature:(j + 2)*n_feature] = self.cube[shifts[j, i]]
+
+            for k, (a, b) in enumerate(r6_index):
+                np.add(data[:, a], data[:, b], out = data[:, (n_lag + 1)*n_feature + k])
+
+            yield self.times[i], data, columns
+
+    def to_dataframe(self, T_0, data, columns, time_gap):
+        '''
+        func: 将某个时刻的滞后特征转为与build_time_series_dataset输出一致的pd.DataFrame
+        inputs:
+            T_0: 时间戳
+            data: shape = (n_station, n_column), lag_features 生成的某个时刻的数据
+            columns: lag_features 生成的列名
+        '''
+        all_columns, _ = lag_columns(self.columns, time_gap, self.step)
+
+        data = pd.DataFrame(data, columns = columns)
+        for name in StationCubeStore.fix_features:
+            data[name] = self.station_info[name].values
+        data = data[all_columns]
+        data.insert(0, 'time', [T_0]*len(data))
+
+        return data
+
+
+@perf.timed('build_lags')
+def write_lag_datasets(store, save_path, time_gaps = [3,6,9,12], times = None,
+                       block_size = 240, filetype = 'h5', manifest = None):
+    '''
+    func: 一次遍历所有时刻，同时构建并保存所有time_gap的滞后特征数据集。
+          为了控制内存，按block_size个时刻分块读取(每块额外读取其前max(time_gaps)小时的数据)
+    inputs:
+        store: StationCubeStore，T0数据集
+        save_path: 保存路径，eg: 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop'
+        time_gaps: 默认[3,6,9,12]
+        times: 需要构建的时刻，默认None，即store中的所有时刻
+        block_size: 每块的时刻数，默认240
+        filetype: 'h5'(默认): 每个time_gap保存为一个store, eg: save_path/T-12.h5;
+                  'csv': 与build_time_series_dataset一致，eg: save_path/T-12/T-12-2018080420.csv
+        manifest: BuildManifest or None
+            构建清单。默认None，即每次都重新构建所有样本;
+            否则当样本已存在，且T-0/T-3/.../T-gap时刻的T0数据(见lag_inputs)和T0的特征列都未改变时跳过，
+            某一块中所有样本都是最新时，不读取该块的数据
+    return:
+        {time_gap: 本次构建的时刻数}
+    '''
+    all_times = list(store.times)
+    target_times = all_times if times is None else [str(t) for t in times]
+    target_times = sorted(target_times, key = time_to_hour)
+
+    all_hours = {t: time_to_hour(t) for t in all_times}
+    time_of_hour = {h: t for t, h in all_hours.items()}
+    max_gap = max(time_gaps)
+
+    out_stores = {}
+    counts = {time_gap: 0 for time_gap in time_gaps}
+
+    #T0的特征列改变时，所有滞后数据集都需要重新构建
+    configs = {time_gap: {'dataset': 'T-gap', 'time_gap': int(time_gap), 'columns': store.columns}
+               for time_gap in time_gaps}
+    #{时间戳: T0数据的md5}
+    digests = {}
+
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    for time_gap in time_gaps:
+        if filetype == 'h5':
+            out_stores[time_gap] = StationCubeStore(os.path.join(save_path, 'T-' + str(time_gap) + '.h5'))
+        elif not os.path.exists(os.path.join(save_path, 'T-' + str(time_gap))):
+            os.makedirs(os.path.join(save_path, 'T-' + str(time_gap)))
+
+    def output_of(time_gap, T_0):
+        #构建清单中的输出及其是否存在
+        if filetype == 'h5':
+            out_store = out_stores[time_gap]
+            return out_store.store_file + '::' + T_0, out_store.has_time(T_0)
+        save_file = os.path.join(save_path, 'T-' + str(time_gap), 'T-' + str(time_gap) + '-' + T_0 + '.csv')
+        return save_file, None
+
+    try:
+        for start in range(0, len(target_times), block_size):
+            block_times = target_times[start:start + block_size]
+
+            #该块中每个time_gap需要构建的时刻: {time_gap: {T_0: (input_files, fingerprints)}}
+            todo = {time_gap: {} for time_gap in time_gaps}
+            for time_gap in time_gaps:
+                for T_0 in block_times:
+                    input_files, fingerprints = lag_inputs(store, T_0, time_gap, digests = digests)
+                    if input_files is None:
+                        continue
+
+                    if manifest is not None:
+                        output, output_exists = output_of(time_gap, T_0)
+                        if manifest.is_up_to_date(output, input_files, configs[time_gap],
+                                                  output_exists = output_exists, fingerprints = fingerprints):
+                            perf.count('lag_samples_up_to_date')
+                            continue
+
+                    todo[time_gap][T_0] = (input_files, fingerprints)
+
+            build_times = set()
+            for time_gap in time_gaps:
+                build_times.update(todo[time_gap].keys())
+            if len(build_times) == 0:
+                continue
+
+            #需要构建的时刻及其滞后时刻
+            need_hours = set()
+            for t in build_times:
+                h = time_to_hour(t)
+                need_hours.update(range(h - max_gap, h + 1))
+            need_times = sorted([time_of_hour[h] for h in need_hours if h in time_of_hour], key = time_to_hour)
+
+            with perf.timer('read_block'):
+                engine = LagFeatureEngine(store, times = need_times)
+            #{时间戳: engine.cube第0维的index}
+            engine_index = {t: i for i, t in enumerate(engine.times)}
+
+            for time_gap in time_gaps:
+                if len(todo[time_gap]) == 0:
+                    continue
+
+                block_index = [engine_index[t] for t in todo[time_gap]]
+
+                #逐时刻构建并立即写出，内存中只有一个时刻的滞后特征
+                with perf.timer('lag_write'):
+                    for T_0, data, columns in engine.lag_features(time_gap, time_index = block_index):
+                        output, _ = output_of(time_gap, T_0)
+                        if filetype == 'h5':
+                            out_store = out_stores[time_gap]
+                            if not out_store.initialized:
+                                all_columns, _ = lag_columns(engine.columns, time_gap, engine.step)
+                                info = engine.station_info
+                                out_store.init_store(all_columns, info['station_num'], info['lon'],
+                                                     info['lat'], info['height'])
+                            out_store.append(T_0, data)
+                        else:
+                            atomic_to_csv(engine.to_dataframe(T_0, data, columns, time_gap), output)
+
+                        if manifest is not None:
+                            input_files, fingerprints = todo[time_gap][T_0]
+                            manifest.record(output, input_files, configs[time_gap], fingerprints = fingerprints)
+
+                        counts[time_gap] += 1
+                        perf.count('lag_samples_built')
+
+            for out_store in out_stores.values():
+                out_store.flush()
+    finally:
+        for out_store in out_stores.values():
+            out_store.close()
+
+    return counts
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+延迟导入: 绘图(matplotlib/basemap)、netCDF4、h5py、scipy的子模块(interpolate/spatial/ndimage/optimize) 在第一次使用时才导入
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    LazyModule      模块的代理，第一次访问属性时才import，可以设置导入后的回调(eg: 设置中文字体)
+    LazyAttr        模块中某个函数/类的代理(eg: griddata, Basemap)，第一次调用时才import
+    set_chinese_font()  matplotlib导入后设置中文字体和负号，原来写在各文件的开头
+
+All_utils_funs / Class_utils2 在文件开头直接 import matplotlib.pyplot / basemap / netCDF4 / h5py / scipy.interpolate，
+只做数据处理、QC、检验的脚本和多进程的子进程也要花约1s导入这些模块(pyplot和scipy.interpolate各约0.3s)。
+这里用代理对象替换这些模块，写法不变(plt.figure()、nc.Dataset()、griddata(...))，只有真正用到时才导入。
+
+用法:
+    plt = LazyModule('matplotlib.pyplot', on_import = set_chinese_font)
+    nc = LazyModule('netCDF4')
+    griddata = LazyAttr('scipy.interpolate', 'griddata')
+
+    is_imported('matplotlib.pyplot')  #检查某个模块是否已经被导入
+'''
+#%%
+
+import sys
+import importlib
+
+
+def set_chinese_font(module = None):
+    '''
+    func: matplotlib导入后的回调: 设置中文字体和负号
+    '''
+    import matplotlib
+    matplotlib.rcParams['font.sans-serif']=['SimHei'] #用来正常显示中文标签
+    matplotlib.rcParams['axes.unicode_minus']=False #用来正常显示负号
+
+    return None
+
+
+class LazyModule():
+    '''
+    func: 模块的代理，第一次访问属性时才导入模块
+    Parameter
+    ----------------------------
+    name: str
+        模块名, eg: 'matplotlib.pyplot'
+    on_import: function or None
+        导入后的回调 on_import(module)，只执行一次
+    '''
+    def __init__(self, name, on_import = None):
+        #不能直接用 self.name = name，会触发__setattr__
+        self.__dict__['_name'] = name
+        self.__dict__['_on_import'] = on_import
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+            if self.__dict__['_on_import'] is not None:
+                self.__dict__['_on_import'](module)
+
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'imported' if self.__dict__['_module'] is not None else 'not imported'
+        return '<LazyModule {} ({})>'.format(self.__dict__['_name'], state)
+
+
+class LazyAttr():
+    '''
+    func: 模块中函数/类的代理，第一次调用(或访问其属性)时才导入模块
+    Parameter
+    ----------------------------
+    module_name: str
+        模块名, eg: 'scipy.interpolate'
+    attr: str
+        函数/类名, eg: 'griddata'
+    '''
+    def __init__(self, module_name, attr):
+        self._module_name = module_name
+        self._attr = attr
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            self._target = getattr(importlib.import_module(self._module_name), self._attr)
+
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        #_module_name等属性不存在时(__init__之前)不能递归
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return '<LazyAttr {}.{}>'.format(self._module_name, self._attr)
+
+
+def is_imported(name):
+    '''
+    func: 模块是否已经被导入(在sys.modules中)
+    '''
+    return name in sys.modules
@@ -0,0 +1,678 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+地图底图缓存 + 多进程后台(Agg)批量绘图 + 逐时刻动画导出 + 大网格降采样快速预览
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    MapBackground        地图底图: 海岸线/国境线/counties/省界(gadm36_CHN_1)的线段，只在第一次使用某个经纬度范围时计算一次
+    get_map_background() 获取某个经纬度范围的底图，依次从 内存缓存 -> 磁盘缓存(.pkl) -> 重新计算 获取
+    plot_station_on_ax() 在底图上画站点散点图(与scatter_station_on_map()一致)
+    plot_grid_on_ax()    在底图上画格点等值填色图(与contourf_data_on_map()一致)
+    render_map()         画一张完整的图(底图 + 数据 + colorbar + title)并保存，不使用plt，不弹出窗口
+    render_maps()        多进程并行画多张图，每个进程只接收一次底图
+    export_animation()   将逐时刻的站点/格点数据流式写入动画(.gif/.mp4)，所有帧共用一个figure和artist
+    store_frames()       从StationCubeStore中逐时刻读取某个特征，作为export_animation()的帧
+
+    block_reduce()       按 factor × factor 的块对网格降采样: 降水用块内最大值('max')，其他要素用平均值('mean')
+    quicklook_factor()   由网格大小和输出图片的像素数，计算降采样倍数(降采样后每个格点约对应一个像素)
+    decimate_grid()      对网格数据及其经纬度降采样到输出图片的分辨率
+    GridPyramid          网格的多级降采样(金字塔, 每级2倍)，按显示范围和像素数选择合适的一级，缩小显示时直接使用粗的一级
+
+scatter_station_on_map() / contourf_data_on_map() 每次调用都要新建Basemap、读取省界shapefile，
+并重新画海岸线/国境线/counties(其中counties为全美国的县界，约3866条线，单这一项就要约2s)，一张图的数据还没画就要好几秒。
+这里对每个经纬度范围只计算一次: 读取shapefile并转换为经纬度坐标的线段，去掉不在范围内的线段，
+保存在内存中(同一进程内重复使用)和磁盘上(pickle，其他进程/下次运行直接读取，不需要Basemap)。
+之后每张图只需要把这些线段作为LineCollection添加到axes上。
+
+用法:
+    tasks = [{'kind': 'station', 'save_file': 'D:/zhongqi/fig/{}.png'.format(t), 'title': t,
+              'station_lon': lon, 'station_lat': lat, 'station_value': obs[i],
+              'loc_range': [30,50,105,125]} for i, t in enumerate(times)]
+    files = render_maps(tasks, processes = 8, cache_path = 'D:/zhongqi/geo_data/map_cache')
+
+    #72小时的逐小时站点降水动画
+    store = StationCubeStore('T0.h5', mode = 'r')
+    info = store.station_info()
+    frames = store_frames(store, '0_T-0_surface_r1-p', times)
+    export_animation('station', frames, 'D:/zhongqi/fig/case.gif', lon = info['lon'].values, lat = info['lat'].values,
+                     loc_range = [30,50,105,125], levels = [0.1, 2, 5, 10, 20, 50], fps = 4)
+
+大网格快速预览:
+    SMS区域和0.125°EC网格的格点数远多于图片的像素数，直接contourf又慢、图片又大。
+    quicklook = True 时先将网格按块降采样到与输出像素数相当，再contourf，图上看起来基本没有差别。
+    降水用块内最大值，避免强降水中心被平均掉。
+    pyramid = GridPyramid(rain, lon_grid, lat_grid, how = 'max')
+    data, lon_grid2, lat_grid2 = pyramid.select(width = 1120, height = 640, loc_range = [30,50,105,125])
+'''
+#%%
+
+import os
+import pickle
+import hashlib
+import numpy as np
+from Build_manifest import atomic_to_pickle
+#matplotlib在第一次画图时才导入，只使用block_reduce/decimate_grid等数组函数时不需要导入
+from Lazy_import import LazyModule, LazyAttr, set_chinese_font
+matplotlib = LazyModule('matplotlib')
+Figure = LazyAttr('matplotlib.figure', 'Figure')
+LineCollection = LazyAttr('matplotlib.collections', 'LineCollection')
+FigureCanvasAgg = LazyAttr('matplotlib.backends.backend_agg', 'FigureCanvasAgg')
+from concurrent.futures import ProcessPoolExecutor
+
+
+shpfile = 'D:/zhongqi/geo_data/gadm36_CHN_shp/gadm36_CHN_1'
+
+#{(loc_range, shpfile, resolution): MapBackground}, 同一进程内的底图缓存
+_background_cache = {}
+
+
+class MapBackground():
+    '''
+    func: 某个经纬度范围的地图底图(等经纬度投影, 与Basemap(projection = 'cyl')一致)
+    Parameter
+    ----------------------------
+    loc_range: list
+        [lat_min,lat_max,lon_min,lon_max], 默认中国大陆区域 [18,54,73,135]
+    shpfile: str or None
+        省界shapefile(不包括扩展名)，默认 gadm36_CHN_1; None时不画省界
+    resolution: str
+        Basemap海岸线/国境线的分辨率，默认'l'
+    layers: list
+        底图包括的图层, 默认['coastlines','countries','counties','states'], 与原来的绘图函数一致
+
+    用法:
+        background = MapBackground([30,50,105,125])
+        background.draw(ax)
+    '''
+    #各图层的线宽(与Basemap默认一致)
+    linewidths = {'coastlines': 1.0, 'countries': 0.5, 'counties': 0.1, 'states': 0.5}
+
+    def __init__(self, loc_range = [18,54,73,135], shpfile = shpfile, resolution = 'l',
+                 layers = ['coastlines', 'countries', 'counties', 'states']):
+
+        self.loc_range = [float(v) for v in loc_range]
+        self.shpfile = shpfile
+        self.resolution = resolution
+
+        #{图层名: [shape = (n_point, 2)的经纬度线段, ...]}
+        self.layers = {}
+        self.build(layers)
+
+    def build(self, layers):
+        '''
+        func: 使用Basemap读取并投影所有图层，只保留与loc_range相交的线段
+        '''
+        #只有重新计算底图时才需要Basemap
+        from mpl_toolkits.basemap import Basemap
+
+        lat_min, lat_max, lon_min, lon_max = self.loc_range
+
+        fig = Figure()
+        ax = fig.add_axes([0.1,0.1,0.8,0.8])
+        m = Basemap(projection='cyl',llcrnrlat=lat_min,llcrnrlon=lon_min,
+                    urcrnrlat=lat_max,urcrnrlon=lon_max,resolution=self.resolution,ax=ax)
+
+        for layer in layers:
+            if layer == 'states':
+                if self.shpfile is None:
+                    continue
+                m.readshapefile(self.shpfile, 'states', drawbounds = False)
+                segments = [np.array(shape, dtype = np.float64) for shape in m.states]
+            else:
+                collection = getattr(m, 'draw' + layer)(ax = ax)
+                segments = [path.vertices.astype(np.float64) for path in collection.get_paths()]
+
+            self.layers[layer] = self.clip(segments)
+
+        return None
+
+    def clip(self, segments):
+        '''
+        func: 去掉外接矩形与loc_range不相交的线段
+        '''
+        lat_min, lat_max, lon_min, lon_max = self.loc_range
+
+        valid_segments = []
+        for segment in segments:
+            if len(segment) < 2:
+                continue
+            x, y = segment[:, 0], segment[:, 1]
+            if x.max() < lon_min or x.min() > lon_max or y.max() < lat_min or y.min() > lat_max:
+                continue
+            valid_segments.append(segment)
+
+        return valid_segments
+
+    def n_segments(self):
+        return {layer: len(segments) for layer, segments in self.layers.items()}
+
+    def draw(self, ax, gap = 5, fontsize = 16, color = 'k', zorder = 3):
+        '''
+        func: 将底图画到ax上，并设置经纬度范围和坐标轴(与原来的绘图函数一致)
+        inputs:
+            ax: matplotlib axes
+            gap: 横纵坐标的经纬度间隔
+            fontsize: 坐标轴字体大小
+        '''
+        lat_min, lat_max, lon_min, lon_max = self.loc_range
+
+        for layer, segments in self.layers.items():
+            if len(segments) > 0:
+                ax.add_collection(LineCollection(segments, colors = color, zorder = zorder,
+                                                 linewidths = self.linewidths.get(layer, 0.5)))
+
+        ax.set_xlim(lon_min, lon_max)
+        ax.set_ylim(lat_min, lat_max)
+        ax.set_aspect('equal')
+
+        x_grid = np.arange(lon_min, lon_max + 1, gap, dtype = int)
+        y_grid = np.arange(lat_min, lat_max + 1, gap, dtype = int)
+        ax.set_xticks(x_grid)
+        ax.set_xticklabels(x_grid, fontsize = fontsize)
+        ax.set_yticks(y_grid)
+        ax.set_yticklabels(y_grid, fontsize = fontsize)
+        ax.grid(True)
+        ax.set_xlabel('longitude: °E', fontsize = fontsize)
+        ax.set_ylabel('latitude: °N', fontsize = fontsize)
+
+        return None
+
+    def save(self, cache_file):
+        '''
+        func: 保存到磁盘缓存(pickle)。先写临时文件再重命名，多个进程同时写入时不会读到不完整的文件
+        '''
+        atomic_to_pickle(self, cache_file)
+
+        return None
+
+    @staticmethod
+    def load(cache_file):
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+
+
+def _cache_key(loc_range, shpfile, resolution):
+    return (tuple(round(float(v), 4) for v in loc_range), shpfile, resolution)
+
+
+def get_map_background(loc_range = [18,54,73,135], shpfile = shpfile, resolution = 'l', cache_path = None):
+    '''
+    func: 获取某个经纬度范围的底图。依次从 内存缓存 -> 磁盘缓存 -> 重新计算(并写入缓存) 获取
+    inputs:
+        loc_range: [lat_min,lat_max,lon_min,lon_max]
+        shpfile: 省界shapefile(不包括扩展名)，None时不画省界
+        resolution: Basemap分辨率，默认'l'
+        cache_path: 磁盘缓存路径，默认None，即只使用内存缓存
+    return:
+        MapBackground
+    '''
+    key = _cache_key(loc_range, shpfile, resolution)
+    if key in _background_cache:
+        return _background_cache[key]
+
+    cache_file = None
+    if cache_path is not None:
+        name = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        cache_file = os.path.join(cache_path, 'map_background_{}.pkl'.format(name))
+
+    if cache_file is not None and os.path.exists(cache_file):
+        background = MapBackground.load(cache_file)
+    else:
+        background = MapBackground(loc_range, shpfile = shpfile, resolution = resolution)
+        if cache_file is not None:
+            if not os.path.exists(cache_path):
+                os.makedirs(cache_path, exist_ok = True)
+            background.save(cache_file)
+
+    _background_cache[key] = background
+
+    return background
+
+
+def plot_station_on_ax(ax, station_lon, station_lat, station_value, fill_value = 9999,
+                       size_value_change = False, if_norm = False, norm_range = [0,50], cmap = 'rainbow'):
+    '''
+    func: 在ax上画站点散点图，参数与scatter_station_on_map()一致
+    return:
+        scatter的artist(PathCollection)，可用于colorbar或者更新数据
+    '''
+    station_lon = np.array(station_lon).ravel()
+    station_lat = np.array(station_lat).ravel()
+
+    #使用mask数组；将value=fill_value的值跳过
+    station_value = np.array(station_value, dtype = np.float64).ravel()
+    station_value = np.ma.array(station_value, mask = station_value == fill_value)
+
+    norm = matplotlib.colors.Normalize(norm_range[0],norm_range[1]) if if_norm else None
+    size = station_value if size_value_change else 15
+
+    return ax.scatter(station_lon, station_lat, s = size, c = station_value, cmap = cmap, norm = norm, zorder = 2)
+
+
+def plot_grid_on_ax(ax, data, lon_grid, lat_grid, levels = 10, is_norm = False, vmin = 0, vmax = 100,
+                    cmap = 'rainbow', quicklook = False, how = 'mean'):
+    '''
+    func: 在ax上画格点等值填色图，参数与contourf_data_on_map()一致
+    inputs:
+        quicklook: 默认False; True时先按ax的像素数对网格降采样(decimate_grid)再画图
+        how: 降采样方式，'max'(降水) 或 'mean'(其他要素)
+    return:
+        contourf的artist(QuadContourSet)
+    '''
+    norm = matplotlib.colors.Normalize(vmin = vmin, vmax = vmax) if is_norm else None
+
+    if quicklook:
+        bbox = ax.get_window_extent()
+        data, lon_grid, lat_grid = decimate_grid(data, lon_grid, lat_grid, how = how,
+                                                 width = bbox.width, height = bbox.height)
+
+    #若lat_grid高纬度值在最上面，则将数据做对应行数反转
+    if lat_grid[0,0] > lat_grid[-1,0]:
+        lat_grid = lat_grid[::-1]
+        lon_grid = lon_grid[::-1]
+        data = data[::-1]
+
+    return ax.contourf(lon_grid, lat_grid, data, levels = levels, extend = 'both', norm = norm, cmap = cmap, zorder = 1)
+
+
+def grid_loc_range(lon_grid, lat_grid):
+    '''
+    func: 网格的经纬度范围 [lat_min,lat_max,lon_min,lon_max]
+    '''
+    return [float(np.min(lat_grid)), float(np.max(lat_grid)), float(np.min(lon_grid)), float(np.max(lon_grid))]
+
+
+def new_map_figure(background, figsize = (14,8), gap = 5, fontsize = 16, dpi = 100):
+    '''
+    func: 新建一张画好底图的图(matplotlib.figure.Figure, 不经过plt，不弹出窗口)
+    return:
+        fig, ax
+    '''
+    fig = Figure(figsize = figsize, dpi = dpi)
+    ax = fig.add_axes([0.1,0.1,0.8,0.8])
+    background.draw(ax, gap = gap, fontsize = fontsize)
+
+    return fig, ax
+
+
+def add_colorbar(fig, ax, artist, fontsize = 16):
+    '''
+    func: 在ax右侧添加colorbar(与Basemap的m.colorbar(h, size = '4%')一致)
+    '''
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
+    cax = make_axes_locatable(ax).append_axes('right', size = '4%', pad = '5%')
+    cb = fig.colorbar(artist, cax = cax)
+    cb.ax.tick_params(labelsize = fontsize)
+
+    return cb
+
+
+def render_map(kind, save_file, loc_range = None, title = None, background = None,
+               shpfile = shpfile, resolution = 'l', cache_path = None,
+               figsize = (14,8), dpi = 100, gap = 5, **kwargs):
+    '''
+    func: 画一张完整的图(底图 + 数据 + colorbar + title)并保存
+    inputs:
+        kind: 'station': 站点散点图, kwargs为plot_station_on_ax()的参数(station_lon, station_lat, station_value, ...)
+              'grid': 格点等值填色图, kwargs为plot_grid_on_ax()的参数(data, lon_grid, lat_grid, quicklook, ...)
+        save_file: 保存的文件路径 + 文件名
+        loc_range: [lat_min,lat_max,lon_min,lon_max]; 默认None: 站点为中国大陆区域，格点为网格的范围
+        title: 图题
+        background: MapBackground, 默认None，即get_map_background(loc_range)
+        figsize, dpi: 图片大小和分辨率
+        gap: 横纵坐标的经纬度间隔
+    return:
+        save_file
+    '''
+    if loc_range is None:
+        loc_range = [18,54,73,135] if kind == 'station' else grid_loc_range(kwargs['lon_grid'], kwargs['lat_grid'])
+    if background is None:
+        background = get_map_background(loc_range, shpfile = shpfile, resolution = resolution, cache_path = cache_path)
+
+    #figure的dpi与保存的dpi一致，quicklook时按实际输出的像素数降采样
+    fig, ax = new_map_figure(background, figsize = figsize, gap = gap, dpi = dpi)
+
+    if kind == 'station':
+        artist = plot_station_on_ax(ax, **kwargs)
+    elif kind == 'grid':
+        artist = plot_grid_on_ax(ax, **kwargs)
+    else:
+        raise ValueError('kind must be station or grid, got {}'.format(kind))
+
+    add_colorbar(fig, ax, artist)
+    if title:
+        ax.set_title(title, fontsize = 20)
+
+    fig.savefig(save_file, dpi = dpi, bbox_inches = 'tight')
+
+    return save_file
+
+
+def _init_worker(backgrounds):
+    '''
+    func: 子进程初始化: 设置中文字体，并将主进程计算好的底图放入子进程的内存缓存
+    '''
+    set_chinese_font()
+
+    _background_cache.update(backgrounds)
+
+
+def _render_task(task):
+    return render_map(**task)
+
+
+def render_maps(tasks, processes = None, shpfile = shpfile, resolution = 'l', cache_path = None):
+    '''
+    func: 多进程并行画多张图。主进程先计算所有用到的底图(每个经纬度范围一次)，每个子进程初始化时接收一次
+    inputs:
+        tasks: list of dict, 每个dict为render_map()的参数, eg:
+               {'kind': 'station', 'save_file': 'D:/fig/2018080420.png', 'title': '2018080420',
+                'station_lon': lon, 'station_lat': lat, 'station_value': value, 'loc_range': [30,50,105,125]}
+        processes: 进程数，默认None，即cpu个数; 为1时在当前进程中依次画图
+        shpfile, resolution, cache_path: 底图参数，见get_map_background()
+    return:
+        所有图片的文件名列表，与tasks顺序一致
+    '''
+    tasks = [dict(task) for task in tasks]
+
+    backgrounds = {}
+    for task in tasks:
+        task.setdefault('shpfile', shpfile)
+        task.setdefault('resolution', resolution)
+
+        loc_range = task.get('loc_range')
+        if loc_range is None:
+            loc_range = [18,54,73,135] if task['kind'] == 'station' else grid_loc_range(task['lon_grid'], task['lat_grid'])
+            task['loc_range'] = loc_range
+
+        key = _cache_key(loc_range, task['shpfile'], task['resolution'])
+        if key not in backgrounds:
+            backgrounds[key] = get_map_background(loc_range, shpfile = task['shpfile'],
+                                                  resolution = task['resolution'], cache_path = cache_path)
+
+    if processes == 1:
+        return [_render_task(task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers = processes, initializer = _init_worker,
+                             initargs = (backgrounds,)) as executor:
+        files = list(executor.map(_render_task, tasks, chunksize = max(1, len(tasks) // 64)))
+
+    return files
+
+
+def store_frames(store, feature, times):
+    '''
+    func: 从StationCubeStore中逐时刻读取某个特征(每次只读取一个时刻)，作为export_animation()的帧
+    inputs:
+        store: StationCubeStore
+        feature: 特征名，eg: '0_T-0_surface_r1-p'
+        times: 时间戳列表，eg: ['2018080400', '2018080401', ...]
+    return:
+        生成器，依次输出 (title, values)
+    '''
+    for time in times:
+        yield str(time), store.read_time(time, features = [feature], filetype = 'array')[:, 0]
+
+
+def _animation_writer(save_file, fps, writer = None):
+    '''
+    func: 根据文件扩展名选择动画writer: .gif使用pillow; 其他(eg: .mp4)使用ffmpeg
+    '''
+    from matplotlib import animation
+
+    if writer is None:
+        writer = 'pillow' if save_file.lower().endswith('.gif') else 'ffmpeg'
+
+    if isinstance(writer, str):
+        if not animation.writers.is_available(writer):
+            raise ValueError('animation writer {} is not available, available: {}'.format(writer, animation.writers.list()))
+        writer = animation.writers[writer](fps = fps)
+
+    return writer
+
+
+def export_animation(kind, frames, save_file, lon, lat, loc_range = None, levels = None, vmin = 0, vmax = 50,
+                     cmap = 'rainbow', fill_value = 9999, fps = 4, dpi = 100, figsize = (14,8), gap = 5,
+                     shpfile = shpfile, resolution = 'l', cache_path = None, writer = None):
+    '''
+    func: 将逐时刻的数据流式写入动画。只新建一次figure、底图、artist和colorbar，
+          之后每一帧只用 set_array()/set_text() 更新数据和title，并立即写入writer，不保存所有帧的数据
+    inputs:
+        kind: 'station': 站点散点图(scatter); 'grid': 格点填色图(pcolormesh, 按levels分级着色，与contourf的效果一致)
+        frames: 可迭代对象(eg: 生成器)，依次输出 (title, values);
+                station: values.shape = (n_station,); grid: values.shape = lon.shape
+        save_file: 动画文件名, .gif 或 .mp4(需要ffmpeg)
+        lon, lat: 站点经纬度(station) 或 网格经纬度lon_grid/lat_grid(grid)
+        loc_range: [lat_min,lat_max,lon_min,lon_max], 默认None: 站点为中国大陆区域，格点为网格的范围
+        levels: list or None, 分级着色的边界(eg: [0.1, 2, 5, 10, 20, 50]); None时在[vmin, vmax]内连续着色
+        vmin, vmax: levels为None时的数值范围。所有帧共用一个colorbar，因此必须固定
+        fill_value: 缺测值，不画
+        fps: 每秒帧数
+        writer: matplotlib的MovieWriter或其名称，默认None，即按扩展名选择
+    return:
+        帧数
+    '''
+    if loc_range is None:
+        loc_range = [18,54,73,135] if kind == 'station' else grid_loc_range(lon, lat)
+    background = get_map_background(loc_range, shpfile = shpfile, resolution = resolution, cache_path = cache_path)
+
+    fig, ax = new_map_figure(background, figsize = figsize, gap = gap)
+    FigureCanvasAgg(fig)
+
+    if levels is not None:
+        norm = matplotlib.colors.BoundaryNorm(levels, matplotlib.colormaps[cmap].N, extend = 'both')
+    else:
+        norm = matplotlib.colors.Normalize(vmin = vmin, vmax = vmax)
+
+    lon = np.asarray(lon)
+    lat = np.asarray(lat)
+    if kind == 'station':
+        lon, lat = lon.ravel(), lat.ravel()
+        artist = ax.scatter(lon, lat, s = 15, c = np.full(len(lon), np.nan), cmap = cmap, norm = norm, zorder = 2)
+    elif kind == 'grid':
+        artist = ax.pcolormesh(lon, lat, np.ma.masked_all(lon.shape), cmap = cmap, norm = norm,
+                               shading = 'nearest', zorder = 1)
+    else:
+        raise ValueError('kind must be station or grid, got {}'.format(kind))
+
+    add_colorbar(fig, ax, artist)
+    title = ax.set_title('', fontsize = 20)
+
+    writer = _animation_writer(save_file, fps, writer)
+
+    n_frame = 0
+    with writer.saving(fig, save_file, dpi):
+        for frame_title, values in frames:
+            values = np.asarray(values, dtype = np.float64)
+            values = np.ma.masked_where(np.isnan(values) | (values == fill_value), values)
+
+            artist.set_array(values.ravel())
+            title.set_text(frame_title)
+            writer.grab_frame()
+            n_frame = n_frame + 1
+
+    return n_frame
+
+
+def block_reduce(data, factor, how = 'mean'):
+    '''
+    func: 按 factor × factor 的块对二维网格降采样，nan(以及mask)不参与计算，块内全为nan时为nan。
+          网格的行/列数不是factor的整数倍时，最后一个块只包括剩余的行/列
+    inputs:
+        data: np.array or np.ma.MaskedArray, shape = (ny, nx)
+        factor: 降采样倍数(int)
+        how: 'max': 块内最大值(降水); 'mean': 块内平均值; 'sum': 块内求和; 'count': 块内有效个数
+    return:
+        np.array, float64, shape = (ceil(ny/factor), ceil(nx/factor))
+    '''
+    if np.ma.isMaskedArray(data):
+        data = data.astype(np.float64).filled(np.nan)
+    data = np.asarray(data, dtype = np.float64)
+    factor = int(factor)
+    if factor <= 1:
+        return data.copy()
+
+    ny, nx = data.shape
+    pad_y = -ny % factor
+    pad_x = -nx % factor
+    if pad_y or pad_x:
+        data = np.pad(data, ((0, pad_y), (0, pad_x)), constant_values = np.nan)
+
+    blocks = data.reshape(data.shape[0] // factor, factor, data.shape[1] // factor, factor)
+    valid = ~np.isnan(blocks)
+    count = np.count_nonzero(valid, axis = (1, 3))
+
+    if how == 'count':
+        return count.astype(np.float64)
+
+    if how == 'max':
+        result = np.max(np.where(valid, blocks, -np.inf), axis = (1, 3))
+    elif how in ['mean', 'sum']:
+        result = np.sum(np.where(valid, blocks, 0), axis = (1, 3))
+        if how == 'mean':
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                result = result / count
+    else:
+        raise ValueError('how must be max, mean, sum or count, got {}'.format(how))
+
+    result[count == 0] = np.nan
+
+    return result
+
+
+def quicklook_factor(shape, width, height):
+    '''
+    func: 降采样倍数: 降采样后的网格在两个方向上都不少于输出的像素数
+    inputs:
+        shape: 网格的shape, (ny, nx)
+        width, height: 输出区域的像素数，eg: figsize = (14,8), dpi = 100的图中，ax的像素数约为(1120, 640)
+    return:
+        int, >= 1
+    '''
+    ny, nx = shape[:2]
+    return max(1, int(min(ny / max(height, 1), nx / max(width, 1))))
+
+
+def decimate_grid(data, lon_grid, lat_grid, how = 'mean', factor = None, width = 1120, height = 640):
+    '''
+    func: 对网格数据及其经纬度降采样(经纬度取块内平均，即块的中心)
+    inputs:
+        data, lon_grid, lat_grid: shape一致的二维网格
+        how: 'max'(降水) 或 'mean'(其他要素)
+        factor: 降采样倍数，默认None，即quicklook_factor(data.shape, width, height)
+        width, height: 输出区域的像素数
+    return:
+        data, lon_grid, lat_grid: 降采样后的网格
+    '''
+    if factor is None:
+        factor = quicklook_factor(np.shape(data), width, height)
+    if factor <= 1:
+        return data, lon_grid, lat_grid
+
+    return (block_reduce(data, factor, how), block_reduce(lon_grid, factor, 'mean'),
+            block_reduce(lat_grid, factor, 'mean'))
+
+
+class GridPyramid():
+    '''
+    func: 网格的多级降采样(金字塔)。第0级为原始网格，第i级为 2**i 倍降采样。
+          每一级都由上一级计算: max为上一级的块最大值; mean由上一级的 和/有效个数 计算，与直接从原始网格计算的结果一致
+    Parameter
+    ----------------------------
+    data, lon_grid, lat_grid: np.array
+        shape一致的二维网格
+    how: str
+        'max'(降水) 或 'mean'(其他要素)
+    min_size: int
+        最粗一级的网格在两个方向上都不少于min_size个格点，默认64
+
+    用法:
+        pyramid = GridPyramid(rain, lon_grid, lat_grid, how = 'max')
+        data, lon_grid2, lat_grid2 = pyramid.select(width = 1120, height = 640, loc_range = [30,50,105,125])
+    '''
+    def __init__(self, data, lon_grid, lat_grid, how = 'mean', min_size = 64):
+
+        if how not in ['max', 'mean']:
+            raise ValueError('how must be max or mean, got {}'.format(how))
+        self.how = how
+
+        if np.ma.isMaskedArray(data):
+            data = data.astype(np.float64).filled(np.nan)
+        data = np.asarray(data, dtype = np.float64)
+        lon_grid = np.asarray(lon_grid, dtype = np.float64)
+        lat_grid = np.asarray(lat_grid, dtype = np.float64)
+
+        #每一级: (data, lon_grid, lat_grid)
+        self.levels = [(data, lon_grid, lat_grid)]
+
+        #mean需要用 和/个数 逐级计算
+        total = np.where(np.isnan(data), 0, data)
+        count = (~np.isnan(data)).astype(np.float64)
+        lon_total, lat_total = lon_grid, lat_grid
+        lon_count = np.ones(lon_grid.shape)
+
+        while min(self.levels[-1][0].shape) >= 2 * min_size:
+            if how == 'max':
+                level_data = block_reduce(self.levels[-1][0], 2, 'max')
+            else:
+                total = block_reduce(total, 2, 'sum')
+                count = block_reduce(count, 2, 'sum')
+                with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                    level_data = np.where(count > 0, total / count, np.nan)
+
+            lon_total = block_reduce(lon_total, 2, 'sum')
+            lat_total = block_reduce(lat_total, 2, 'sum')
+            lon_count = block_reduce(lon_count, 2, 'sum')
+
+            self.levels.append((level_data, lon_total / lon_count, lat_total / lon_count))
+
+    @property
+    def n_levels(self):
+        return len(self.levels)
+
+    def get(self, level):
+        '''
+        func: 获取第level级的 (data, lon_grid, lat_grid)
+        '''
+        return self.levels[level]
+
+    def select(self, width = 1120, height = 640, loc_range = None):
+        '''
+        func: 选择显示范围内格点数不少于像素数的最粗一级，并截取显示范围
+        inputs:
+            width, height: 输出区域的像素数
+            loc_range: 显示范围 [lat_min,lat_max,lon_min,lon_max], 默认None，即整个网格
+        return:
+            data, lon_grid, lat_grid: 截取后的网格
+        '''
+        chosen = None
+        for level in range(self.n_levels - 1, -1, -1):
+            data, lon_grid, lat_grid = self.subset(level, loc_range)
+            chosen = (data, lon_grid, lat_grid)
+            if data.shape[0] >= height and data.shape[1] >= width:
+                break
+
+        return chosen
+
+    def subset(self, level, loc_range = None):
+        '''
+        func: 截取第level级网格中显示范围内的部分(包括范围外的一圈格点，保证填色覆盖整个显示范围)
+        '''
+        data, lon_grid, lat_grid = self.levels[level]
+        if loc_range is None:
+            return data, lon_grid, lat_grid
+
+        lat_min, lat_max, lon_min, lon_max = loc_range
+        rows = np.where((np.max(lat_grid, axis = 1) >= lat_min) & (np.min(lat_grid, axis = 1) <= lat_max))[0]
+        cols = np.where((np.max(lon_grid, axis = 0) >= lon_min) & (np.min(lon_grid, axis = 0) <= lon_max))[0]
+        if len(rows) == 0 or len(cols) == 0:
+            return data[:0, :0], lon_grid[:0, :0], lat_grid[:0, :0]
+
+        rows = slice(max(rows[0] - 1, 0), rows[-1] + 2)
+        cols = slice(max(cols[0] - 1, 0), cols[-1] + 2)
+
+        return data[rows, cols], lon_grid[rows, cols], lat_grid[rows, cols]
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+性能统计: 可嵌套的命名计时器和计数器，默认关闭，开启后可导出JSON / Chrome trace，并给出各阶段耗时汇总表
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    enable() / disable() / is_enabled()   开启/关闭统计(默认关闭; 环境变量 PERF_ENABLE=1 时导入后即开启，便于子进程统计)
+    timer(name)        计时的上下文管理器，可以嵌套，嵌套的阶段名为 'build_T0/read_surface' 的形式
+    timed(name)        计时的装饰器
+    count(name, n)     计数器累加, eg: count('vars_interpolated')
+    count_file(file)   读取一个文件: files_read + 1, bytes_parsed + 文件大小
+    summary()          各阶段耗时汇总表 pd.DataFrame: 调用次数、总耗时、平均耗时、最大耗时、占顶层总耗时的百分比
+    counters()         所有计数器 {name: value}
+    print_summary()    打印汇总表和计数器
+    to_json(file)      导出所有阶段的统计、计数器和事件
+    to_chrome_trace(file)  导出Chrome trace格式(chrome://tracing 或 https://ui.perfetto.dev 打开)
+    get_state() / merge_state(state)  子进程返回统计结果，主进程合并
+    reset()            清空统计
+
+原来各构建函数在循环中 print('cost:', ...) / print('total time cost:', ...)，
+每个文件/变量都打印一行，既有开销，也无法汇总整个构建的各阶段耗时。
+关闭时 timer() 返回同一个空的上下文管理器，count() 直接返回，开销只有一次函数调用。
+
+常用的计数器名称:
+    files_read           读取的文件数
+    bytes_parsed         解析的字节数
+    vars_interpolated    插值到站点的变量数
+    stations_aligned     与站点表对齐的站点数
+    outliers_corrected   SMS降水异常值修正的格点数
+    lag_samples_built    构建的滞后特征样本数(各time_gap之和)
+    lag_samples_up_to_date  构建清单中已是最新、跳过的滞后特征样本数
+    figures_rendered     检验报告绘制的图片数
+
+用法:
+    import Perf_utils as perf
+    perf.enable()
+    with perf.timer('build_T0'):
+        with perf.timer('read_surface'):
+            ...
+        perf.count('files_read')
+    perf.print_summary()
+    perf.to_chrome_trace('D:/zhongqi/perf/build_T0.trace.json')
+'''
+#%%
+
+import os
+import time
+import threading
+import functools
+import pandas as pd
+
+from Build_manifest import atomic_write_json
+
+
+_state = {'enabled': False}
+_lock = threading.Lock()
+_local = threading.local()
+
+#{阶段名: [调用次数, 总耗时, 最大耗时]}
+_stats = {}
+#{计数器名: 值}
+_counters = {}
+#Chrome trace事件: (阶段名, 开始时刻(perf_counter, s), 耗时(s), pid, tid)
+_events = []
+#超过该数目后不再记录事件(汇总统计仍然记录)，避免长时间构建时占用过多内存
+max_events = 200000
+
+
+def enable():
+    _state['enabled'] = True
+
+
+def disable():
+    _state['enabled'] = False
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def reset():
+    '''
+    func: 清空所有统计
+    '''
+    with _lock:
+        _stats.clear()
+        _counters.clear()
+        del _events[:]
+
+    return None
+
+
+class _NullTimer():
+    '''
+    func: 关闭统计时使用的空上下文管理器
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class _Timer():
+    '''
+    func: 计时的上下文管理器。阶段名为所有外层阶段名用'/'连接
+    '''
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self.path = stack[-1] + '/' + self.name if stack else self.name
+        stack.append(self.path)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        end = time.perf_counter()
+        _local.stack.pop()
+        cost = end - self.start
+
+        with _lock:
+            stat = _stats.get(self.path)
+            if stat is None:
+                _stats[self.path] = [1, cost, cost]
+            else:
+                stat[0] += 1
+                stat[1] += cost
+                stat[2] = max(stat[2], cost)
+
+            if len(_events) < max_events:
+                _events.append((self.path, self.start, cost, os.getpid(), threading.get_ident()))
+
+        return False
+
+
+def timer(name):
+    '''
+    func: 计时的上下文管理器，可以嵌套
+    inputs:
+        name: 阶段名, eg: 'read_surface'
+    return:
+        上下文管理器; 关闭统计时为空操作
+    '''
+    if not _state['enabled']:
+        return _null_timer
+
+    return _Timer(name)
+
+
+def timed(name = None):
+    '''
+    func: 计时的装饰器, 默认阶段名为函数名
+    '''
+    def decorator(func):
+        stage = name if name is not None else func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return func(*args, **kwargs)
+            with _Timer(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, n = 1):
+    '''
+    func: 计数器累加
+    inputs:
+        name: 计数器名, eg: 'files_read'
+        n: 累加值
+    '''
+    if not _state['enabled']:
+        return None
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+    return None
+
+
+def count_file(filename):
+    '''
+    func: 读取一个文件: files_read + 1, bytes_parsed + 文件大小
+    '''
+    if not _state['enabled']:
+        return None
+
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        size = 0
+
+    with _lock:
+        _counters['files_read'] = _counters.get('files_read', 0) + 1
+        _counters['bytes_parsed'] = _counters.get('bytes_parsed', 0) + size
+
+    return None
+
+
+def counters():
+    '''
+    func: 所有计数器
+    return:
+        dict, {name: value}
+    '''
+    with _lock:
+        return dict(_counters)
+
+
+def summary():
+    '''
+    func: 各阶段耗时汇总表，按阶段名排序(嵌套的阶段排在外层阶段之后)
+    return:
+        pd.DataFrame, columns = ['stage','depth','calls','total_s','mean_s','max_s','percent']
+        percent: 占所有顶层阶段总耗时的百分比
+    '''
+    with _lock:
+        items = [(path, stat[0], stat[1], stat[2]) for path, stat in _stats.items()]
+
+    columns = ['stage','depth','calls','total_s','mean_s','max_s','percent']
+    if len(items) == 0:
+        return pd.DataFrame(columns = columns)
+
+    table = pd.DataFrame(items, columns = ['stage','calls','total_s','max_s'])
+    table['depth'] = table['stage'].str.count('/')
+    table['mean_s'] = table['total_s'] / table['calls']
+
+    top_total = table.loc[table['depth'] == 0, 'total_s'].sum()
+    table['percent'] = 100 * table['total_s'] / top_total if top_total > 0 else 0.0
+
+    table = table.sort_values('stage', ascending = True)
+    table.index = range(len(table))
+
+    return table[columns]
+
+
+def print_summary():
+    '''
+    func: 打印各阶段耗时汇总表和计数器，嵌套的阶段缩进显示
+    '''
+    table = summary()
+    print('{:<48s}{:>8s}{:>12s}{:>12s}{:>12s}{:>9s}'.format('stage', 'calls', 'total(s)', 'mean(s)', 'max(s)', '%'))
+    for row in table.itertuples():
+        stage = '  ' * row.depth + row.stage.split('/')[-1]
+        print('{:<48s}{:>8d}{:>12.3f}{:>12.4f}{:>12.4f}{:>9.1f}'.format(
+            stage, row.calls, row.total_s, row.mean_s, row.max_s, row.percent))
+
+    for name, value in sorted(counters().items()):
+        print('{:<48s}{:>12}'.format(name, value))
+
+    return None
+
+
+def get_state():
+    '''
+    func: 当前进程的统计结果(可pickle)，子进程返回给主进程后用 merge_state() 合并
+    '''
+    with _lock:
+        return {'stats': {path: list(stat) for path, stat in _stats.items()},
+                'counters': dict(_counters),
+                'events': list(_events)}
+
+
+def merge_state(state):
+    '''
+    func: 将子进程的统计结果合并到当前进程
+    '''
+    with _lock:
+        for path, (calls, total, max_cost) in state['stats'].items():
+            stat = _stats.get(path)
+            if stat is None:
+                _stats[path] = [calls, total, max_cost]
+            else:
+                stat[0] += calls
+                stat[1] += total
+                stat[2] = max(stat[2], max_cost)
+
+        for name, value in state['counters'].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+        _events.extend(state['events'][:max(0, max_events - len(_events))])
+
+    return None
+
+
+def _atomic_write_json(save_file, data):
+    '''
+    func: 先写入临时文件再替换(见Build_manifest.atomic_write_json)，避免中断时留下不完整的文件
+    '''
+    save_path = os.path.dirname(save_file)
+    if save_path != '' and not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    atomic_write_json(data, save_file, ensure_ascii = False, indent = 1)
+
+    return save_file
+
+
+def to_json(save_file, include_events = False):
+    '''
+    func: 导出统计结果为JSON: {'stages': [...], 'counters': {...}, 'events': [...](可选)}
+    inputs:
+        include_events: 是否包括每次计时的事件，默认False
+    '''
+    data = {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'stages': summary().to_dict(orient = 'records'),
+            'counters': counters()}
+    if include_events:
+        with _lock:
+            events = list(_events)
+        t0 = min([e[1] for e in events]) if len(events) > 0 else 0
+        data['events'] = [{'stage': e[0], 'start_s': e[1] - t0, 'cost_s': e[2], 'pid': e[3], 'tid': e[4]} for e in events]
+
+    return _atomic_write_json(save_file, data)
+
+
+def to_chrome_trace(save_file):
+    '''
+    func: 导出Chrome trace格式(Trace Event Format)，每次计时为一个完整事件(ph = 'X')，
+          计数器的最终值作为一个计数事件(ph = 'C')
+    '''
+    with _lock:
+        events = list(_events)
+
+    #perf_counter在同一台机器的各进程间一致(单调时钟)，合并的子进程事件可以直接对齐
+    t0 = min([e[1] for e in events]) if len(events) > 0 else 0
+    trace = []
+    for path, start, cost, pid, tid in events:
+        trace.append({'name': path.split('/')[-1], 'cat': path, 'ph': 'X',
+                      'ts': (start - t0) * 1e6, 'dur': cost * 1e6, 'pid': pid, 'tid': tid})
+
+    end = max([e[1] + e[2] - t0 for e in events]) if len(events) > 0 else 0
+    for name, value in counters().items():
+        trace.append({'name': name, 'ph': 'C', 'ts': end * 1e6, 'pid': os.getpid(), 'args': {name: value}})
+
+    return _atomic_write_json(save_file, {'traceEvents': trace, 'displayTimeUnit': 'ms'})
+
+
+if os.environ.get('PERF_ENABLE', '0') not in ['', '0']:
+    enable()
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+逐小时站点观测(jiami)的质量控制: 空间邻站检验(buddy check) + 时间一致性检验
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    jiami_obs_cube()     读取多个时刻的加密观测文件(get_jiami_obs)，按站点文件的顺序对齐为 (time, station, var) 数组
+    robust_median()      沿最后一维的中位数，nan不参与计算(排序 + 按有效个数取中间值，全部向量化)
+    BuddyCheck           空间邻站检验: 每个站点与最近的k个邻站的中位数比较(稳健z-score)，并做海拔订正
+    buddy_check_params   各要素默认的检验参数
+    
+    rolling_mean_std()   沿时间维的滑动窗口平均值/标准差(累加和实现，O(n)，与窗口长度无关)
+    step_test()          跳变检验: 相邻两个时刻的变化量超过max_step
+    persistence_test()   持续性检验: 连续min_run个时刻及以上数值不变(仪器卡死)
+    rolling_zscore_test() 滑动z-score检验: 与前window个时刻的平均值的偏差超过z_threshold个标准差
+    temporal_qc()        执行以上时间一致性检验，输出按位压缩的质控标识(uint8)
+    temporal_check_params 各要素默认的时间一致性检验参数
+    unpack_flags()       从质控标识中取出某一项检验的结果
+    count_flags()        统计每一项检验标记的个数
+
+空间邻站检验(buddy check):
+    对每个时刻、每个站点，取最近的k个邻站(不包括自身)的观测值，按海拔差订正到本站高度:
+        adjusted = neighbor_value + lapse_rate * (neighbor_height - station_height)
+    稳健z-score:
+        z = (value - median(adjusted)) / max(1.4826 * MAD(adjusted), min_sigma)
+    |z| > z_threshold 且有效邻站个数 >= min_neighbors 时标记为可疑值。
+    邻站index和海拔差只在初始化时计算一次(KD树，见Verify_utils.StationNeighbors)，
+    之后所有时刻、所有站点的检验都是对 (time, station, k) 数组的向量化计算，一个季节的观测几秒内完成。
+
+用法:
+    catalog = StationCatalog.load('D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv')
+    times, obs = jiami_obs_cube(abs_files, catalog.station_num, columns = ['气温','小时降水量'])
+    buddy = BuddyCheck.from_station_file('D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv', k = 10)
+    flags, z = buddy.check(obs[..., 0], **buddy_check_params['气温'])
+    obs[..., 0][flags] = np.nan
+
+时间一致性检验:
+    输入为按时间排序、逐小时连续的 (time, station) 数组(缺少的时刻用nan填充)，所有检验沿时间维向量化计算，
+    不需要逐站点循环。质控标识 qc_flags 为与数据shape一致的uint8数组，每一位对应一项检验:
+        QC_BUDDY = 1    空间邻站检验
+        QC_STEP = 2     跳变检验
+        QC_PERSIST = 4  持续性检验
+        QC_ZSCORE = 8   滑动z-score检验
+    eg: qc_flags == 0 为通过所有检验; (qc_flags & QC_STEP) != 0 为未通过跳变检验
+    qc_flags = temporal_qc(obs[..., 0], **temporal_check_params['气温'])
+    qc_flags |= np.where(flags, QC_BUDDY, 0).astype(np.uint8)
+'''
+#%%
+
+import os
+import numpy as np
+import pandas as pd
+
+from All_utils_funs import get_jiami_obs
+from Verify_utils import StationNeighbors
+from Station_catalog import StationCatalog
+
+
+#各要素默认的检验参数
+#lapse_rate: 每升高1m要素的减小量(气温约0.0065℃/m，露点温度约0.002℃/m，降水不做订正)
+#min_sigma: 邻站离散程度的下限，避免邻站数值完全相同(eg: 都无降水)时 MAD = 0 导致z-score过大
+buddy_check_params = {'气温': {'lapse_rate': 0.0065, 'z_threshold': 4, 'min_sigma': 1.0},
+                      '最高气温': {'lapse_rate': 0.0065, 'z_threshold': 4, 'min_sigma': 1.0},
+                      '最低气温': {'lapse_rate': 0.0065, 'z_threshold': 4, 'min_sigma': 1.0},
+                      '露点温度': {'lapse_rate': 0.002, 'z_threshold': 4, 'min_sigma': 1.5},
+                      '小时降水量': {'lapse_rate': 0, 'z_threshold': 6, 'min_sigma': 2.0},
+                      }
+
+#质控标识中每一项检验对应的位
+QC_BUDDY = 1
+QC_STEP = 2
+QC_PERSIST = 4
+QC_ZSCORE = 8
+
+qc_flag_names = {QC_BUDDY: 'buddy', QC_STEP: 'step', QC_PERSIST: 'persistence', QC_ZSCORE: 'zscore'}
+
+#各要素默认的时间一致性检验参数，为None的检验不做
+#max_step: 1小时最大变化量; min_run: 连续不变的最少时刻数; ignore_values: 不做持续性检验的值(eg: 无降水)
+temporal_check_params = {'气温': {'max_step': 8, 'min_run': 6, 'window': 24, 'z_threshold': 5, 'min_sigma': 1.0},
+                         '最高气温': {'max_step': 8, 'min_run': 6, 'window': 24, 'z_threshold': 5, 'min_sigma': 1.0},
+                         '最低气温': {'max_step': 8, 'min_run': 6, 'window': 24, 'z_threshold': 5, 'min_sigma': 1.0},
+                         '露点温度': {'max_step': 10, 'min_run': 6, 'window': 24, 'z_threshold': 5, 'min_sigma': 1.5},
+                         '小时降水量': {'max_step': None, 'min_run': 4, 'ignore_values': [0], 'window': None},
+                         }
+
+#T0数据集(StationCubeStore)中对应的特征名
+for name, alias in [('气温', '3_T-0_surface_plot-T'), ('露点温度', '1_T-0_surface_plot-Td'),
+                    ('小时降水量', '0_T-0_surface_r1-p')]:
+    buddy_check_params[alias] = buddy_check_params[name]
+    temporal_check_params[alias] = temporal_check_params[name]
+
+
+def jiami_obs_cube(abs_files, station_num, columns = ['气温', '露点温度', '小时降水量']):
+    '''
+    func: 读取多个时刻的加密观测文件，并按station_num的顺序对齐(没有观测的站点为nan)
+    inputs:
+        abs_files: 加密观测文件的绝对路径列表，eg: ['D:/ori_data/aws_jiami/2018080420.txt', ...]
+        station_num: 站点号列表，eg: all_jiami_station_lon_lat_alt.csv 中的 station_num
+        columns: 读取的要素，eg: ['气温', '露点温度', '小时降水量']
+    return:
+        times: 各文件对应的时间(文件名)，eg: ['2018080420', ...]
+        cube: np.array, float32, shape = (len(abs_files), len(station_num), len(columns))
+    '''
+    station_num = pd.Index([str(num) for num in station_num])
+    cube = np.full((len(abs_files), len(station_num), len(columns)), np.nan, dtype = np.float32)
+    times = []
+
+    for i, abs_file in enumerate(abs_files):
+        times.append(os.path.basename(abs_file).split('.')[0])
+
+        pd_data = get_jiami_obs(abs_file, filetype = 'pd', sort = False)
+        pd_data = pd_data.drop_duplicates('站号')
+
+        #站点在station_num中的位置，不在其中的站点为 -1
+        index = station_num.get_indexer(pd_data['站号'].astype(str))
+        valid = index >= 0
+        cube[i, index[valid]] = pd_data[columns].values[valid]
+
+    return times, cube
+
+
+def robust_median(values):
+    '''
+    func: 沿最后一维的中位数，nan不参与计算；全为nan时为nan。
+          np.nanmedian对多维数组较慢，这里将nan替换为inf后排序，按每行的有效个数取中间的一个/两个值
+    inputs:
+        values: np.array, shape = (..., k)
+    return:
+        median: np.array, shape = values.shape[:-1]
+        count: 每行的有效个数
+    '''
+    values = np.asarray(values)
+    isnan = np.isnan(values)
+    count = values.shape[-1] - np.count_nonzero(isnan, axis = -1)
+
+    values = np.sort(np.where(isnan, np.inf, values), axis = -1)
+
+    low = np.maximum((count - 1) // 2, 0)[..., None]
+    high = np.maximum(count // 2, 0)[..., None]
+    with np.errstate(invalid = 'ignore'):
+        median = (np.take_along_axis(values, low, axis = -1) + np.take_along_axis(values, high, axis = -1))[..., 0] / 2
+    median[count == 0] = np.nan
+
+    return median, count
+
+
+class BuddyCheck():
+    '''
+    func: 空间邻站检验。初始化时计算每个站点最近的k个邻站(不包括自身)的index和海拔差，
+          check() 对所有时刻、所有站点做向量化的稳健z-score检验
+    Parameter
+    ----------------------------
+    lon, lat, height: np.array
+        所有站点的经纬度和海拔(m)，顺序与观测数据的站点顺序一致
+    k: int
+        邻站个数(不包括自身)，默认10
+    max_height_diff: float or None
+        与本站海拔差超过max_height_diff(m)的邻站不参与检验，默认None，即不限制
+    station_num: list or None
+        站点号，仅用于记录
+
+    用法:
+        buddy = BuddyCheck.from_station_file(all_station_file, k = 10)
+        flags, z = buddy.check(T, lapse_rate = 0.0065, z_threshold = 4, min_sigma = 1)  #T.shape = (time, 4343)
+    '''
+    def __init__(self, lon, lat, height, k = 10, max_height_diff = None, station_num = None):
+
+        self.k = int(k)
+        self.max_height_diff = max_height_diff
+        self.station_num = station_num
+
+        height = np.asarray(height, dtype = np.float64)
+        n_station = len(height)
+
+        #最近的k+1个站点(包括自身)，去掉自身后为k个邻站
+        neighbors = StationNeighbors(lon, lat, k = self.k + 1)
+        index = neighbors.indices.reshape(n_station, -1)
+        own = np.arange(n_station)[:, None]
+        is_self = index == own
+
+        #StationNeighbors 保证每行有且只有一个自身
+        self.index = index[~is_self].reshape(n_station, -1)
+
+        #邻站海拔 - 本站海拔，海拔缺测时不订正
+        self.height_diff = height[self.index] - height[:, None]
+        self.height_diff[np.isnan(self.height_diff)] = 0
+
+        self.neighbor_valid = np.ones(self.index.shape, dtype = bool)
+        if max_height_diff is not None:
+            self.neighbor_valid = np.abs(self.height_diff) <= max_height_diff
+
+    @classmethod
+    def from_station_file(cls, all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv',
+                          k = 10, max_height_diff = None):
+        '''
+        func: 由站点文件(all_jiami_station_lon_lat_alt.csv)构建，站点顺序与站点文件一致
+        '''
+        #进程内共享的站点表，同一个站点文件只读取一次
+        catalog = StationCatalog.load(all_station_file)
+
+        return cls(catalog.lon, catalog.lat, catalog.height, k = k, max_height_diff = max_height_diff,
+                   station_num = catalog.station_num)
+
+    @property
+    def n_station(self):
+        return len(self.index)
+
+    def check(self, values, lapse_rate = 0, z_threshold = 4, min_sigma = 1.0, min_neighbors = 3,
+              chunk_size = 256):
+        '''
+        func: 空间邻站检验
+        inputs:
+            values: 观测值, shape = (n_station,) 或 (time, n_station), nan为缺测
+            lapse_rate: 每升高1m要素的减小量，邻站观测订正到本站高度: value + lapse_rate * 海拔差, 默认0
+            z_threshold: |z| > z_threshold 标记为可疑值，默认4
+            min_sigma: 邻站离散程度(1.4826*MAD)的下限，默认1.0
+            min_neighbors: 有效邻站个数 >= min_neighbors 时才做检验，默认3
+            chunk_size: 每次计算的时刻数，控制内存，默认256
+        return:
+            flags: bool数组，与values的shape一致, True为可疑值
+            z: float32数组，与values的shape一致，无法检验的为nan
+        '''
+        #观测精度远低于float32的精度，用float32计算(排序)更快
+        values = np.asarray(values, dtype = np.float32)
+        if values.shape[-1] != self.n_station:
+            raise ValueError('values has {} stations, BuddyCheck has {}'.format(values.shape[-1], self.n_station))
+
+        shape = values.shape
+        values = values.reshape(-1, self.n_station)
+
+        z = np.full(values.shape, np.nan, dtype = np.float32)
+        adjust = (lapse_rate * self.height_diff).astype(np.float32)
+
+        for start in range(0, len(values), chunk_size):
+            v = values[start:start + chunk_size]
+
+            #shape = (chunk, n_station, k)
+            neighbor = v[:, self.index] + adjust
+            neighbor[:, ~self.neighbor_valid] = np.nan
+
+            median, count = robust_median(neighbor)
+            mad, _ = robust_median(np.abs(neighbor - median[..., None]))
+            sigma = np.maximum(1.4826 * mad, min_sigma)
+
+            with np.errstate(invalid = 'ignore'):
+                z_chunk = (v - median) / sigma
+            z_chunk[count < min_neighbors] = np.nan
+            z[start:start + chunk_size] = z_chunk
+
+        with np.errstate(invalid = 'ignore'):
+            flags = np.abs(z) > z_threshold
+
+        return flags.reshape(shape), z.reshape(shape)
+
+
+def rolling_mean_std(values, window, exclude_current = True):
+    '''
+    func: 沿时间维(第0维)的滑动窗口平均值和标准差，nan不参与计算。
+          用累加和(cumsum)实现，每个点的计算量与窗口长度无关
+    inputs:
+        values: np.array, shape = (time, ...)
+        window: 窗口长度(时刻数)
+        exclude_current: 默认True，窗口为 [t-window, t-1]，不包括当前时刻(当前时刻的异常值不影响平均值);
+                         False时窗口为 [t-window+1, t]
+    return:
+        mean, std: 与values的shape一致(ddof = 0)
+        count: 窗口内的有效个数
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    valid = ~np.isnan(values)
+
+    #先减去每个站点的平均值，避免累加平方和时损失精度
+    with np.errstate(invalid = 'ignore'):
+        center = np.nanmean(values, axis = 0) if len(values) > 0 else 0
+    center = np.where(np.isnan(center), 0, center)
+    x = np.where(valid, values - center, 0)
+
+    #在第0维前面补0, cum[t]为前t个时刻的和
+    pad = np.zeros((1,) + values.shape[1:])
+    cum_n = np.concatenate([pad, np.cumsum(valid, axis = 0)], axis = 0)
+    cum_x = np.concatenate([pad, np.cumsum(x, axis = 0)], axis = 0)
+    cum_x2 = np.concatenate([pad, np.cumsum(x*x, axis = 0)], axis = 0)
+
+    #时刻t的窗口为 [start, end), 即 cum[end] - cum[start]
+    t = np.arange(len(values))
+    end = t if exclude_current else t + 1
+    start = np.maximum(end - window, 0)
+
+    count = cum_n[end] - cum_n[start]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = (cum_x[end] - cum_x[start]) / count
+        var = (cum_x2[end] - cum_x2[start]) / count - mean*mean
+        std = np.sqrt(np.maximum(var, 0))
+
+    return mean + center, std, count
+
+
+def step_test(values, max_step):
+    '''
+    func: 跳变检验。|values[t] - values[t-1]| > max_step 时，标记时刻t(两个时刻都不为nan时才检验)
+    inputs:
+        values: np.array, shape = (time, ...), 逐小时连续
+        max_step: 1小时最大变化量
+    return:
+        bool数组，与values的shape一致
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    flags = np.zeros(values.shape, dtype = bool)
+
+    with np.errstate(invalid = 'ignore'):
+        flags[1:] = np.abs(values[1:] - values[:-1]) > max_step
+
+    return flags
+
+
+def persistence_test(values, min_run, ignore_values = None, tolerance = 0):
+    '''
+    func: 持续性检验。连续 >= min_run 个时刻的值不变(相邻时刻之差 <= tolerance)时，标记这一段所有时刻; nan会打断连续段
+    inputs:
+        values: np.array, shape = (time, ...), 逐小时连续
+        min_run: 连续不变的最少时刻数, eg: 6
+        ignore_values: 不做检验的值的列表，eg: 降水为[0]，即长时间无降水不标记
+        tolerance: 相邻时刻之差 <= tolerance 时认为不变，默认0
+    return:
+        bool数组，与values的shape一致
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    n_time = len(values)
+    if n_time == 0:
+        return np.zeros(values.shape, dtype = bool)
+
+    #same[t]: 时刻t与t-1的值相同; 不相同的时刻为一个连续段的起点
+    same = np.zeros(values.shape, dtype = bool)
+    with np.errstate(invalid = 'ignore'):
+        same[1:] = np.abs(values[1:] - values[:-1]) <= tolerance
+
+    t = np.arange(n_time).reshape((-1,) + (1,)*(values.ndim - 1))
+
+    #每个时刻所在连续段的起点: 对起点的时刻做累计最大值
+    run_start = np.maximum.accumulate(np.where(same, 0, t), axis = 0)
+
+    #每个时刻所在连续段的终点: 下一个时刻是起点(或者是最后一个时刻)的为终点，逆序做累计最小值
+    is_end = np.ones(values.shape, dtype = bool)
+    is_end[:-1] = ~same[1:]
+    run_end = np.minimum.accumulate(np.where(is_end, t, n_time)[::-1], axis = 0)[::-1]
+
+    flags = (run_end - run_start + 1 >= min_run) & ~np.isnan(values)
+
+    if ignore_values is not None:
+        flags &= ~np.isin(values, ignore_values)
+
+    return flags
+
+
+def rolling_zscore_test(values, window = 24, z_threshold = 5, min_sigma = 1.0, min_count = None):
+    '''
+    func: 滑动z-score检验。时刻t的值与前window个时刻(不包括t)的平均值之差超过 z_threshold 个标准差时标记
+    inputs:
+        values: np.array, shape = (time, ...), 逐小时连续
+        window: 窗口长度，默认24
+        z_threshold: 默认5
+        min_sigma: 标准差的下限，默认1.0
+        min_count: 窗口内有效个数 >= min_count 时才检验，默认None，即window的一半
+    return:
+        bool数组，与values的shape一致
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    min_count = window // 2 if min_count is None else min_count
+
+    mean, std, count = rolling_mean_std(values, window, exclude_current = True)
+
+    with np.errstate(invalid = 'ignore'):
+        z = (values - mean) / np.maximum(std, min_sigma)
+        flags = (np.abs(z) > z_threshold) & (count >= min_count)
+
+    return flags
+
+
+def temporal_qc(values, max_step = None, min_run = None, ignore_values = None, tolerance = 0,
+                window = None, z_threshold = 5, min_sigma = 1.0, min_count = None):
+    '''
+    func: 时间一致性检验，输出按位压缩的质控标识。参数为None的检验不做
+    inputs:
+        values: np.array, shape = (time, station) 或 (time, ...), 按时间排序且逐小时连续(缺少的时刻为nan)
+        max_step: 跳变检验的1小时最大变化量
+        min_run, ignore_values, tolerance: 持续性检验的参数，见persistence_test()
+        window, z_threshold, min_sigma, min_count: 滑动z-score检验的参数，见rolling_zscore_test()
+    return:
+        qc_flags: np.uint8数组，与values的shape一致，每一位对应一项检验(QC_STEP/QC_PERSIST/QC_ZSCORE)
+    用法:
+        qc_flags = temporal_qc(T, **temporal_check_params['气温'])
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    qc_flags = np.zeros(values.shape, dtype = np.uint8)
+
+    if max_step is not None:
+        qc_flags[step_test(values, max_step)] |= QC_STEP
+
+    if min_run is not None:
+        qc_flags[persistence_test(values, min_run, ignore_values, tolerance)] |= QC_PERSIST
+
+    if window is not None:
+        qc_flags[rolling_zscore_test(values, window, z_threshold, min_sigma, min_count)] |= QC_ZSCORE
+
+    return qc_flags
+
+
+def unpack_flags(qc_flags, bit):
+    '''
+    func: 从质控标识中取出某一项检验的结果
+    inputs:
+        qc_flags: temporal_qc() 的输出
+        bit: QC_BUDDY/QC_STEP/QC_PERSIST/QC_ZSCORE，也可以是多项的组合，eg: QC_STEP | QC_ZSCORE
+    return:
+        bool数组，True为未通过其中任一项检验
+    '''
+    return (np.asarray(qc_flags) & bit) != 0
+
+
+def count_flags(qc_flags):
+    '''
+    func: 统计每一项检验标记的个数
+    return:
+        dict, eg: {'buddy': 0, 'step': 12, 'persistence': 30, 'zscore': 5, 'any': 40}
+    '''
+    qc_flags = np.asarray(qc_flags)
+    counts = {name: int(np.count_nonzero(qc_flags & bit)) for bit, name in qc_flag_names.items()}
+    counts['any'] = int(np.count_nonzero(qc_flags))
+
+    return counts
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+多机/多进程构建数据集时的 时间/站点 分片(shard)，以及分片结果的合并
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    ShardSpec             分片规则: 第index个分片(共count个)，按时间块或站点块确定性地分配任务
+    shard_store_file()    分片对应的部分store文件名, eg: T0.h5 --> T0.shard-1-of-4.h5
+    open_shard_store()    打开(新建)分片的部分store，并在文件中记录分片规则
+    merge_shard_stores()  将所有分片的部分store合并为一个store，合并前检查完整性，拒绝重叠
+    run_local_shards()    在本机用多个进程同时构建所有分片(不需要任何集群服务)
+
+分片规则:
+    by = 'time':    时刻 t 属于分片 (time_to_hour(t) // block_size) % count，
+                    block_size默认24小时，即按天轮流分配，每个分片的负荷基本相同;
+                    分配只与时刻本身有关，与每台机器上的文件列表无关，增加新的时刻不会改变已有时刻的分配
+    by = 'station': 站点文件中第 i 个站点属于分片 (i // block_size) % count，block_size默认64个站点
+
+多机构建流程:
+    1. 每台机器(或每个进程)使用不同的index: shard = ShardSpec(index, count)，
+       各自写出部分store, eg: T0.shard-0-of-4.h5, T0.shard-1-of-4.h5 ...
+    2. 将所有部分store拷贝到同一目录，merge_shard_stores('T0.h5') 合并为一个store
+'''
+#%%
+
+import os
+import numpy as np
+import pandas as pd
+import multiprocessing
+
+from Station_store import StationCubeStore
+from Lag_features import time_to_hour
+
+
+class ShardSpec():
+    '''
+    func: 分片规则
+    Parameter
+    ----------------------------
+    index: int
+        当前分片的编号, 0 <= index < count
+    count: int
+        分片总数
+    by: str
+        'time'(默认): 按时间块分片; 'station': 按站点块分片
+    block_size: int or None
+        by = 'time' 时为时间块的小时数，默认24; by = 'station' 时为站点块的站点数，默认64
+    '''
+    def __init__(self, index, count, by = 'time', block_size = None):
+
+        if by not in ['time', 'station']:
+            raise ValueError("shard by must be 'time' or 'station', got {}".format(by))
+        if not 0 <= int(index) < int(count):
+            raise ValueError('shard index {} out of range [0, {})'.format(index, count))
+
+        self.index = int(index)
+        self.count = int(count)
+        self.by = by
+        if block_size is None:
+            block_size = 24 if by == 'time' else 64
+        self.block_size = int(block_size)
+
+    def __repr__(self):
+        return 'ShardSpec({}, {}, by = {!r}, block_size = {})'.format(self.index, self.count, self.by, self.block_size)
+
+    @classmethod
+    def from_string(cls, spec_str, by = 'time', block_size = None):
+        '''
+        func: 从字符串构建分片规则, eg: '1/4' --> 第1个分片(共4个)
+        '''
+        index, count = spec_str.split('/')
+        return cls(int(index), int(count), by, block_size)
+
+    def owner_of_time(self, time):
+        '''
+        func: 时刻time所属的分片编号
+        '''
+        return (time_to_hour(time) // self.block_size) % self.count
+
+    def owns_time(self, time):
+        '''
+        func: 判断时刻time是否属于当前分片。按站点分片时，所有时刻都属于当前分片
+        '''
+        if self.by != 'time':
+            return True
+        return self.owner_of_time(time) == self.index
+
+    def select_times(self, times):
+        '''
+        func: 从times中选出属于当前分片的时刻
+        '''
+        return [t for t in times if self.owns_time(t)]
+
+    def station_owner(self, n_station):
+        '''
+        func: 每个站点(按站点文件中的顺序)所属的分片编号
+        return:
+            np.array, shape = (n_station,)
+        '''
+        return (np.arange(n_station) // self.block_size) % self.count
+
+    def station_index(self, n_station):
+        '''
+        func: 属于当前分片的站点在站点文件中的index。按时间分片时，为所有站点
+        '''
+        if self.by != 'station':
+            return np.arange(n_station)
+        return np.where(self.station_owner(n_station) == self.index)[0]
+
+    def to_attrs(self):
+        return {'shard_index': self.index, 'shard_count': self.count,
+                'shard_by': self.by, 'shard_block_size': self.block_size}
+
+    @classmethod
+    def from_attrs(cls, attrs):
+        by = attrs['shard_by']
+        by = by.decode() if isinstance(by, bytes) else str(by)
+        return cls(int(attrs['shard_index']), int(attrs['shard_count']), by, int(attrs['shard_block_size']))
+
+
+def shard_store_file(store_file, spec):
+    '''
+    func: 分片对应的部分store文件名
+    inputs:
+        store_file: 合并后的store文件, eg: 'D:/.../T0.h5'
+        spec: ShardSpec
+    return:
+        eg: 'D:/.../T0.shard-1-of-4.h5'
+    '''
+    root, ext = os.path.splitext(store_file)
+    return '{}.shard-{}-of-{}{}'.format(root, spec.index, spec.count, ext)
+
+
+def open_shard_store(store_file, spec, n_station = None, mode = 'a', **kwargs):
+    '''
+    func: 打开分片的部分store，并在HDF5文件属性中记录分片规则(合并时用于检查)
+    inputs:
+        store_file: 合并后的store文件, 部分store为 shard_store_file(store_file, spec)
+        spec: ShardSpec
+        n_station: 站点文件中的总站点数; 按站点分片时必须提供，用于记录部分store中各站点在站点文件中的位置
+        kwargs: 传给 StationCubeStore 的其他参数
+    return:
+        StationCubeStore
+    '''
+    store = StationCubeStore(shard_store_file(store_file, spec), mode = mode, **kwargs)
+
+    if 'shard_count' in store.f.attrs:
+        old = ShardSpec.from_attrs(store.f.attrs)
+        if old.to_attrs() != spec.to_attrs():
+            store.close()
+            raise ValueError('{} was built with {}, not {}'.format(shard_store_file(store_file, spec), old, spec))
+    else:
+        for key, value in spec.to_attrs().items():
+            store.f.attrs[key] = value
+
+    if spec.by == 'station' and 'shard/station_position' not in store.f:
+        if n_station is None:
+            store.close()
+            raise ValueError('n_station is needed when shard by station')
+        store.f.attrs['shard_n_station'] = int(n_station)
+        store.f.create_dataset('shard/station_position', data = spec.station_index(n_station))
+
+    return store
+
+
+def _find_shard_files(store_file):
+    '''
+    func: 查找store_file对应的所有部分store, eg: T0.shard-*-of-*.h5
+    '''
+    root, ext = os.path.splitext(store_file)
+    save_dir = os.path.dirname(root) or '.'
+    prefix = os.path.basename(root) + '.shard-'
+
+    files = []
+    for name in sorted(os.listdir(save_dir)):
+        if name.startswith(prefix) and name.endswith(ext) and '-of-' in name:
+            files.append(os.path.join(save_dir, name))
+    return files
+
+
+def merge_shard_stores(store_file, shard_files = None, expected_times = None, overwrite = False):
+    '''
+    func: 合并所有分片的部分store。合并前检查:
+          1. 所有分片的规则(count/by/block_size)一致，编号 0 ~ count-1 每个恰好出现一次(缺少则不完整，重复则重叠);
+          2. 所有分片的特征列一致;
+          3. 按时间分片: 各分片的站点一致，每个时刻都属于其所在的分片，不同分片的时刻没有重叠;
+             按站点分片: 各分片的时刻一致，站点没有重叠，所有分片的站点合起来为站点文件中的全部站点;
+          4. 如果给定expected_times，合并后包含所有expected_times
+          任何一项不满足都抛出 ValueError，不写出合并后的store
+    inputs:
+        store_file: 合并后的store文件, eg: 'D:/.../T0.h5'
+        shard_files: 部分store文件列表，默认None，即store_file同目录下所有 T0.shard-*-of-*.h5
+        expected_times: 合并后应包含的所有时刻，默认None，即不检查
+        overwrite: store_file已存在时是否覆盖，默认False
+    return:
+        合并后的 (时刻数, 站点数, 特征数)
+    '''
+    if shard_files is None:
+        shard_files = _find_shard_files(store_file)
+    if len(shard_files) == 0:
+        raise ValueError('no shard store found for {}'.format(store_file))
+    if os.path.exists(store_file) and not overwrite:
+        raise ValueError('{} already exists'.format(store_file))
+
+    shards = [StationCubeStore(shard_file, mode = 'r') for shard_file in shard_files]
+    try:
+        ###step1: 分片规则和编号
+        specs = []
+        for shard, shard_file in zip(shards, shard_files):
+            if 'shard_count' not in shard.f.attrs:
+                raise ValueError('{} is not a shard store'.format(shard_file))
+            specs.append(ShardSpec.from_attrs(shard.f.attrs))
+
+        rule = {k: v for k, v in specs[0].to_attrs().items() if k != 'shard_index'}
+        for spec, shard_file in zip(specs, shard_files):
+            if {k: v for k, v in spec.to_attrs().items() if k != 'shard_index'} != rule:
+                raise ValueError('{} was built with {}, not consistent with {}'.format(shard_file, spec, specs[0]))
+
+        indexes = [spec.index for spec in specs]
+        duplicate = sorted(set(i for i in indexes if indexes.count(i) > 1))
+        missing = sorted(set(range(specs[0].count)) - set(indexes))
+        if duplicate:
+            raise ValueError('overlapping shards: index {} appears more than once'.format(duplicate))
+        if missing:
+            raise ValueError('incomplete shards: index {} of {} are missing'.format(missing, specs[0].count))
+
+        ###step2: 特征列
+        built = [shard for shard in shards if shard.initialized]
+        if len(built) == 0:
+            raise ValueError('all shard stores of {} are empty'.format(store_file))
+        columns = built[0].columns
+        for shard in built:
+            if shard.columns != columns:
+                raise ValueError('columns of {} are not equal with {}'.format(shard.store_file, built[0].store_file))
+
+        ###step3: 时刻和站点
+        if specs[0].by == 'time':
+            station_num = built[0].station_num
+            owner = {}
+            for shard, spec in zip(shards, specs):
+                if not shard.initialized:
+                    continue
+                if not np.array_equal(shard.station_num, station_num):
+                    raise ValueError('stations of {} are not equal with {}'.format(shard.store_file, built[0].store_file))
+                for t in shard.times:
+                    if spec.owner_of_time(t) != spec.index:
+                        raise ValueError('time {} in {} belongs to shard {}'.format(t, shard.store_file, spec.owner_of_time(t)))
+                    if t in owner:
+                        raise ValueError('overlapping time {} in {} and {}'.format(t, owner[t].store_file, shard.store_file))
+                    owner[t] = shard
+            times = sorted(owner.keys(), key = time_to_hour)
+            info = built[0].station_info()
+        else:
+            n_station = int(shards[0].f.attrs['shard_n_station'])
+            positions = [shard.f['shard/station_position'][:] for shard in shards]
+            all_positions = np.concatenate(positions)
+            if len(np.unique(all_positions)) != len(all_positions):
+                raise ValueError('overlapping stations between shards')
+            if len(all_positions) != n_station:
+                raise ValueError('incomplete stations: {} of {}'.format(len(all_positions), n_station))
+
+            times = None
+            for shard, position in zip(shards, positions):
+                if len(position) == 0:
+                    continue
+                if not shard.initialized:
+                    raise ValueError('{} is empty'.format(shard.store_file))
+                if times is None:
+                    times = shard.times
+                elif set(shard.times) != set(times):
+                    raise ValueError('times of {} are not equal with other shards'.format(shard.store_file))
+            times = sorted(times, key = time_to_hour)
+
+            #按站点文件中的顺序拼接站点信息
+            info = [shard.station_info() for shard in shards if shard.initialized]
+            order = np.argsort(np.concatenate([p for shard, p in zip(shards, positions) if shard.initialized]))
+            info = pd.concat(info, axis = 0).iloc[order]
+
+        if expected_times is not None:
+            missing_times = sorted(set(str(t) for t in expected_times) - set(times), key = time_to_hour)
+            if missing_times:
+                raise ValueError('incomplete times: {} missing, eg: {}'.format(len(missing_times), missing_times[:5]))
+
+        ###step4: 写出合并后的store。先写入临时文件，全部写完后才替换为store_file; 出错时删除临时文件
+        tmp_file = '{}.tmp-{}'.format(store_file, os.getpid())
+        try:
+            merged = StationCubeStore(tmp_file, mode = 'w', chunk_time = built[0].chunk_time,
+                                      chunk_station = built[0].chunk_station)
+            try:
+                merged.init_store(columns, info['station_num'].values, info['lon'].values,
+                                  info['lat'].values, info['height'].values)
+                for t in times:
+                    if specs[0].by == 'time':
+                        data = owner[t].read_time(t, filetype = 'array')
+                    else:
+                        data = np.concatenate([shard.read_time(t, filetype = 'array') for shard in shards
+                                               if shard.initialized], axis = 0)[order]
+                    merged.append(t, data)
+                shape = merged.shape
+            finally:
+                merged.close()
+            os.replace(tmp_file, store_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    finally:
+        for shard in shards:
+            shard.close()
+
+    return shape
+
+
+def run_local_shards(func, count, by = 'time', block_size = None, processes = None, args = ()):
+    '''
+    func: 在本机用多个进程同时构建所有分片
+    inputs:
+        func: 顶层函数(可被pickle)，调用方式为 func(ShardSpec, *args)，负责构建一个分片
+        count: 分片总数
+        by, block_size: 分片规则，见ShardSpec
+        processes: 进程数，默认None，即 min(count, cpu个数)
+        args: 传给func的其他参数
+    return:
+        每个分片func的返回值
+    '''
+    specs = [ShardSpec(i, count, by, block_size) for i in range(count)]
+    if processes is None:
+        processes = min(count, multiprocessing.cpu_count())
+
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(func, [(spec,) + tuple(args) for spec in specs])
+
+    return results
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+进程内共享的站点表(StationCatalog): 只读取一次站点文件，并可通过共享内存传给子进程
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    StationCatalog       站点表: 站点号/经纬度/高度保存为连续的numpy数组，提供站点号 -> index 的向量化查找和经纬度范围(ROI)的掩码
+    StationCatalog.load() 按 (文件路径, 修改时间) 缓存，同一进程内同一个站点文件只读取一次，文件被修改后自动重新读取
+
+原来ComposeMultipleData每次初始化都要 pd.read_csv(all_station_file) 并转换为list，
+而驱动代码对每个surface文件都新建一个实例; 之后用 list.index() / in 查找每个观测站点的位置，每个文件都是 O(n_obs × n_station)。
+这里:
+    1. station_num: np.array(str), 站点号中含有'A0302'这类字母开头的站点，不能保存为int64，
+       因此另外提供int64的 index(站点在站点文件中的行号)，查找站点号时用 lookup() 得到 int64 的 index;
+    2. lon/lat/height: float64 的连续数组;
+    3. roi_mask(loc_range): 每个经纬度范围只计算一次;
+    4. to_shared_memory() / from_shared_memory(): 主进程把站点表放入共享内存，子进程只接收一个很小的handle(dict)，
+       不需要再读取csv，也不需要通过pickle复制数组
+
+用法:
+    catalog = StationCatalog.load('D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv')
+    index = catalog.lookup(jiami_data['站号'])  #不在站点表中的站点为 -1
+    mask = catalog.roi_mask([30,50,105,125])
+
+    #多进程
+    handle = catalog.to_shared_memory()
+    pool = multiprocessing.Pool(8, initializer = StationCatalog.from_shared_memory, initargs = (handle,))
+    ...
+    catalog.unlink_shared_memory()
+'''
+#%%
+
+import os
+import numpy as np
+import pandas as pd
+
+import Perf_utils as perf
+
+
+#{(abs_path, mtime): StationCatalog}
+_catalog_cache = {}
+
+
+class StationCatalog():
+    '''
+    func: 站点表。一般通过 StationCatalog.load(station_file) 获取，同一个文件只读取一次
+    Parameter
+    ----------------------------
+    station_num: list or np.array
+        站点号, eg: ['58362', 'A0302', ...]
+    lon, lat, height: list or np.array
+        站点的经纬度和高度
+    station_file: str or None
+        站点文件路径，仅用于记录
+    '''
+    fix_features = ['station_num','lon','lat','height']
+
+    def __init__(self, station_num, lon, lat, height, station_file = None):
+
+        self.station_file = station_file
+        self.station_num = np.ascontiguousarray(np.asarray([str(s) for s in station_num], dtype = str))
+        self.lon = np.ascontiguousarray(lon, dtype = np.float64)
+        self.lat = np.ascontiguousarray(lat, dtype = np.float64)
+        self.height = np.ascontiguousarray(height, dtype = np.float64)
+        self.index = np.arange(len(self.station_num), dtype = np.int64)
+
+        self._init_cache()
+
+    def _init_cache(self):
+
+        #共享的数组不允许修改
+        for array in [self.station_num, self.lon, self.lat, self.height, self.index]:
+            array.flags.writeable = False
+
+        #站点号 -> index 的哈希表，只在第一次lookup时构建
+        self._num_index = None
+        self._num_position = None
+
+        #{loc_range: bool数组}
+        self._roi_cache = {}
+        self._shm = None
+
+    @classmethod
+    def load(cls, station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv'):
+        '''
+        func: 读取站点文件(all_jiami_station_lon_lat_alt.csv)，按 (文件路径, 修改时间) 缓存
+        return:
+            StationCatalog
+        '''
+        abs_file = os.path.abspath(station_file)
+        key = (abs_file, os.path.getmtime(abs_file))
+
+        if key not in _catalog_cache:
+            #文件被修改后，删除旧的缓存
+            for old_key in [k for k in _catalog_cache if k[0] == abs_file]:
+                del _catalog_cache[old_key]
+
+            station_lon_lat_pd = pd.read_csv(abs_file, dtype = {'station_num': str})
+            _catalog_cache[key] = cls(station_lon_lat_pd['station_num'].values, station_lon_lat_pd['lon'].values,
+                                      station_lon_lat_pd['lat'].values, station_lon_lat_pd['height'].values,
+                                      station_file = abs_file)
+
+        return _catalog_cache[key]
+
+    def __len__(self):
+        return len(self.station_num)
+
+    @property
+    def n_station(self):
+        return len(self.station_num)
+
+    def to_dataframe(self):
+        '''
+        func: 转换为 pd.DataFrame, columns = ['station_num','lon','lat','height'], 与站点文件一致
+        '''
+        return pd.DataFrame({'station_num': self.station_num.astype(object), 'lon': self.lon,
+                             'lat': self.lat, 'height': self.height})
+
+    def lookup(self, station_num):
+        '''
+        func: 站点号 -> 站点在站点表中的index(向量化的哈希查找)
+        inputs:
+            station_num: 站点号列表/数组/pd.Series
+        return:
+            np.array, int64, 不在站点表中的站点为 -1
+        '''
+        if self._num_index is None:
+            #站点文件中有重复的站点号，与list.index()一致，取第一次出现的位置
+            num_index = pd.Index(self.station_num.astype(object))
+            first = ~num_index.duplicated(keep = 'first')
+            self._num_index = num_index[first]
+            self._num_position = self.index[first]
+
+        station_num = pd.Index([str(s) for s in station_num], dtype = object)
+        position = self._num_index.get_indexer(station_num)
+        perf.count('stations_aligned', int(np.count_nonzero(position >= 0)))
+
+        return np.where(position >= 0, self._num_position[position], -1).astype(np.int64)
+
+    def contains(self, station_num):
+        '''
+        func: 站点号是否在站点表中
+        return:
+            bool数组
+        '''
+        return self.lookup(station_num) >= 0
+
+    def roi_mask(self, loc_range = [30,50,105,125]):
+        '''
+        func: 在经纬度范围内的站点(包括边界)，每个经纬度范围只计算一次
+        inputs:
+            loc_range: [lat_min,lat_max,lon_min,lon_max]
+        return:
+            bool数组(只读)，shape = (n_station,)
+        '''
+        key = tuple(float(v) for v in loc_range)
+        if key not in self._roi_cache:
+            lat_min, lat_max, lon_min, lon_max = key
+            mask = (self.lat >= lat_min) & (self.lat <= lat_max) & (self.lon >= lon_min) & (self.lon <= lon_max)
+            mask.flags.writeable = False
+            self._roi_cache[key] = mask
+
+        return self._roi_cache[key]
+
+    def roi_index(self, loc_range = [30,50,105,125]):
+        '''
+        func: 在经纬度范围内的站点的index
+        '''
+        return self.index[self.roi_mask(loc_range)]
+
+    def to_shared_memory(self):
+        '''
+        func: 将站点表放入共享内存(float64的 lon/lat/height 和 定长字符串的station_num 各一块)
+        return:
+            handle: dict, 很小，可以直接传给子进程，用 StationCatalog.from_shared_memory(handle) 获取站点表
+        '''
+        from multiprocessing import shared_memory
+
+        if self._shm is None:
+            values = np.stack([self.lon, self.lat, self.height], axis = 0)
+            shm_values = shared_memory.SharedMemory(create = True, size = max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype = values.dtype, buffer = shm_values.buf)[:] = values
+
+            shm_num = shared_memory.SharedMemory(create = True, size = max(self.station_num.nbytes, 1))
+            np.ndarray(self.station_num.shape, dtype = self.station_num.dtype, buffer = shm_num.buf)[:] = self.station_num
+
+            self._shm = (shm_values, shm_num)
+
+        return {'values': self._shm[0].name, 'station_num': self._shm[1].name,
+                'n_station': self.n_station, 'num_dtype': self.station_num.dtype.str,
+                'station_file': self.station_file}
+
+    @classmethod
+    def from_shared_memory(cls, handle):
+        '''
+        func: 子进程中由handle获取站点表(数组直接使用共享内存，不复制)，并放入该进程的缓存，
+              之后 StationCatalog.load(station_file) 直接返回该站点表; 可以作为进程池的initializer
+        return:
+            StationCatalog
+        '''
+        shm_values = _attach_shared_memory(handle['values'])
+        shm_num = _attach_shared_memory(handle['station_num'])
+
+        n_station = handle['n_station']
+        values = np.ndarray((3, n_station), dtype = np.float64, buffer = shm_values.buf)
+
+        catalog = cls.__new__(cls)
+        catalog.station_file = handle['station_file']
+        catalog.station_num = np.ndarray((n_station,), dtype = np.dtype(handle['num_dtype']), buffer = shm_num.buf)
+        catalog.lon, catalog.lat, catalog.height = values[0], values[1], values[2]
+        catalog.index = np.arange(n_station, dtype = np.int64)
+        catalog._init_cache()
+
+        #保持引用，避免共享内存被提前释放
+        catalog._attached = (shm_values, shm_num)
+
+        station_file = handle['station_file']
+        if station_file is not None and os.path.exists(station_file):
+            _catalog_cache[(station_file, os.path.getmtime(station_file))] = catalog
+
+        return catalog
+
+    def unlink_shared_memory(self):
+        '''
+        func: 主进程在所有子进程结束后释放共享内存
+        '''
+        if self._shm is not None:
+            for shm in self._shm:
+                shm.close()
+                shm.unlink()
+            self._shm = None
+
+        return None
+
+
+def _attach_shared_memory(name):
+    '''
+    func: 子进程连接已有的共享内存，由主进程负责unlink。
+          python >= 3.13 使用track = False; 更早的版本中，multiprocessing启动的子进程与主进程共用一个resource_tracker，
+          重复注册不会导致子进程退出时释放共享内存
+    '''
+    from multiprocessing import shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError:
+        return shared_memory.SharedMemory(name = name)
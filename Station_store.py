@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+站点-时间-特征 数据立方体(station cube)的HDF5存储
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    StationCubeStore  以HDF5文件保存所有时刻的T0站点数据集，代替每个时刻一个.csv文件。
+
+HDF5文件结构:
+    /data     float32, shape = (time, station, feature), 按时间维可扩展(逐时刻追加写入)，分块+gzip压缩
+              attrs['features']: 特征名称(不包括 station_num/lon/lat/height)
+              attrs['columns']: T0数据集原始的列顺序(包括 station_num/lon/lat/height)
+    /time     时间戳，eg: b'2018080420', 与/data的第0维一一对应
+    /digest   每个时刻数据的md5，与/time一一对应，append时写入; 作为该时刻数据的指纹(eg: 滞后数据集的构建清单)
+    /station/station_num, /station/lon, /station/lat, /station/height
+              站点元数据(4343个站点的数组超过HDF5属性64KB的限制，因此保存为小的dataset),
+              与/data的第1维一一对应。站点号中含有'A0302'这类字母开头的站点，因此以字符串保存
+    /qc       uint8, shape与/data一致，质控标识(按位压缩，见QC_utils.temporal_qc)，0为通过所有检验;
+              只有调用write_flags后才存在。append覆盖某一时刻的数据时，该时刻的质控标识清零
+'''
+#%%
+
+import hashlib
+import numpy as np
+import pandas as pd
+from Lazy_import import LazyModule
+h5py = LazyModule('h5py')
+
+
+class StationCubeStore():
+    '''
+    func: 站点-时间-特征 float32 数据立方体的HDF5存储。支持逐时刻追加写入，
+          以及快速读取任意时刻切片或任意站点切片
+    Parameter
+    ----------------------------
+    store_file: str
+        HDF5文件路径,eg: 'D:/zhongqi/ori_data/jiami_Station_Dataset_SMS_Drop/T0.h5'
+    mode: str
+        'a'(默认): 读写，不存在则新建; 'r': 只读; 'w': 新建(覆盖已有文件)
+    chunk_time, chunk_station: int
+        分块大小。默认(24, 64, 所有特征)，约0.7MB一块；
+        读取单个时刻需要解压 ceil(n_station/64) 块，读取单个站点全年的时间序列需要解压 ceil(n_time/24) 块
+    compression: str
+        压缩方式，默认'gzip'
+    compression_opts: int
+        压缩等级，默认4
+
+    用法:
+        store = StationCubeStore('T0.h5')
+        store.append('2018080420', T0_data)  #T0_data为get_T_0_TRAIN_dataset构建的pd.DataFrame
+        data = store.read_time('2018080420')  #与T0_data列顺序一致的 pd.DataFrame
+        store.close()
+    '''
+    fix_features = ['station_num','lon','lat','height']
+
+    def __init__(self, store_file, mode = 'a',
+                 chunk_time = 24, chunk_station = 64,
+                 compression = 'gzip', compression_opts = 4):
+
+        self.store_file = store_file
+        self.mode = mode
+        self.chunk_time = chunk_time
+        self.chunk_station = chunk_station
+        self.compression = compression
+        self.compression_opts = compression_opts
+
+        #加大chunk缓存(默认1MB)，连续读取相邻时刻/站点时避免重复解压同一块
+        self.f = h5py.File(store_file, mode, rdcc_nbytes = 64*1024*1024, rdcc_nslots = 10007)
+
+        #{时间戳: /data第0维的index}
+        self.time_index = {}
+        if 'time' in self.f:
+            self.time_index = {t.decode(): i for i, t in enumerate(self.f['time'][:])}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+        return None
+
+    def flush(self):
+        self.f.flush()
+        return None
+
+    @property
+    def initialized(self):
+        return 'data' in self.f
+
+    @property
+    def features(self):
+        return [str(v) for v in self.f['data'].attrs['features']]
+
+    @property
+    def columns(self):
+        return [str(v) for v in self.f['data'].attrs['columns']]
+
+    @property
+    def times(self):
+        return [t.decode() for t in self.f['time'][:]]
+
+    @property
+    def station_num(self):
+        return np.array([s.decode() for s in self.f['station/station_num'][:]], dtype = object)
+
+    @property
+    def shape(self):
+        return self.f['data'].shape
+
+    def station_info(self):
+        '''
+        func: 获取站点元数据
+        return: pd.DataFrame, columns = ['station_num','lon','lat','height']
+        '''
+        info = pd.DataFrame({name: self.f['station/' + name][:] for name in self.fix_features[1:]})
+        info.insert(0, 'station_num', self.station_num)
+        return info
+
+    def init_store(self, columns, station_num, lon, lat, height):
+        '''
+        func: 创建/data, /time, /station。一般不需要手动调用，第一次append时自动创建
+        inputs:
+            columns: T0数据集的所有列名(可以包括station_num/lon/lat/height, 这4列不存入/data)
+            station_num, lon, lat, height: 所有站点的站点号和经纬度、高度信息
+        '''
+        columns = [str(c) for c in columns]
+        features = [c for c in columns if c not in self.fix_features]
+        n_station = len(station_num)
+        n_feature = len(features)
+
+        chunks = (self.chunk_time, min(self.chunk_station, n_station), max(n_feature, 1))
+
+        data = self.f.create_dataset('data', shape = (0, n_station, n_feature),
+                                     maxshape = (None, n_station, n_feature),
+                                     dtype = np.float32, chunks = chunks,
+                                     compression = self.compression,
+                                     compression_opts = self.compression_opts,
+                                     shuffle = True, fillvalue = np.nan)
+
+        str_dtype = h5py.string_dtype(encoding = 'utf-8')
+        data.attrs.create('features', features, dtype = str_dtype)
+        data.attrs.create('columns', columns, dtype = str_dtype)
+
+        self.f.create_dataset('time', shape = (0,), maxshape = (None,), dtype = 'S10',
+                              chunks = (1024,))
+        self.f.create_dataset('digest', shape = (0,), maxshape = (None,), dtype = 'S32',
+                              chunks = (1024,))
+
+        self.f.create_dataset('station/station_num', data = np.array([str(s).encode() for s in station_num]))
+        self.f.create_dataset('station/lon', data = np.asarray(lon, dtype = np.float64))
+        self.f.create_dataset('station/lat', data = np.asarray(lat, dtype = np.float64))
+        self.f.create_dataset('station/height', data = np.asarray(height, dtype = np.float64))
+
+        return None
+
+    def has_time(self, time):
+        return str(time) in self.time_index
+
+    def append(self, time, data):
+        '''
+        func: 写入某个时刻的站点数据。如果该时刻已经存在，则覆盖原有数据
+        inputs:
+            time: 时间戳，eg: '2018080420'
+            data: pd.DataFrame。每行为一个站点，列包括所有特征和station_num/lon/lat/height;
+                  站点顺序必须与store中的站点顺序一致(即all_station_file中的顺序)
+                  也可以是shape = (n_station, n_feature)的 np.array, 此时列顺序必须与self.features一致
+        '''
+        time = str(time)
+
+        if isinstance(data, pd.DataFrame):
+            if not self.initialized:
+                self.init_store(list(data.columns), data['station_num'].values, data['lon'].values,
+                                data['lat'].values, data['height'].values)
+
+            if not np.array_equal(data['station_num'].astype(str).values, self.station_num.astype(str)):
+                raise ValueError('station_num of {} is not equal with the stations in {}'.format(time, self.store_file))
+
+            values = data[self.features].values
+        else:
+            values = np.asarray(data)
+
+        dset = self.f['data']
+        if values.shape != dset.shape[1:]:
+            raise ValueError('data shape {} is not equal with store shape {}'.format(values.shape, dset.shape[1:]))
+
+        if time in self.time_index:
+            i = self.time_index[time]
+        else:
+            i = dset.shape[0]
+            dset.resize(i + 1, axis = 0)
+            self.f['time'].resize(i + 1, axis = 0)
+            self.f['time'][i] = time.encode()
+            self.time_index[time] = i
+
+        values = values.astype(np.float32)
+        dset[i] = values
+
+        #旧版本创建的store没有/digest，由time_digest()读取数据计算
+        if 'digest' in self.f:
+            if self.f['digest'].shape[0] < dset.shape[0]:
+                self.f['digest'].resize(dset.shape[0], axis = 0)
+            self.f['digest'][i] = self.data_digest(values).encode()
+
+        #数据已更新，原来的质控标识不再有效
+        if 'qc' in self.f:
+            if self.f['qc'].shape[0] < dset.shape[0]:
+                self.f['qc'].resize(dset.shape[0], axis = 0)
+            self.f['qc'][i] = 0
+
+        return None
+
+    @staticmethod
+    def data_digest(values):
+        '''
+        func: 某个时刻数据(float32)的md5
+        '''
+        return hashlib.md5(np.ascontiguousarray(values, dtype = np.float32).tobytes()).hexdigest()
+
+    def time_digest(self, time):
+        '''
+        func: 获取某个时刻数据的md5，数据改变(重新append)时随之改变。
+              没有记录时(旧版本创建的store)读取该时刻的数据计算
+        inputs:
+            time: 时间戳，eg: '2018080420'
+        return:
+            md5 字符串
+        '''
+        i = self.time_index[str(time)]
+        if 'digest' in self.f and i < self.f['digest'].shape[0]:
+            digest = self.f['digest'][i].decode()
+            if digest != '':
+                return digest
+
+        return self.data_digest(self.f['data'][i])
+
+    def write_flags(self, qc_flags, time_index = slice(None), features = None):
+        '''
+        func: 写入质控标识(/qc)，不存在时自动创建，shape与/data一致
+        inputs:
+            qc_flags: np.uint8数组, shape = (n_time, n_station, n_feature), 与time_index/features对应;
+                      只有一个特征时也可以是 (n_time, n_station)
+            time_index: slice/递增的index列表，/data第0维的index, 默认所有时刻
+            features: 特征名列表，默认None，即所有特征
+        '''
+        dset = self.f['data']
+        if 'qc' not in self.f:
+            self.f.create_dataset('qc', shape = dset.shape, maxshape = dset.maxshape,
+                                  dtype = np.uint8, chunks = dset.chunks,
+                                  compression = self.compression,
+                                  compression_opts = self.compression_opts, fillvalue = 0)
+        qc = self.f['qc']
+        if qc.shape[0] < dset.shape[0]:
+            qc.resize(dset.shape[0], axis = 0)
+
+        qc_flags = np.asarray(qc_flags, dtype = np.uint8)
+        feature_index = self.feature_index(features)
+
+        if feature_index == slice(None):
+            qc[time_index] = qc_flags
+        else:
+            #h5py一次只支持一个维度的列表索引，逐个特征写入
+            qc_flags = qc_flags.reshape(qc_flags.shape[:2] + (len(feature_index),))
+            for j, index in enumerate(feature_index):
+                qc[time_index, :, index] = qc_flags[..., j]
+
+        return None
+
+    def read_flags(self, time_index = slice(None), station_index = slice(None), features = None):
+        '''
+        func: 读取质控标识，参数与read_cube一致。没有写入过质控标识时全为0
+        return:
+            np.array, uint8
+        '''
+        if 'qc' not in self.f:
+            shape = np.broadcast_to(np.zeros(1, dtype = bool), self.shape[:2])[time_index, station_index].shape
+            n_feature = self.shape[2] if features is None else len(features)
+            return np.zeros(shape + (n_feature,), dtype = np.uint8)
+
+        data = self.f['qc'][time_index, station_index]
+        feature_index = self.feature_index(features)
+        if feature_index != slice(None):
+            data = data[..., feature_index]
+
+        return data
+
+    def feature_index(self, features = None):
+        '''
+        func: 获取特征名在/data第2维中的index。features为None时返回slice(None),即所有特征
+        '''
+        if features is None:
+            return slice(None)
+
+        all_features = self.features
+        return [all_features.index(feature) for feature in features]
+
+    def read_cube(self, time_index = slice(None), station_index = slice(None), features = None):
+        '''
+        func: 读取数据立方体的一部分
+        inputs:
+            time_index: int/slice/递增的index列表，/data第0维的index
+            station_index: int/slice/递增的index列表，/data第1维的index
+            features: 特征名列表，默认None，即所有特征
+        return:
+            np.array, float32
+        '''
+        dset = self.f['data']
+        feature_index = self.feature_index(features)
+
+        #h5py一次只支持一个维度的列表索引，先按时间和站点读取，再在内存中选取特征
+        data = dset[time_index, station_index]
+        if feature_index != slice(None):
+            data = data[..., feature_index]
+
+        return data
+
+    def read_time(self, time, features = None, filetype = 'pd'):
+        '''
+        func: 读取某一时刻所有站点的数据
+        inputs:
+            time: 时间戳，eg: '2018080420'
+            features: 特征名列表，默认None，即所有特征
+            filetype: 'pd'(默认)，返回与T0数据集列顺序一致的pd.DataFrame(包括station_num/lon/lat/height);
+                      'array', 返回 shape = (n_station, n_feature)的数组
+        '''
+        data = self.read_cube(self.time_index[str(time)], slice(None), features)
+
+        if filetype == 'array':
+            return data
+
+        columns = self.features if features is None else list(features)
+        data = pd.DataFrame(data, columns = columns)
+
+        if features is None:
+            info = self.station_info()
+            for name in self.fix_features:
+                data[name] = info[name].values
+            data = data[self.columns]
+
+        return data
+
+    def read_times(self, times, features = None):
+        '''
+        func: 读取多个时刻的数据
+        return:
+            np.array, shape = (len(times), n_station, n_feature)
+        '''
+        index = [self.time_index[str(t)] for t in times]
+        order = np.argsort(index)
+
+        #h5py要求列表索引递增,先按递增顺序读取,再恢复原顺序
+        data = self.read_cube(list(np.array(index)[order]), slice(None), features)
+        data = data[np.argsort(order)]
+
+        return data
+
+    def read_station(self, station_num, features = None, filetype = 'pd'):
+        '''
+        func: 读取某个站点所有时刻的数据
+        inputs:
+            station_num: 站点号，eg: '58362' / 'A0302'
+            features: 特征名列表，默认None，即所有特征
+            filetype: 'pd'(默认)，返回index为时间戳的pd.DataFrame; 'array', 返回 shape = (n_time, n_feature)的数组
+        '''
+        i = int(np.where(self.station_num == str(station_num))[0][0])
+        data = self.read_cube(slice(None), i, features)
+
+        if filetype == 'array':
+            return data
+
+        columns = self.features if features is None else list(features)
+        return pd.DataFrame(data, columns = columns, index = self.times)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+基于站点数据立方体(StationCubeStore)的流式mini-batch训练样本生成器
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    default_train_features()  默认的X特征: 除target和T-0时刻地面观测以外的所有特征
+    StationBatchGenerator     从T0/T-gap store中流式读取数据，生成打乱后的 (X, y) float32 mini-batch
+
+原来训练模型时需要把所有 T-gap-time.csv 文件拼接成一个很大的pd.DataFrame，多年的数据无法全部放入内存。
+这里按时间块(time block, 默认连续24个时刻)组织数据:
+    1. 每个epoch先将所有时间块的顺序打乱;
+    2. 每次只读取 blocks_in_memory 个时间块到内存(buffer)，去掉target为nan的样本后，在buffer内打乱样本顺序;
+    3. 按batch_size输出 (X, y)，不足一个batch的剩余样本留到下一个buffer;
+内存占用约为 blocks_in_memory * time_block * n_station * n_feature * 4 字节，与数据的总时长无关。
+读取时间块时，每次只读取一个HDF5分块高度(chunk_time个时刻)、所用站点范围内的数据，读取后立即选取需要的特征，
+因此读取时的临时数组只有 chunk_time * 站点范围 * store中的特征数，不需要一次读入整个时间块的所有特征。
+时间块内的样本是相邻时刻的，因此先打乱时间块、再在多个时间块组成的buffer内打乱，样本之间的相关性较小。
+'''
+#%%
+
+import numpy as np
+
+from Station_store import StationCubeStore
+from Lag_features import time_to_hour
+
+
+def default_train_features(columns, target = '0_T-0_surface_r1-p'):
+    '''
+    func: 获取默认的X特征: 去掉target，以及T-0时刻的地面观测特征(训练时T-0时刻的观测是未知的)
+    inputs:
+        columns: store中的所有特征名(store.features)
+        target: y对应的特征名，默认T-0时刻的站点小时降水
+    return:
+        list
+    '''
+    return [c for c in columns if c != target and '_T-0_surface' not in c]
+
+
+class StationBatchGenerator():
+    '''
+    func: 流式mini-batch训练样本生成器。每次迭代为一个epoch，依次输出打乱后的 (X, y)
+    Parameter
+    ----------------------------
+    store: StationCubeStore
+        T0 或 T-gap 数据集所在的store, eg: write_lag_datasets 输出的 T-12.h5
+    target: str
+        y对应的特征名，默认'0_T-0_surface_r1-p'，即T-0时刻的站点小时降水
+    features: list or None
+        X的特征名，默认None，即 default_train_features(store.features, target)
+        可以包括'lon','lat','height'，从store的站点信息中获取
+    batch_size: int
+        每个batch的样本数，默认4096
+    time_block: int
+        每个时间块包含的(按时间排序后)连续时刻数，默认24
+    blocks_in_memory: int
+        每次读入内存的时间块个数，默认8
+    shuffle: bool
+        是否打乱时间块和样本，默认True
+    drop_nan_target: bool
+        是否去掉target为nan(无观测)的样本，默认True
+    drop_nan_features: bool
+        是否去掉X中含有nan的样本，默认False
+    times: list or None
+        使用的时刻，默认None，即store中的所有时刻; eg: 用于划分训练集/验证集
+    station_index: list or None
+        使用的站点在store中的index，默认None，即所有站点
+    drop_last: bool
+        是否丢弃每个epoch最后不足batch_size的样本，默认False
+    seed: int or None
+        随机种子
+
+    用法:
+        store = StationCubeStore('T-12.h5', mode = 'r')
+        generator = StationBatchGenerator(store, batch_size = 4096, seed = 0)
+        for epoch in range(10):
+            for X, y in generator:
+                model.partial_fit(X, y)
+    '''
+    def __init__(self, store, target = '0_T-0_surface_r1-p', features = None,
+                 batch_size = 4096, time_block = 24, blocks_in_memory = 8,
+                 shuffle = True, drop_nan_target = True, drop_nan_features = False,
+                 times = None, station_index = None, drop_last = False, seed = None):
+
+        self.store = store
+        self.target = target
+        self.batch_size = int(batch_size)
+        self.time_block = int(time_block)
+        self.blocks_in_memory = int(blocks_in_memory)
+        self.shuffle = shuffle
+        self.drop_nan_target = drop_nan_target
+        self.drop_nan_features = drop_nan_features
+        self.drop_last = drop_last
+        self.rng = np.random.RandomState(seed)
+
+        store_features = store.features
+        if target not in store_features:
+            raise ValueError('target {} is not in {}'.format(target, store.store_file))
+
+        self.features = default_train_features(store_features, target) if features is None else list(features)
+
+        #X的特征分为两部分: store中的特征 和 站点信息(lon/lat/height)
+        station_features = [f for f in self.features if f in StationCubeStore.fix_features]
+        if 'station_num' in station_features:
+            raise ValueError('station_num can not be used as a train feature')
+        for f in self.features:
+            if f not in store_features and f not in station_features:
+                raise ValueError('feature {} is not in {}'.format(f, store.store_file))
+
+        #只读取用到的特征列: [target, X中的store特征]
+        cube_features = [f for f in self.features if f not in station_features]
+        self.read_index = np.array([store_features.index(f) for f in [target] + cube_features])
+
+        #X中每一列在 [读取的特征, 站点信息] 拼接后的位置
+        n_cube = len(cube_features)
+        self.x_index = np.array([1 + cube_features.index(f) if f in cube_features
+                                 else 1 + n_cube + station_features.index(f) for f in self.features])
+
+        self.station_index = np.arange(store.shape[1]) if station_index is None else np.sort(np.asarray(station_index))
+
+        #按站点范围(slice)读取，不连续的站点读取后再在内存中选取
+        self.station_slice = slice(int(self.station_index[0]), int(self.station_index[-1]) + 1)
+        if len(self.station_index) == self.station_slice.stop - self.station_slice.start:
+            self.station_offset = None
+        else:
+            self.station_offset = self.station_index - self.station_index[0]
+
+        #每次读取的时刻数: 与/data的分块高度一致，每次读取只解压一层分块
+        self.read_rows = max(1, min(self.time_block, store.f['data'].chunks[0]))
+        self.n_store_features = store.shape[2]
+
+        info = store.station_info()
+        self.station_values = info[station_features].values[self.station_index].astype(np.float32)
+
+        #按时间排序后，每time_block个时刻为一个时间块，块内为store中/data第0维的index
+        times = store.times if times is None else [str(t) for t in times]
+        times = sorted(times, key = time_to_hour)
+        time_index = np.array([store.time_index[t] for t in times], dtype = np.int64)
+        self.blocks = [time_index[i:i + self.time_block] for i in range(0, len(time_index), self.time_block)]
+
+    @property
+    def n_features(self):
+        return len(self.features)
+
+    def memory_bytes(self):
+        '''
+        func: 估计一个buffer的最大内存占用(字节)，包括读取时的临时数组(read_rows个时刻、站点范围内的所有特征)
+        '''
+        n_sample = self.blocks_in_memory * self.time_block * len(self.station_index)
+        n_span = self.station_slice.stop - self.station_slice.start
+        read_buffer = self.read_rows * n_span * self.n_store_features * 4
+        return n_sample * (len(self.read_index) + self.station_values.shape[1] + self.n_features + 1) * 4 + read_buffer
+
+    def read_block(self, block):
+        '''
+        func: 读取一个时间块，并转换为样本
+        inputs:
+            block: 时间块中各时刻在/data第0维的index
+        return:
+            samples: np.array, float32, shape = (n_sample, 1 + n_feature)，第0列为target，其余为X
+        '''
+        block = np.sort(block)
+
+        #shape = (n_time, n_station_use, n_read)
+        data = np.empty((len(block), len(self.station_index), len(self.read_index)), dtype = np.float32)
+        for start in range(0, len(block), self.read_rows):
+            rows = block[start:start + self.read_rows]
+
+            #连续的index使用slice读取，h5py读取更快
+            if rows[-1] - rows[0] + 1 == len(rows):
+                chunk = self.store.read_cube(slice(int(rows[0]), int(rows[-1]) + 1), self.station_slice)
+            else:
+                chunk = self.store.read_cube(list(rows), self.station_slice)
+
+            #读取后立即选取站点和特征，释放整个分块宽度的临时数组
+            if self.station_offset is not None:
+                chunk = chunk[:, self.station_offset]
+            data[start:start + len(rows)] = chunk[..., self.read_index]
+            del chunk
+
+        n_time, n_station = data.shape[:2]
+        station_values = np.broadcast_to(self.station_values[None], (n_time,) + self.station_values.shape)
+        data = np.concatenate([data, station_values], axis = -1).reshape(n_time*n_station, -1)
+
+        samples = np.empty((len(data), 1 + self.n_features), dtype = np.float32)
+        samples[:, 0] = data[:, 0]
+        samples[:, 1:] = data[:, self.x_index]
+
+        valid = np.ones(len(samples), dtype = bool)
+        if self.drop_nan_target:
+            valid &= ~np.isnan(samples[:, 0])
+        if self.drop_nan_features:
+            valid &= ~np.isnan(samples[:, 1:]).any(axis = 1)
+
+        return samples[valid]
+
+    def __iter__(self):
+
+        order = self.rng.permutation(len(self.blocks)) if self.shuffle else np.arange(len(self.blocks))
+
+        rest = np.zeros((0, 1 + self.n_features), dtype = np.float32)
+        for start in range(0, len(order), self.blocks_in_memory):
+
+            buffer = [rest] + [self.read_block(self.blocks[i]) for i in order[start:start + self.blocks_in_memory]]
+            buffer = np.concatenate(buffer, axis = 0)
+            if self.shuffle:
+                buffer = buffer[self.rng.permutation(len(buffer))]
+
+            n_batch = len(buffer) // self.batch_size
+            for i in range(n_batch):
+                batch = buffer[i*self.batch_size:(i + 1)*self.batch_size]
+                yield np.ascontiguousarray(batch[:, 1:]), np.ascontiguousarray(batch[:, 0])
+
+            #拷贝剩余样本，释放整个buffer
+            rest = buffer[n_batch*self.batch_size:].copy()
+
+        if len(rest) > 0 and not self.drop_last:
+            yield np.ascontiguousarray(rest[:, 1:]), np.ascontiguousarray(rest[:, 0])
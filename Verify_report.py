@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+批量检验报告: 一次计算所有分组(个例/预报时效/模式)的评分，多进程后台(Agg)绘图，并生成索引页面
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    compute_report_scores()  一次计算多个模式在所有分组(eg: 个例 × 预报时效)下各阈值的混淆矩阵和评分
+    aggregate_scores()       将分组结果按更粗的分组(eg: 只按模式)合并: 混淆矩阵相加后重新计算评分
+    render_group_figure()    画一个分组的评分图(各模式的 TS/ETS/BIAS 随阈值的变化)，保存为.png
+    write_report()           多进程并行画出所有分组的评分图，保存评分表(.csv)并生成索引页面(index.html)
+
+plot_multi_scores() 每次画一张交互式的图并plt.show()，无法无人值守地生成整个季节的检验报告。
+这里所有绘图都在子进程中使用Agg后端完成，不弹出窗口，各分组的图并行绘制。
+
+用法:
+    #obs, EC_pre, SMS_pre, cor_pre.shape = (time, station); case.shape = (time, 1), lead.shape = (time, 1)
+    scores = compute_report_scores(obs, {'EC': EC_pre, 'SMS': SMS_pre, 'correct': cor_pre},
+                                   {'case': case, 'lead': lead}, thresholds = [0.1, 5, 10, 20])
+    write_report(scores, 'D:/zhongqi/report/2019', group_cols = ['case', 'lead'])
+'''
+#%%
+
+import os
+import html
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from All_utils_funs import clf_scores
+from Verify_utils import grouped_scores
+from Lazy_import import set_chinese_font
+import Perf_utils as perf
+
+
+def compute_report_scores(obs, pre_dict, keys, thresholds = [0.1, 5,10,15,20,25,30,35,40]):
+    '''
+    func: 计算多个模式在所有分组下各阈值的混淆矩阵和评分。每个模式只遍历一次数据(grouped_scores)
+    inputs:
+        obs: 观测值, eg: shape = (time, station)
+        pre_dict: {模式名: 预报值}, 预报值与obs的shape一致, eg: {'EC': EC_pre, 'SMS': SMS_pre}
+        keys: {键名: 分组键}, 分组键可以广播到obs的shape, eg: {'case': case[:, None], 'lead': lead[:, None]}
+        thresholds: 阈值列表
+    return:
+        pd.DataFrame, columns为 ['model', 各分组键, 'threshold', 'hits', ..., 'BIAS']
+    '''
+    all_scores = []
+    for model, pre in pre_dict.items():
+        scores = grouped_scores(obs, pre, keys, thresholds)
+        scores.insert(0, 'model', model)
+        all_scores.append(scores)
+
+    all_scores = pd.concat(all_scores, axis = 0)
+    all_scores.index = range(len(all_scores))
+
+    return all_scores
+
+
+def aggregate_scores(scores, by = ['model']):
+    '''
+    func: 将分组评分按更粗的分组合并(混淆矩阵相加后重新计算评分，而不是对评分求平均)
+    inputs:
+        scores: compute_report_scores() 的输出
+        by: 合并后保留的分组键，默认['model']，'threshold'总是保留
+    return:
+        pd.DataFrame, 格式与scores一致
+    '''
+    by = list(by) + ['threshold']
+    counts = scores.groupby(by, sort = False)[['hits', 'misses', 'falsealarms', 'correctnegatives']].sum().reset_index()
+
+    for name, score in clf_scores(counts['hits'].values, counts['misses'].values,
+                                  counts['falsealarms'].values, counts['correctnegatives'].values).items():
+        counts[name] = score
+
+    return counts
+
+
+def _init_worker():
+    '''
+    func: 子进程初始化: 使用Agg后端(不需要显示器)，并设置中文字体
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    set_chinese_font()
+
+
+def render_group_figure(scores, title, save_file, panels = ['TS', 'ETS', 'BIAS']):
+    '''
+    func: 画一个分组的评分图，每个子图为一个评分，每条线为一个模式
+    inputs:
+        scores: 该分组的评分(compute_report_scores() 输出中的一部分), 需要包括'model','threshold'列
+        title: 图片的title
+        save_file: 保存的文件路径 + 文件名(.png)
+        panels: 子图对应的评分
+    return:
+        save_file
+    '''
+    import matplotlib
+    if matplotlib.get_backend().lower() != 'agg':
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, len(panels), figsize = (6*len(panels), 5))
+    axes = np.atleast_1d(axes)
+
+    for ax, score in zip(axes, panels):
+        for model, data in scores.groupby('model', sort = False):
+            data = data.sort_values('threshold')
+            ax.plot(data['threshold'].values, data[score].values, linewidth = 2, marker = 'o', label = str(model))
+
+        if score == 'BIAS':
+            ax.axhline(1, color = 'gray', linewidth = 1, linestyle = '--')
+        else:
+            ax.set_ylim([0,1])
+
+        ax.set_title(score, fontsize = 16)
+        ax.set_xlabel('Thresholds', fontsize = 14)
+        ax.legend(fontsize = 10)
+
+    fig.suptitle(title, fontsize = 18)
+    fig.tight_layout()
+    fig.savefig(save_file, dpi = 100)
+    plt.close(fig)
+
+    return save_file
+
+
+def _render_task(task):
+    return render_group_figure(*task)
+
+
+@perf.timed()
+def write_report(scores, save_path, group_cols = ['case', 'lead'], panels = ['TS', 'ETS', 'BIAS'],
+                 processes = None, title = '降水检验报告'):
+    '''
+    func: 生成检验报告:
+          1. 保存所有分组的评分表 save_path/scores.csv;
+          2. 多进程并行画出 所有样本的总体评分图 + 每个分组的评分图 save_path/figures/*.png;
+          3. 生成索引页面 save_path/index.html，包括总体评分表和所有图片
+    inputs:
+        scores: compute_report_scores() 的输出
+        save_path: 报告保存路径
+        group_cols: 每张图对应的分组键，默认['case','lead']，每个(个例, 预报时效)画一张图
+        panels: 每张图中的评分
+        processes: 绘图进程数，默认None，即cpu个数
+        title: 报告标题
+    return:
+        index.html 的路径
+    '''
+    figure_path = os.path.join(save_path, 'figures')
+    if not os.path.exists(figure_path):
+        os.makedirs(figure_path)
+
+    scores.to_csv(os.path.join(save_path, 'scores.csv'), index = False)
+
+    #总体评分: 所有分组的混淆矩阵相加
+    overall = aggregate_scores(scores, by = ['model'])
+    overall.to_csv(os.path.join(save_path, 'scores_overall.csv'), index = False)
+
+    tasks = [(overall, 'all samples', os.path.join(figure_path, 'all.png'), panels)]
+    names = ['all samples']
+    for group, data in scores.groupby(group_cols, sort = True):
+        group = group if isinstance(group, tuple) else (group,)
+        name = ', '.join('{} = {}'.format(col, value) for col, value in zip(group_cols, group))
+        file_name = '_'.join('{}-{}'.format(col, value) for col, value in zip(group_cols, group)) + '.png'
+        file_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in file_name)
+
+        tasks.append((data, name, os.path.join(figure_path, file_name), panels))
+        names.append(name)
+
+    with ProcessPoolExecutor(max_workers = processes, initializer = _init_worker) as executor:
+        files = list(executor.map(_render_task, tasks, chunksize = max(1, len(tasks) // 64)))
+
+    #索引页面
+    lines = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8">',
+             '<title>{}</title>'.format(html.escape(title)),
+             '<style>body{font-family:sans-serif} table{border-collapse:collapse} '
+             'td,th{border:1px solid #ccc;padding:2px 6px} img{max-width:100%}</style>',
+             '</head><body>',
+             '<h1>{}</h1>'.format(html.escape(title)),
+             '<p>{} groups, generated at {}. <a href="scores.csv">scores.csv</a> '
+             '<a href="scores_overall.csv">scores_overall.csv</a></p>'.format(
+                 len(tasks) - 1, time.strftime('%Y-%m-%d %H:%M:%S')),
+             '<h2>all samples</h2>',
+             overall[['model', 'threshold', 'hits', 'misses', 'falsealarms', 'correctnegatives'] + list(panels)
+                     ].to_html(index = False, float_format = lambda x: '{:.3f}'.format(x)),
+             '<h2>contents</h2><ul>']
+    for i, name in enumerate(names):
+        lines.append('<li><a href="#fig{}">{}</a></li>'.format(i, html.escape(name)))
+    lines.append('</ul>')
+    for i, (name, file) in enumerate(zip(names, files)):
+        lines.append('<h3 id="fig{}">{}</h3>'.format(i, html.escape(name)))
+        lines.append('<img src="figures/{}" loading="lazy">'.format(html.escape(os.path.basename(file))))
+    lines.append('</body></html>')
+
+    index_file = os.path.join(save_path, 'index.html')
+    with open(index_file, 'w', encoding = 'utf-8') as f:
+        f.write('\n'.join(lines))
+
+    perf.count('figures_rendered', len(files))
+
+    return index_file
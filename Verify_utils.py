@@ -0,0 +1,941 @@
+# -*- coding: utf-8 -*-
+"""
+2026.10.19
+大规模检验(verification)工具: 可合并的流式评分累加器
+@author: fzl
+"""
+#%%
+'''
+函数介绍:
+    VerifyAccumulator     流式评分累加器。逐批(eg: 逐个时刻文件)输入obs和pre，累加多个阈值下的混淆矩阵，
+                          以及计算 平均误差(bias)/MAE/RMSE/相关系数 需要的统计量; 内存占用与数据量无关
+    merge_accumulators()  合并多个并行进程得到的累加器
+    grouped_clf()         分组检验: 按站点/区域/小时/预报时效等整数分组键，一次向量化计算每组、每个阈值的混淆矩阵
+    grouped_scores()      分组检验，返回每组、每个阈值的混淆矩阵和所有评分(tidy格式的pd.DataFrame)
+    bootstrap_scores()    由每个数据块(eg: 每天)的混淆矩阵做向量化的块bootstrap，得到TS/ETS等评分的置信区间,
+                          以及两个预报(eg: 订正后 vs EC原始)评分之差的配对置信区间
+    bootstrap_ci()        直接输入obs/pre/分块键的 bootstrap_scores()
+    summed_area_table()   二值场的积分图(summed-area table)
+    neighborhood_fraction()  由积分图得到任意窗口大小的邻域事件比例，每个格点O(1)
+    fss_matrix()          格点场的FSS(Fractions Skill Score)邻域检验，一次得到 窗口大小 × 阈值 的FSS矩阵
+    StationNeighbors      由站点经纬度预先计算每个站点的邻近站点(半径r以内 或 最近的k个)，保存为稀疏index数组
+    neighborhood_clf()    站点邻域检验: 预报有降水时，只要邻域内任一站点观测到降水即为命中
+    neighborhood_scores() 站点邻域检验的混淆矩阵和所有评分
+    label_objects()       格点降水场中 >= 阈值的连通区域(降水对象)标记
+    object_attributes()   向量化计算每个降水对象的属性: 面积、质心、平均/最大强度、强度分位数
+    match_objects()       按质心距离将预报对象与观测对象一一匹配(匈牙利算法)，得到位移、面积比、强度比
+    object_verify()       基于对象的检验: 标记 + 属性 + 匹配，一次调用完成一个时刻
+
+与 All_utils_funs 中 Part6 的评分函数的区别:
+    Part6的评分函数需要一次传入全部的obs和pre; 检验一整个季节(4343个站点 × 8760小时 × 多个模式)时，
+    需要先把所有数据拼接起来。累加器每次只需要一批数据，多个进程的累加器可以直接相加(merge)，结果与一次性计算相同。
+
+缺测的处理:
+    只有obs和pre都不为nan的样本才参与检验(混淆矩阵和连续评分都是如此)。
+'''
+#%%
+
+import numpy as np
+import pandas as pd
+from Lazy_import import LazyModule, LazyAttr
+#scipy的子模块在第一次使用时才导入(只做评分的子进程不需要导入)
+cKDTree = LazyAttr('scipy.spatial', 'cKDTree')
+ndimage = LazyModule('scipy.ndimage')
+linear_sum_assignment = LazyAttr('scipy.optimize', 'linear_sum_assignment')
+
+from All_utils_funs import multi_threshold_clf, clf_scores
+from Station_catalog import StationCatalog
+import Perf_utils as perf
+
+
+class VerifyAccumulator():
+    '''
+    func: 可合并的流式评分累加器
+    Parameter
+    ----------------------------
+    thresholds: list
+        分类评分的阈值，默认[0.1, 5,10,15,20,25,30,35,40]
+
+    连续评分的统计量(按Chan等的并行算法合并，避免大样本下直接累加平方和带来的精度损失):
+        n                    样本数
+        mean_obs, mean_pre   平均值
+        m2_obs, m2_pre       离差平方和 sum((x - mean)^2)
+        c_op                 协方差和 sum((obs - mean_obs)*(pre - mean_pre))
+        sum_abs, sum_sq      sum(|pre - obs|), sum((pre - obs)^2)
+
+    用法:
+        acc = VerifyAccumulator(thresholds = [0.1, 5, 10, 20])
+        for file in files:
+            obs, pre = ...  #某个时刻的观测和预报
+            acc.update(obs, pre)
+        acc.scores()             #各阈值的混淆矩阵和分类评分，pd.DataFrame
+        acc.continuous_scores()  #{'n','bias','MAE','RMSE','corr'}
+
+        #多进程: 每个进程得到一个累加器，最后合并
+        acc = merge_accumulators([acc1, acc2, acc3])
+    '''
+    def __init__(self, thresholds = [0.1, 5,10,15,20,25,30,35,40]):
+
+        self.thresholds = np.atleast_1d(np.asarray(thresholds, dtype = np.float64))
+
+        n_threshold = len(self.thresholds)
+        self.hits = np.zeros(n_threshold, dtype = np.int64)
+        self.misses = np.zeros(n_threshold, dtype = np.int64)
+        self.falsealarms = np.zeros(n_threshold, dtype = np.int64)
+        self.correctnegatives = np.zeros(n_threshold, dtype = np.int64)
+
+        self.n = 0
+        self.mean_obs = 0.0
+        self.mean_pre = 0.0
+        self.m2_obs = 0.0
+        self.m2_pre = 0.0
+        self.c_op = 0.0
+        self.sum_abs = 0.0
+        self.sum_sq = 0.0
+
+    def __repr__(self):
+        return 'VerifyAccumulator(n = {}, thresholds = {})'.format(self.n, list(self.thresholds))
+
+    def _merge_moments(self, n, mean_obs, mean_pre, m2_obs, m2_pre, c_op):
+        '''
+        func: 将另一组样本的统计量合并到self
+        '''
+        if n == 0:
+            return None
+
+        total = self.n + n
+        d_obs = mean_obs - self.mean_obs
+        d_pre = mean_pre - self.mean_pre
+        w = self.n * n / total
+
+        self.m2_obs += m2_obs + d_obs * d_obs * w
+        self.m2_pre += m2_pre + d_pre * d_pre * w
+        self.c_op += c_op + d_obs * d_pre * w
+        self.mean_obs += d_obs * n / total
+        self.mean_pre += d_pre * n / total
+        self.n = total
+
+        return None
+
+    def update(self, obs, pre):
+        '''
+        func: 输入一批数据
+        inputs:
+            obs: 观测值，任意shape的数组
+            pre: 预测值，与obs的shape一致
+        '''
+        obs = np.asarray(obs, dtype = np.float64).ravel()
+        pre = np.asarray(pre, dtype = np.float64).ravel()
+        if obs.shape != pre.shape:
+            raise ValueError('obs size {} is not equal with pre size {}'.format(obs.size, pre.size))
+
+        valid = ~(np.isnan(obs) | np.isnan(pre))
+        if not np.all(valid):
+            obs = obs[valid]
+            pre = pre[valid]
+        if obs.size == 0:
+            return self
+
+        hits, misses, falsealarms, correctnegatives = multi_threshold_clf(obs, pre, self.thresholds)
+        self.hits += hits
+        self.misses += misses
+        self.falsealarms += falsealarms
+        self.correctnegatives += correctnegatives
+
+        diff = pre - obs
+        self.sum_abs += np.sum(np.abs(diff))
+        self.sum_sq += np.sum(diff * diff)
+
+        mean_obs = obs.mean()
+        mean_pre = pre.mean()
+        d_obs = obs - mean_obs
+        d_pre = pre - mean_pre
+        self._merge_moments(obs.size, mean_obs, mean_pre,
+                            np.sum(d_obs * d_obs), np.sum(d_pre * d_pre), np.sum(d_obs * d_pre))
+
+        return self
+
+    def merge(self, other):
+        '''
+        func: 将另一个累加器合并到self(两者的阈值必须一致)
+        '''
+        if not np.array_equal(self.thresholds, other.thresholds):
+            raise ValueError('can not merge accumulators with different thresholds: {} and {}'.format(
+                list(self.thresholds), list(other.thresholds)))
+
+        self.hits += other.hits
+        self.misses += other.misses
+        self.falsealarms += other.falsealarms
+        self.correctnegatives += other.correctnegatives
+        self.sum_abs += other.sum_abs
+        self.sum_sq += other.sum_sq
+        self._merge_moments(other.n, other.mean_obs, other.mean_pre, other.m2_obs, other.m2_pre, other.c_op)
+
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def copy(self):
+        new = VerifyAccumulator(self.thresholds)
+        new.merge(self)
+        return new
+
+    def scores(self):
+        '''
+        func: 各阈值下的混淆矩阵和分类评分
+        return:
+            pd.DataFrame, 与 All_utils_funs.multi_threshold_scores() 的格式一致
+        '''
+        scores = pd.DataFrame({'hits': self.hits, 'misses': self.misses,
+                               'falsealarms': self.falsealarms, 'correctnegatives': self.correctnegatives},
+                              index = pd.Index(self.thresholds, name = 'threshold'))
+        for name, score in clf_scores(self.hits, self.misses, self.falsealarms, self.correctnegatives).items():
+            scores[name] = score
+
+        return scores
+
+    def continuous_scores(self):
+        '''
+        func: 连续评分
+        return:
+            dict: n 样本数; bias 平均误差 mean(pre - obs); MAE 平均绝对误差; RMSE 均方根误差; corr 相关系数
+        '''
+        if self.n == 0:
+            return {'n': 0, 'bias': np.nan, 'MAE': np.nan, 'RMSE': np.nan, 'corr': np.nan}
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            corr = self.c_op / np.sqrt(self.m2_obs * self.m2_pre)
+
+        return {'n': self.n,
+                'bias': float(self.mean_pre - self.mean_obs),
+                'MAE': float(self.sum_abs / self.n),
+                'RMSE': float(np.sqrt(self.sum_sq / self.n)),
+                'corr': float(corr)}
+
+    def to_dict(self):
+        '''
+        func: 转为可以json序列化的dict, 便于多机时保存/传输部分结果
+        '''
+        state = {name: getattr(self, name).tolist() for name in
+                 ['thresholds', 'hits', 'misses', 'falsealarms', 'correctnegatives']}
+        for name in ['n', 'mean_obs', 'mean_pre', 'm2_obs', 'm2_pre', 'c_op', 'sum_abs', 'sum_sq']:
+            state[name] = getattr(self, name)
+            state[name] = int(state[name]) if name == 'n' else float(state[name])
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        acc = cls(state['thresholds'])
+        for name in ['hits', 'misses', 'falsealarms', 'correctnegatives']:
+            setattr(acc, name, np.asarray(state[name], dtype = np.int64))
+        for name in ['n', 'mean_obs', 'mean_pre', 'm2_obs', 'm2_pre', 'c_op', 'sum_abs', 'sum_sq']:
+            setattr(acc, name, state[name])
+        return acc
+
+
+def merge_accumulators(accumulators):
+    '''
+    func: 合并多个累加器(eg: 多个进程分别检验不同时段得到的累加器)
+    inputs:
+        accumulators: VerifyAccumulator 列表
+    return:
+        VerifyAccumulator
+    '''
+    accumulators = list(accumulators)
+    merged = VerifyAccumulator(accumulators[0].thresholds)
+    for acc in accumulators:
+        merged.merge(acc)
+
+    return merged
+
+
+def _encode_keys(keys, shape):
+    '''
+    func: 将多个分组键编码为一个整数分组号
+    inputs:
+        keys: {键名: 整数数组}，每个数组可以广播到shape, eg: obs.shape = (time, station)时，
+              站点键可以是 shape = (station,)，小时键可以是 shape = (time, 1)
+        shape: obs的shape
+    return:
+        group: np.array, shape = (prod(shape),), 每个样本的分组号
+        levels: {键名: 该键所有取值(升序)}, 分组号 = np.ravel_multi_index(各键取值的位置, 各键取值个数)
+    '''
+    positions = []
+    levels = {}
+    for name, key in keys.items():
+        key = np.broadcast_to(np.asarray(key), shape).ravel()
+        levels[name], position = np.unique(key, return_inverse = True)
+        positions.append(position.ravel())
+
+    dims = tuple(len(level) for level in levels.values())
+    group = np.ravel_multi_index(positions, dims)
+
+    return group, levels
+
+
+def grouped_clf(obs, pre, keys, thresholds = [0.1, 5,10,15,20,25,30,35,40], chunk_size = 1000000):
+    '''
+    func: 分组检验。一次遍历所有样本，得到每个分组、每个阈值的混淆矩阵，不需要在python中循环每个分组。
+          每个样本在每个阈值下属于混淆矩阵四类中的一类(code = 2*obs_yes + pre_yes)，
+          将 (分组号, 阈值, code) 合并为一个整数后，用一次 np.bincount 完成计数
+    inputs:
+        obs: 观测值，任意shape的数组, eg: (time, station)
+        pre: 预测值，与obs的shape一致
+        keys: 分组键, 整数(或可排序的)数组，可以广播到obs的shape;
+              单个数组，或 {键名: 数组}, eg: {'station': station_index, 'hour': hour[:, None]}
+        thresholds: 阈值列表
+        chunk_size: 每次处理的样本数，控制内存，默认1000000
+    return:
+        counts: np.array, int64, shape = (n_group, n_threshold, 4), 最后一维为 hits, misses, falsealarms, correctnegatives
+        levels: {键名: 该键所有取值}, counts第0维为各键取值的组合(按np.ravel_multi_index的顺序)
+        只有obs和pre都不为nan的样本参与计数
+    '''
+    obs = np.asarray(obs, dtype = np.float64)
+    pre = np.asarray(pre, dtype = np.float64)
+    if obs.shape != pre.shape:
+        raise ValueError('obs shape {} is not equal with pre shape {}'.format(obs.shape, pre.shape))
+    if not isinstance(keys, dict):
+        keys = {'group': keys}
+
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype = np.float64))
+    n_threshold = len(thresholds)
+
+    group, levels = _encode_keys(keys, obs.shape)
+    n_group = int(np.prod([len(level) for level in levels.values()]))
+
+    obs = obs.ravel()
+    pre = pre.ravel()
+
+    #code: 3 hits, 2 misses, 1 falsealarms, 0 correctnegatives
+    counts = np.zeros(n_group * n_threshold * 4, dtype = np.int64)
+    threshold_offset = np.arange(n_threshold) * 4
+
+    for start in range(0, obs.size, chunk_size):
+        o = obs[start:start + chunk_size]
+        p = pre[start:start + chunk_size]
+        g = group[start:start + chunk_size]
+
+        valid = ~(np.isnan(o) | np.isnan(p))
+        o, p, g = o[valid], p[valid], g[valid]
+
+        #shape = (n_sample, n_threshold)
+        code = 2 * (o[:, None] >= thresholds[None, :]) + (p[:, None] >= thresholds[None, :])
+        index = (g * (n_threshold * 4))[:, None] + threshold_offset[None, :] + code
+
+        counts += np.bincount(index.ravel(), minlength = counts.size)
+
+    counts = counts.reshape(n_group, n_threshold, 4)[..., ::-1]
+
+    return np.ascontiguousarray(counts), levels
+
+
+@perf.timed()
+def grouped_scores(obs, pre, keys, thresholds = [0.1, 5,10,15,20,25,30,35,40], drop_empty = True):
+    '''
+    func: 分组检验，返回tidy格式的结果
+    inputs:
+        obs, pre, keys, thresholds: 见 grouped_clf()
+        drop_empty: 是否去掉没有样本的分组，默认True
+    return:
+        pd.DataFrame, 每行为一个分组的一个阈值,
+        columns为 [各分组键, 'threshold', 'hits','misses','falsealarms','correctnegatives',
+                   'Acc','Recall','Precision','F1','TS','MAR','FAR','ETS','HSS','BIAS']
+
+    用法:
+        #obs, pre.shape = (time, station)
+        scores = grouped_scores(obs, pre, {'station': station_num, 'hour': hour_of_day[:, None]}, [0.1, 10])
+        scores[scores['threshold'] == 10].pivot(index = 'station', columns = 'hour', values = 'TS')
+    '''
+    if not isinstance(keys, dict):
+        keys = {'group': keys}
+
+    counts, levels = grouped_clf(obs, pre, keys, thresholds)
+    n_group, n_threshold = counts.shape[:2]
+
+    #每个分组号对应的各键取值
+    dims = tuple(len(level) for level in levels.values())
+    positions = np.unravel_index(np.arange(n_group), dims)
+
+    scores = {}
+    for (name, level), position in zip(levels.items(), positions):
+        scores[name] = np.repeat(level[position], n_threshold)
+    scores['threshold'] = np.tile(np.atleast_1d(np.asarray(thresholds, dtype = np.float64)), n_group)
+
+    counts = counts.reshape(-1, 4)
+    for i, name in enumerate(['hits', 'misses', 'falsealarms', 'correctnegatives']):
+        scores[name] = counts[:, i]
+    scores.update(clf_scores(counts[:, 0], counts[:, 1], counts[:, 2], counts[:, 3]))
+
+    scores = pd.DataFrame(scores)
+    if drop_empty:
+        scores = scores[counts.sum(axis = 1) > 0]
+        scores.index = range(len(scores))
+
+    return scores
+
+
+def bootstrap_scores(counts, counts_b = None, thresholds = None, scores = ['TS', 'ETS'],
+                     n_boot = 10000, method = 'multinomial', alpha = 0.05,
+                     seed = None, chunk_size = 1000):
+    '''
+    func: 块bootstrap置信区间。每次重采样不需要重新计算prep_clf，
+          只需对每个数据块的混淆矩阵加权求和: 重采样后的混淆矩阵 = 权重(n_boot, n_block) @ 块混淆矩阵(n_block, ...)，
+          所有重采样一次矩阵乘法完成，计算量与样本数无关，只与块数有关
+    inputs:
+        counts: np.array, shape = (n_block, n_threshold, 4), 每个数据块的混淆矩阵, 见 grouped_clf()
+                数据块一般取一天或若干天，保留块内样本(相邻时刻、相邻站点)的相关性
+        counts_b: 与counts相同数据块的另一个预报的混淆矩阵，默认None;
+                  给定时同时计算配对差 score(counts) - score(counts_b) 的置信区间(两个预报使用相同的重采样权重)
+        thresholds: 阈值列表，仅用于输出，默认None，即 0,1,2...
+        scores: 需要计算置信区间的评分，clf_scores()中的名称，默认['TS','ETS']
+        n_boot: 重采样次数，默认10000
+        method: 'multinomial'(默认): 每次有放回地抽取n_block个块，即权重 ~ Multinomial(n_block, 1/n_block);
+                'poisson': 每个块的权重 ~ Poisson(1)，各块独立，适合块数很多或分布式计算的情况
+        alpha: 置信区间为 [alpha/2, 1 - alpha/2] 分位数，默认0.05，即95%置信区间
+        seed: 随机种子
+        chunk_size: 每次计算的重采样次数，控制内存
+    return:
+        pd.DataFrame, 每行为一个(预报, 阈值, 评分)，columns为
+            ['forecast','threshold','score','value','lower','upper','std']
+            forecast: 'a' (counts), 'b' (counts_b), 'a-b' (配对差)
+            value为全部样本的评分，lower/upper为置信区间，std为bootstrap标准差
+    '''
+    counts = np.asarray(counts, dtype = np.float64)
+    n_block, n_threshold = counts.shape[:2]
+    if counts_b is not None:
+        counts_b = np.asarray(counts_b, dtype = np.float64)
+        if counts_b.shape != counts.shape:
+            raise ValueError('counts_b shape {} is not equal with counts shape {}'.format(counts_b.shape, counts.shape))
+    if method not in ['multinomial', 'poisson']:
+        raise ValueError("method must be 'multinomial' or 'poisson', got {}".format(method))
+    if thresholds is None:
+        thresholds = np.arange(n_threshold)
+
+    rng = np.random.RandomState(seed)
+
+    forecasts = {'a': counts.reshape(n_block, -1)}
+    if counts_b is not None:
+        forecasts['b'] = counts_b.reshape(n_block, -1)
+
+    def get_scores(flat):
+        #flat.shape = (..., n_threshold*4) --> {评分: (..., n_threshold)}
+        flat = flat.reshape(flat.shape[:-1] + (n_threshold, 4))
+        all_scores = clf_scores(flat[..., 0], flat[..., 1], flat[..., 2], flat[..., 3])
+        return {name: all_scores[name] for name in scores}
+
+    #重采样的评分, {预报: {评分: (n_boot, n_threshold)}}
+    boot = {name: {score: [] for score in scores} for name in forecasts}
+    for start in range(0, n_boot, chunk_size):
+        size = min(chunk_size, n_boot - start)
+        if method == 'multinomial':
+            weights = rng.multinomial(n_block, np.full(n_block, 1.0 / n_block), size = size).astype(np.float64)
+        else:
+            weights = rng.poisson(1.0, size = (size, n_block)).astype(np.float64)
+
+        for name, flat in forecasts.items():
+            for score, values in get_scores(weights @ flat).items():
+                boot[name][score].append(values)
+
+    result = []
+    full = {name: get_scores(flat.sum(axis = 0)) for name, flat in forecasts.items()}
+    boot = {name: {score: np.concatenate(values, axis = 0) for score, values in item.items()} for name, item in boot.items()}
+    if counts_b is not None:
+        full['a-b'] = {score: full['a'][score] - full['b'][score] for score in scores}
+        boot['a-b'] = {score: boot['a'][score] - boot['b'][score] for score in scores}
+
+    for name in full:
+        for score in scores:
+            with np.errstate(invalid = 'ignore'):
+                lower, upper = np.nanpercentile(boot[name][score], [100 * alpha / 2, 100 * (1 - alpha / 2)], axis = 0)
+                std = np.nanstd(boot[name][score], axis = 0)
+            for i in range(n_threshold):
+                result.append([name, thresholds[i], score, full[name][score][i], lower[i], upper[i], std[i]])
+
+    return pd.DataFrame(result, columns = ['forecast', 'threshold', 'score', 'value', 'lower', 'upper', 'std'])
+
+
+def bootstrap_ci(obs, pre, blocks, thresholds = [0.1, 5,10,15,20,25,30,35,40], pre_b = None, **kwargs):
+    '''
+    func: 块bootstrap置信区间
+    inputs:
+        obs: 观测值, eg: shape = (time, station)
+        pre: 预报值，与obs的shape一致, eg: 订正后的降水
+        blocks: 分块键，可以广播到obs的shape, eg: 每个时刻所在的日期 day[:, None]
+        thresholds: 阈值列表
+        pre_b: 另一个预报(eg: EC原始降水)，默认None；给定时计算配对差的置信区间
+        kwargs: 传给 bootstrap_scores() 的其他参数(scores, n_boot, method, alpha, seed)
+    return:
+        见 bootstrap_scores()
+    '''
+    counts_b = None
+    if pre_b is not None:
+        #两个预报只使用二者都不为nan的样本，保证配对
+        pre_b = np.asarray(pre_b, dtype = np.float64)
+        obs = np.where(np.isnan(np.asarray(pre, dtype = np.float64)) | np.isnan(pre_b), np.nan, obs)
+        counts_b, _ = grouped_clf(obs, pre_b, blocks, thresholds)
+    counts, _ = grouped_clf(obs, pre, blocks, thresholds)
+
+    return bootstrap_scores(counts, counts_b, thresholds = thresholds, **kwargs)
+
+
+def summed_area_table(binary):
+    '''
+    func: 计算二值场的积分图(summed-area table)
+    inputs:
+        binary: np.array, shape = (..., ny, nx)
+    return:
+        sat: np.array, int64, shape = (..., ny + 1, nx + 1),
+             sat[..., i, j] = binary[..., :i, :j].sum(), 第0行和第0列为0
+    '''
+    binary = np.asarray(binary)
+    shape = binary.shape[:-2] + (binary.shape[-2] + 1, binary.shape[-1] + 1)
+
+    sat = np.zeros(shape, dtype = np.int64)
+    sat[..., 1:, 1:] = binary
+    sat = np.cumsum(np.cumsum(sat, axis = -2, out = sat), axis = -1, out = sat)
+
+    return sat
+
+
+def neighborhood_fraction(sat, window):
+    '''
+    func: 由积分图计算每个格点的邻域事件比例(以该格点为中心，window × window的窗口)，
+          窗口中超出边界的部分按没有事件处理，比例的分母总是 window*window
+          每个格点只需积分图中4个点的加减，与窗口大小无关
+    inputs:
+        sat: summed_area_table() 的输出, shape = (..., ny + 1, nx + 1)
+        window: 窗口大小(格点数)，奇数, eg: 1, 3, 5, 11
+    return:
+        np.array, float64, shape = (..., ny, nx)
+    '''
+    if window % 2 != 1:
+        raise ValueError('window must be odd, got {}'.format(window))
+
+    ny, nx = sat.shape[-2] - 1, sat.shape[-1] - 1
+    half = window // 2
+
+    #窗口在积分图中的上下左右边界(截断到边界内)
+    top = np.clip(np.arange(ny) - half, 0, ny)
+    bottom = np.clip(np.arange(ny) + half + 1, 0, ny)
+    left = np.clip(np.arange(nx) - half, 0, nx)
+    right = np.clip(np.arange(nx) + half + 1, 0, nx)
+
+    count = (sat[..., bottom[:, None], right[None, :]] - sat[..., top[:, None], right[None, :]]
+             - sat[..., bottom[:, None], left[None, :]] + sat[..., top[:, None], left[None, :]])
+
+    return count / float(window * window)
+
+
+@perf.timed()
+def fss_matrix(obs, pre, thresholds = [0.1, 5,10,20], windows = [1,3,5,9,17,33], chunk_size = 24,
+               return_sums = False):
+    '''
+    func: 格点场的FSS(Fractions Skill Score)邻域检验
+          FSS = 1 - sum((Pf - Po)^2) / (sum(Pf^2) + sum(Po^2))，Pf/Po为预报/观测的邻域事件比例，
+          求和范围为所有时刻的所有格点(即整个时段的综合FSS)
+          每个阈值的二值场只计算一次积分图，所有窗口大小的邻域比例都由同一个积分图得到
+    inputs:
+        obs: 观测格点场, shape = (ny, nx) 或 (time, ny, nx), eg: interp2d_station_to_grid 插值得到的站点观测
+        pre: 预报格点场, 与obs的shape一致, eg: EC TP / SMS APCP
+        thresholds: 阈值列表
+        windows: 窗口大小列表(格点数, 奇数)
+        chunk_size: 每次处理的时刻数，控制内存，默认24
+        return_sums: 是否同时返回分子分母的累加值，便于分批计算后再合并, 默认False
+    return:
+        pd.DataFrame, index为窗口大小(window)，columns为阈值(threshold)
+        return_sums为True时，返回 (fss, num, den)，num/den为 np.array, shape = (n_window, n_threshold),
+        多批的 num/den 分别相加后，FSS = 1 - num/den
+        obs或pre为nan的格点不参与求和，在邻域中按没有事件处理
+    '''
+    obs = np.asarray(obs, dtype = np.float64)
+    pre = np.asarray(pre, dtype = np.float64)
+    if obs.shape != pre.shape:
+        raise ValueError('obs shape {} is not equal with pre shape {}'.format(obs.shape, pre.shape))
+    if obs.ndim == 2:
+        obs = obs[None]
+        pre = pre[None]
+
+    thresholds = list(thresholds)
+    windows = list(windows)
+    num = np.zeros((len(windows), len(thresholds)))
+    den = np.zeros((len(windows), len(thresholds)))
+
+    for start in range(0, obs.shape[0], chunk_size):
+        o = obs[start:start + chunk_size]
+        p = pre[start:start + chunk_size]
+        valid = ~(np.isnan(o) | np.isnan(p))
+
+        for j, threshold in enumerate(thresholds):
+            with np.errstate(invalid = 'ignore'):
+                sat_o = summed_area_table((o >= threshold) & valid)
+                sat_p = summed_area_table((p >= threshold) & valid)
+
+            for i, window in enumerate(windows):
+                fraction_o = neighborhood_fraction(sat_o, window)[valid]
+                fraction_p = neighborhood_fraction(sat_p, window)[valid]
+                num[i, j] += np.sum(np.square(fraction_p - fraction_o))
+                den[i, j] += np.sum(np.square(fraction_p)) + np.sum(np.square(fraction_o))
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        fss = pd.DataFrame(1 - num / den, index = pd.Index(windows, name = 'window'),
+                           columns = pd.Index(thresholds, name = 'threshold'))
+
+    if return_sums:
+        return fss, num, den
+
+    return fss
+
+
+#地球半径，km
+earth_radius = 6371.0
+
+
+def lon_lat_to_xyz(lon, lat):
+    '''
+    func: 经纬度转换为单位球面上的三维坐标，球面上的距离越近，三维空间中的(弦)距离越近
+    '''
+    lon = np.radians(np.asarray(lon, dtype = np.float64))
+    lat = np.radians(np.asarray(lat, dtype = np.float64))
+
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis = -1)
+
+
+class StationNeighbors():
+    '''
+    func: 站点的邻近站点列表。只在初始化时计算一次(KD树)，以CSR格式的稀疏index数组保存:
+          第i个站点的邻近站点(包括自身)为 indices[indptr[i]:indptr[i+1]]
+          之后每个时刻、每个阈值的邻域计算都只是对这两个数组的索引
+    Parameter
+    ----------------------------
+    lon, lat: np.array
+        所有站点的经纬度，顺序与检验数据中的站点顺序一致
+    radius: float or None
+        邻域半径，km, eg: 20
+    k: int or None
+        最近的k个站点(包括自身)。radius 和 k 必须且只能给定一个
+    station_num: list or None
+        站点号，仅用于记录
+
+    用法:
+        neighbors = StationNeighbors.from_station_file(all_station_file, radius = 20)
+        scores = neighborhood_scores(obs, pre, neighbors, thresholds = [0.1, 10, 20])  #obs.shape = (time, 4343)
+    '''
+    def __init__(self, lon, lat, radius = None, k = None, station_num = None):
+
+        if (radius is None) == (k is None):
+            raise ValueError('one and only one of radius and k must be given')
+
+        self.radius = radius
+        self.k = k
+        self.station_num = station_num
+
+        xyz = lon_lat_to_xyz(lon, lat)
+        tree = cKDTree(xyz)
+        n_station = len(xyz)
+
+        if radius is not None:
+            #球面距离radius对应的弦长
+            chord = 2 * np.sin(float(radius) / earth_radius / 2)
+            neighbor_list = tree.query_ball_point(xyz, r = chord)
+            counts = np.array([len(item) for item in neighbor_list], dtype = np.int64)
+            self.indices = np.concatenate([np.sort(item) for item in neighbor_list]).astype(np.int64)
+        else:
+            k = min(int(k), n_station)
+            _, index = tree.query(xyz, k = k)
+            index = np.asarray(index, dtype = np.int64).reshape(n_station, k)
+            
+            #有经纬度完全相同的站点时，最近的k个可能不包括自身，用自身代替第k个
+            own = np.arange(n_station)
+            has_self = np.any(index == own[:, None], axis = 1)
+            index[~has_self, -1] = own[~has_self]
+            counts = np.full(n_station, k, dtype = np.int64)
+            self.indices = index.reshape(-1)
+
+        self.indptr = np.zeros(n_station + 1, dtype = np.int64)
+        self.indptr[1:] = np.cumsum(counts)
+
+    @classmethod
+    def from_station_file(cls, all_station_file = 'D:/zhongqi/ori_data/all_jiami_station_lon_lat_alt.csv',
+                          radius = None, k = None):
+        '''
+        func: 由站点文件(all_jiami_station_lon_lat_alt.csv)构建，站点顺序与站点文件一致
+        '''
+        #进程内共享的站点表，同一个站点文件只读取一次
+        catalog = StationCatalog.load(all_station_file)
+
+        return cls(catalog.lon, catalog.lat, radius = radius, k = k, station_num = catalog.station_num)
+
+    @property
+    def n_station(self):
+        return len(self.indptr) - 1
+
+    def counts(self):
+        '''
+        func: 每个站点的邻近站点个数(包括自身)
+        '''
+        return np.diff(self.indptr)
+
+    def neighbor_max(self, values):
+        '''
+        func: 每个站点邻域内的最大值，nan不参与计算(邻域内全为nan时为 -inf)
+        inputs:
+            values: np.array, shape = (..., n_station)
+        return:
+            np.array, shape = (..., n_station)
+        '''
+        values = np.asarray(values, dtype = np.float64)
+        values = np.where(np.isnan(values), -np.inf, values)
+
+        return np.maximum.reduceat(values[..., self.indices], self.indptr[:-1], axis = -1)
+
+
+def neighborhood_clf(obs, pre, neighbors, thresholds = [0.1, 5,10,15,20,25,30,35,40]):
+    '''
+    func: 站点邻域检验的混淆矩阵。对每个站点(obs和pre都不为nan):
+              预报有降水: 邻域内任一站点观测 >= 阈值为 hits，否则为 falsealarms
+              预报无降水: 本站观测 >= 阈值，且邻域内所有站点的预报都 < 阈值，为 misses; 否则为 correctnegatives
+          邻域只有自身时(radius很小 或 k = 1)，与 prep_clf 的结果一致
+    inputs:
+        obs: 观测值, shape = (..., n_station), eg: (time, 4343)
+        pre: 预测值，与obs的shape一致
+        neighbors: StationNeighbors，站点顺序与obs最后一维一致
+        thresholds: 阈值列表
+    return:
+        hits, misses, falsealarms, correctnegatives: np.array, shape = (len(thresholds),)
+    '''
+    obs = np.asarray(obs, dtype = np.float64)
+    pre = np.asarray(pre, dtype = np.float64)
+    if obs.shape != pre.shape:
+        raise ValueError('obs shape {} is not equal with pre shape {}'.format(obs.shape, pre.shape))
+    if obs.shape[-1] != neighbors.n_station:
+        raise ValueError('obs has {} stations, neighbors has {}'.format(obs.shape[-1], neighbors.n_station))
+
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype = np.float64))
+
+    #邻域最大值与阈值无关，只计算一次
+    obs_max = neighbors.neighbor_max(obs)
+    pre_max = neighbors.neighbor_max(pre)
+
+    valid = ~(np.isnan(obs) | np.isnan(pre))
+    obs, pre, obs_max, pre_max = obs[valid], pre[valid], obs_max[valid], pre_max[valid]
+
+    hits = np.zeros(len(thresholds), dtype = np.int64)
+    misses = np.zeros(len(thresholds), dtype = np.int64)
+    falsealarms = np.zeros(len(thresholds), dtype = np.int64)
+
+    for i, threshold in enumerate(thresholds):
+        pre_yes = pre >= threshold
+        obs_near = obs_max >= threshold
+
+        hits[i] = np.count_nonzero(pre_yes & obs_near)
+        falsealarms[i] = np.count_nonzero(pre_yes & ~obs_near)
+        misses[i] = np.count_nonzero(~pre_yes & (obs >= threshold) & (pre_max < threshold))
+
+    correctnegatives = obs.size - hits - misses - falsealarms
+
+    return hits, misses, falsealarms, correctnegatives
+
+
+@perf.timed()
+def neighborhood_scores(obs, pre, neighbors, thresholds = [0.1, 5,10,15,20,25,30,35,40]):
+    '''
+    func: 站点邻域检验的混淆矩阵和所有评分
+    return:
+        pd.DataFrame, 与 All_utils_funs.multi_threshold_scores() 的格式一致
+    '''
+    hits, misses, falsealarms, correctnegatives = neighborhood_clf(obs, pre, neighbors, thresholds)
+
+    scores = pd.DataFrame({'hits': hits, 'misses': misses,
+                           'falsealarms': falsealarms, 'correctnegatives': correctnegatives},
+                          index = pd.Index(np.atleast_1d(thresholds), name = 'threshold'))
+    for name, score in clf_scores(hits, misses, falsealarms, correctnegatives).items():
+        scores[name] = score
+
+    return scores
+
+
+def label_objects(field, threshold, min_area = 1, connectivity = 8):
+    '''
+    func: 标记降水对象，即 field >= threshold 的连通区域
+    inputs:
+        field: 降水格点场, shape = (ny, nx), nan按无降水处理
+        threshold: 阈值, eg: 20
+        min_area: 最小面积(格点数)，小于该面积的对象被去掉，默认1
+        connectivity: 4 或 8(默认)，连通方式
+    return:
+        labels: np.array, int32, shape = (ny, nx)，0为背景，对象编号为 1 ~ n
+        n: 对象个数
+    '''
+    field = np.asarray(field, dtype = np.float64)
+    with np.errstate(invalid = 'ignore'):
+        binary = field >= threshold
+
+    structure = np.ones((3,3), dtype = bool) if connectivity == 8 else None
+    labels, n = ndimage.label(binary, structure = structure)
+
+    if min_area > 1 and n > 0:
+        area = np.bincount(labels.ravel(), minlength = n + 1)
+        keep = area >= min_area
+        keep[0] = False
+        #重新编号为 1 ~ n
+        new_index = np.zeros(n + 1, dtype = labels.dtype)
+        new_index[keep] = np.arange(1, np.count_nonzero(keep) + 1)
+        labels = new_index[labels]
+        n = int(np.count_nonzero(keep))
+
+    return labels, n
+
+
+def object_attributes(field, labels, n, lon_grid = None, lat_grid = None, quantiles = [0.5, 0.9]):
+    '''
+    func: 计算每个降水对象的属性，所有对象一次向量化计算(ndimage的分组统计 + 一次排序得到分位数)
+    inputs:
+        field: 降水格点场, shape = (ny, nx)
+        labels, n: label_objects() 的输出
+        lon_grid, lat_grid: 格点的经纬度, shape = (ny, nx)，默认None，即不计算质心的经纬度
+        quantiles: 对象内降水强度的分位数，默认[0.5, 0.9]
+    return:
+        pd.DataFrame, 每行为一个对象, columns为
+            ['label','area','centroid_y','centroid_x',('centroid_lon','centroid_lat'),
+             'mean','max','sum', 'q50','q90'...]
+            centroid_y/centroid_x为格点index(行/列)意义下的质心
+    '''
+    columns = ['label', 'area', 'centroid_y', 'centroid_x']
+    if lon_grid is not None:
+        columns += ['centroid_lon', 'centroid_lat']
+    columns += ['mean', 'max', 'sum'] + ['q{}'.format(int(round(q * 100))) for q in quantiles]
+
+    if n == 0:
+        return pd.DataFrame(columns = columns)
+
+    field = np.asarray(field, dtype = np.float64)
+    index = np.arange(1, n + 1)
+
+    attrs = {'label': index}
+    attrs['area'] = np.bincount(labels.ravel(), minlength = n + 1)[1:]
+
+    yy, xx = np.indices(labels.shape)
+    attrs['centroid_y'] = np.asarray(ndimage.mean(yy, labels, index))
+    attrs['centroid_x'] = np.asarray(ndimage.mean(xx, labels, index))
+    if lon_grid is not None:
+        attrs['centroid_lon'] = np.asarray(ndimage.mean(np.asarray(lon_grid), labels, index))
+        attrs['centroid_lat'] = np.asarray(ndimage.mean(np.asarray(lat_grid), labels, index))
+
+    attrs['mean'] = np.asarray(ndimage.mean(field, labels, index))
+    attrs['max'] = np.asarray(ndimage.maximum(field, labels, index))
+    attrs['sum'] = np.asarray(ndimage.sum(field, labels, index))
+
+    #分位数: 所有对象内的格点按 (对象编号, 降水值) 排序一次，每个对象的格点连续排列
+    in_object = labels > 0
+    object_label = labels[in_object]
+    values = field[in_object]
+    order = np.lexsort((values, object_label))
+    values = values[order]
+
+    area = attrs['area']
+    start = np.concatenate([[0], np.cumsum(area)[:-1]])
+    for q in quantiles:
+        #与 np.quantile 默认的线性插值一致
+        position = start + q * (area - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, start + area - 1)
+        attrs['q{}'.format(int(round(q * 100)))] = values[low] + (values[high] - values[low]) * (position - low)
+
+    return pd.DataFrame(attrs)[columns]
+
+
+def match_objects(obs_attrs, pre_attrs, max_distance = 10, use_lon_lat = False):
+    '''
+    func: 将预报对象与观测对象一一匹配。以质心距离为代价，用匈牙利算法求总距离最小的匹配，
+          距离大于max_distance的不匹配
+    inputs:
+        obs_attrs, pre_attrs: object_attributes() 的输出
+        max_distance: 最大匹配距离，默认10(格点数); use_lon_lat为True时单位为km
+        use_lon_lat: 是否使用质心经纬度计算距离(球面距离，km)，默认False，即使用格点index
+    return:
+        pd.DataFrame, 每行为一对匹配的对象，columns为
+            ['obs_label','pre_label','distance','dy','dx','area_ratio','mean_ratio','max_ratio']
+            dy/dx为预报相对观测的位移(格点数, 或使用经纬度时为 纬度/经度 差)，
+            area_ratio/mean_ratio/max_ratio为 预报/观测
+    '''
+    columns = ['obs_label', 'pre_label', 'distance', 'dy', 'dx', 'area_ratio', 'mean_ratio', 'max_ratio']
+    if len(obs_attrs) == 0 or len(pre_attrs) == 0:
+        return pd.DataFrame(columns = columns)
+
+    if use_lon_lat:
+        obs_xyz = lon_lat_to_xyz(obs_attrs['centroid_lon'].values, obs_attrs['centroid_lat'].values)
+        pre_xyz = lon_lat_to_xyz(pre_attrs['centroid_lon'].values, pre_attrs['centroid_lat'].values)
+        chord = np.sqrt(np.sum(np.square(obs_xyz[:, None] - pre_xyz[None]), axis = -1))
+        distance = 2 * earth_radius * np.arcsin(np.clip(chord / 2, 0, 1))
+        dy = pre_attrs['centroid_lat'].values[None] - obs_attrs['centroid_lat'].values[:, None]
+        dx = pre_attrs['centroid_lon'].values[None] - obs_attrs['centroid_lon'].values[:, None]
+    else:
+        dy = pre_attrs['centroid_y'].values[None] - obs_attrs['centroid_y'].values[:, None]
+        dx = pre_attrs['centroid_x'].values[None] - obs_attrs['centroid_x'].values[:, None]
+        distance = np.sqrt(dy * dy + dx * dx)
+
+    #超过最大距离的配对代价设为很大的值，匹配后再去掉
+    cost = np.where(distance <= max_distance, distance, 1e12)
+    row, col = linear_sum_assignment(cost)
+    keep = distance[row, col] <= max_distance
+    row, col = row[keep], col[keep]
+
+    obs_sel = obs_attrs.iloc[row]
+    pre_sel = pre_attrs.iloc[col]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        pairs = pd.DataFrame({'obs_label': obs_sel['label'].values,
+                              'pre_label': pre_sel['label'].values,
+                              'distance': distance[row, col],
+                              'dy': dy[row, col],
+                              'dx': dx[row, col],
+                              'area_ratio': pre_sel['area'].values / obs_sel['area'].values,
+                              'mean_ratio': pre_sel['mean'].values / obs_sel['mean'].values,
+                              'max_ratio': pre_sel['max'].values / obs_sel['max'].values})
+
+    return pairs[columns]
+
+
+@perf.timed()
+def object_verify(obs, pre, threshold, min_area = 4, max_distance = 10,
+                  lon_grid = None, lat_grid = None, quantiles = [0.5, 0.9], connectivity = 8):
+    '''
+    func: 基于对象的检验(一个时刻)。标记观测和预报场中的降水对象，计算对象属性并匹配
+    inputs:
+        obs: 观测格点场, shape = (ny, nx), eg: interp2d_station_to_grid 插值得到的站点观测
+        pre: 预报格点场, 与obs的shape一致, eg: EC TP / SMS APCP / 订正后的降水
+        threshold: 阈值, eg: 20
+        min_area: 最小对象面积(格点数)，默认4
+        max_distance: 最大匹配距离，默认10; 给定lon_grid/lat_grid时单位为km
+        lon_grid, lat_grid: 格点经纬度，默认None
+        quantiles: 强度分位数
+        connectivity: 4 或 8(默认)
+    return:
+        summary: dict, {'n_obs','n_pre','n_matched','POD','FAR','mean_distance','mean_area_ratio'}
+                 POD = 匹配的观测对象数/观测对象数, FAR = 未匹配的预报对象数/预报对象数
+        pairs: match_objects() 的输出
+        obs_attrs, pre_attrs: object_attributes() 的输出
+
+    用法(逐时刻检验整个季节):
+        results = [object_verify(obs[t], pre[t], 20)[0] for t in range(len(obs))]
+        pd.DataFrame(results)
+    '''
+    obs_labels, n_obs = label_objects(obs, threshold, min_area, connectivity)
+    pre_labels, n_pre = label_objects(pre, threshold, min_area, connectivity)
+
+    obs_attrs = object_attributes(obs, obs_labels, n_obs, lon_grid, lat_grid, quantiles)
+    pre_attrs = object_attributes(pre, pre_labels, n_pre, lon_grid, lat_grid, quantiles)
+
+    pairs = match_objects(obs_attrs, pre_attrs, max_distance, use_lon_lat = lon_grid is not None)
+    n_matched = len(pairs)
+
+    summary = {'n_obs': n_obs, 'n_pre': n_pre, 'n_matched': n_matched,
+               'POD': n_matched / n_obs if n_obs > 0 else np.nan,
+               'FAR': (n_pre - n_matched) / n_pre if n_pre > 0 else np.nan,
+               'mean_distance': float(pairs['distance'].mean()) if n_matched > 0 else np.nan,
+               'mean_area_ratio': float(pairs['area_ratio'].mean()) if n_matched > 0 else np.nan}
+
+    return summary, pairs, obs_attrs, pre_attrs